@@ -0,0 +1,457 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+# Render without a window. The dummy video driver still allows a display mode, which loading sprites needs
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pygame
+from pygame import Surface, Vector2
+
+from benchmarks.scenarios import SCENARIOS
+from controller.controller import ControllerOptions, GameController, ModelBackend
+from controller.headless import ScriptedKeys
+from model.entities.entity_arrays import COLUMNS
+from model.entities.gameentity import GameEntity
+from model.utils.assets import asset_cache
+from model.utils.compiled_kernels import NUMBA_AVAILABLE
+from model.utils.sprite_rotations import rotation_cache
+from model.world.array_model import ArraySpatialPartitioningModel, KernelBackend
+from model.world.cell_index import CellIndex
+from model.world.flock_aggregates import ApproximationMode
+from model.world.snapshot import load_snapshot, save_snapshot
+from model.world.spatial_partitioning_model import (
+    GridMode,
+    SpatialPartitioningModel,
+    UpdateMode,
+)
+from view.view import View
+
+world_width = 6400.0
+world_height = 6400.0
+cell_size = 128.0
+background_color = (0, 0, 0)
+screen_size = (1920, 1080)
+
+# Backend name -> ControllerOptions keyword arguments
+BACKENDS: dict[str, dict] = {
+    "object": {},
+    "object-index": {"grid_mode": GridMode.SORTED_INDEX},
+    "object-blocked": {"update_mode": UpdateMode.CELL_BLOCKED},
+    "object-index-blocked": {
+        "grid_mode": GridMode.SORTED_INDEX,
+        "update_mode": UpdateMode.CELL_BLOCKED,
+    },
+    "array": {"model_backend": ModelBackend.ARRAY},
+    "array-numpy": {
+        "model_backend": ModelBackend.ARRAY,
+        "kernel_backend": KernelBackend.NUMPY,
+    },
+    "parallel": {"model_backend": ModelBackend.PARALLEL},
+    "object-lod": {"lod_near_cells": 2},
+    "array-lod": {"model_backend": ModelBackend.ARRAY, "lod_near_cells": 2},
+    "array-collisions": {"model_backend": ModelBackend.ARRAY, "collisions": True},
+    "object-aggregates": {"flocking_approximation": ApproximationMode.CELL_AGGREGATES},
+    # Also computes the exact forces to record the approximation error, so it is slower than object-aggregates
+    "object-approx": {
+        "flocking_approximation": ApproximationMode.MEASURE_ERROR,
+        "approximation_tolerance": 0.3,
+    },
+}
+
+# Cases with more neighbor pairs than this are skipped, so that a full run finishes in minutes. Pairs are estimated from the number of entities in every 3x3 cell neighborhood
+MAX_PAIRS: dict[str, float] = {
+    "object": 2e6,
+    "object-index": 2e6,
+    "object-blocked": 4e6,
+    "object-index-blocked": 4e6,
+    "array": 2e8 if NUMBA_AVAILABLE else 2e7,
+    "array-numpy": 2e7,
+    "parallel": 2e8 if NUMBA_AVAILABLE else 2e7,
+    "object-lod": 2e6,
+    "array-lod": 2e8 if NUMBA_AVAILABLE else 2e7,
+    "array-collisions": 2e8 if NUMBA_AVAILABLE else 2e7,
+    "object-aggregates": 2e6,
+    "object-approx": 1e6,
+}
+
+
+def estimate_pairs(model: SpatialPartitioningModel) -> int:
+    """
+    Estimates how many neighbor pairs a frame checks: every entity against every entity in its 3x3 cell neighborhood, within each grid level.
+    Only occupied cells are visited, so this is cheap for huge worlds too
+    """
+    # Entity count by (row, column) of every occupied cell, and the grid size, of every level
+    level_counts: list[tuple[dict[tuple[int, int], int], int, int]] = []
+    if model.grid_mode == GridMode.SORTED_INDEX:
+        model.ensure_cell_index()
+        index: CellIndex = model.cell_index
+        level_counts.append(
+            (
+                dict(
+                    zip(
+                        zip(
+                            (index.cell_keys // model.grid_width).tolist(),
+                            (index.cell_keys % model.grid_width).tolist(),
+                        ),
+                        index.cell_count.tolist(),
+                    )
+                ),
+                model.grid_height,
+                model.grid_width,
+            )
+        )
+    else:
+        for level in model.levels.values():
+            level_counts.append(
+                (
+                    {
+                        key: len(cell.get_entities())
+                        for key, cell in level.cells.items()
+                    },
+                    level.grid_height,
+                    level.grid_width,
+                )
+            )
+    pairs: int = 0
+    for counts, grid_height, grid_width in level_counts:
+        for (r, c), count in counts.items():
+            pairs += count * sum(
+                counts.get(((r + dr) % grid_height, (c + dc) % grid_width), 0)
+                for dr in range(-1, 2)
+                for dc in range(-1, 2)
+            )
+    return pairs
+
+
+def get_entity_bytes(model: SpatialPartitioningModel, sample_size: int = 1000) -> float:
+    """
+    Average bytes used per entity: the GameEntity objects (see GameEntity.get_byte_size, averaged over a sample), plus one row of every entity array column for the array backends
+    """
+    entities: list[GameEntity] = model.get_all_entities()
+    if not entities:
+        return 0.0
+    step: int = max(1, len(entities) // sample_size)
+    sample: list[GameEntity] = entities[::step]
+    size: float = sum(entity.get_byte_size() for entity in sample) / len(sample)
+    if isinstance(model, ArraySpatialPartitioningModel):
+        size += sum(
+            int(np.prod(row_shape)) * np.dtype(dtype).itemsize
+            for row_shape, dtype in COLUMNS.values()
+        )
+    return size
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """
+    Summary statistics in milliseconds of a list of durations in seconds
+    """
+    return {
+        "median_ms": statistics.median(samples) * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "min_ms": min(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+
+def run_case(
+    scenario: str,
+    size: int,
+    backend: str,
+    frames: int,
+    warmup_frames: int,
+    seed: int,
+    max_pairs: float | None,
+    snapshot_dir: str | None = None,
+) -> dict:
+    """
+    Builds one scenario with one backend, runs it for warmup_frames + frames frames and returns the timings of every update_model phase, the render path and apply_forces_to_entity
+    :param snapshot_dir: Directory of world snapshots to use as fixed inputs. The world of a scenario, size and seed is loaded from there if it has been saved before, otherwise it is built and saved
+    """
+    result: dict = {"scenario": scenario, "size": size, "backend": backend}
+    snapshot_path: str | None = None
+    if snapshot_dir is not None:
+        snapshot_path = os.path.join(
+            snapshot_dir, "{}_{}_{}.snapshot".format(scenario, size, seed)
+        )
+        result["snapshot"] = snapshot_path
+    options: ControllerOptions = ControllerOptions(
+        world_width,
+        world_height,
+        cell_size,
+        background_color,
+        seed=seed,
+        **BACKENDS[backend],
+    )
+    controller: GameController = GameController(
+        options, View(background_color, Surface(screen_size))
+    )
+    model: SpatialPartitioningModel = controller.model
+    try:
+        start: float = time.perf_counter()
+        loaded: bool = snapshot_path is not None and os.path.exists(snapshot_path)
+        if loaded:
+            load_snapshot(model, snapshot_path)
+        else:
+            SCENARIOS[scenario](model, size)
+        model.ensure_cell_index()
+        result["build_s"] = time.perf_counter() - start
+        if snapshot_path is not None and not loaded:
+            os.makedirs(snapshot_dir, exist_ok=True)
+            save_snapshot(model, snapshot_path)
+        pairs: int = estimate_pairs(model)
+        result["estimated_pairs"] = pairs
+        limit: float = max_pairs if max_pairs is not None else MAX_PAIRS[backend]
+        if pairs > limit:
+            result["skipped"] = (
+                "about "
+                + str(pairs)
+                + " neighbor pairs is over the limit of "
+                + str(int(limit))
+            )
+            return result
+
+        controller.dt = 1 / 60
+        mouse_pos: Vector2 = Vector2(world_width / 2, world_height / 2)
+        keys: ScriptedKeys = ScriptedKeys()
+        phase_samples: dict[str, list[float]] = {}
+        update_samples: list[float] = []
+        render_samples: list[float] = []
+        for frame in range(warmup_frames + frames):
+            update_time: float = 0.0
+            for name, phase in model.get_update_phases(controller.dt, mouse_pos, keys):
+                start = time.perf_counter()
+                phase()
+                elapsed: float = time.perf_counter() - start
+                update_time += elapsed
+                if frame >= warmup_frames:
+                    phase_samples.setdefault(name, []).append(elapsed)
+            start = time.perf_counter()
+            controller.draw_background()
+            controller.draw_game_entities()
+            render_time: float = time.perf_counter() - start
+            if frame >= warmup_frames:
+                update_samples.append(update_time)
+                render_samples.append(render_time)
+        result["frames"] = frames
+        result["phases"] = {
+            name: summarize(samples) for name, samples in phase_samples.items()
+        }
+        result["phases"]["update_model"] = summarize(update_samples)
+        result["phases"]["render"] = summarize(render_samples)
+        result["sprite_rotations"] = rotation_cache.get_report()
+        result["assets"] = asset_cache.get_report()
+        result["tier_counts"] = model.tier_counts
+        if model.approximation_error.entity_count:
+            error = model.approximation_error
+            result["approximation_error"] = {
+                "max": error.max_error,
+                "mean": error.mean_error,
+                "max_acceleration": error.max_acceleration,
+            }
+        result["grid_cells"] = len(model.grid_cells)
+        result["entity_bytes"] = get_entity_bytes(model)
+        result["background_bytes"] = model.background_palette.get_byte_size()
+
+        # Cost of one apply_forces_to_entity call, measured last because it adds forces outside of a frame
+        sample: list[GameEntity] = model.get_entities_in_camera_range()[:500]
+        if sample:
+            start = time.perf_counter()
+            for entity in sample:
+                model.apply_forces_to_entity(entity, mouse_pos)
+            result["apply_forces_to_entity_us"] = (
+                (time.perf_counter() - start) / len(sample) * 1e6
+            )
+    finally:
+        close = getattr(model, "close", None)
+        if close is not None:
+            close()
+    return result
+
+
+def get_metadata() -> dict:
+    try:
+        commit: str | None = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    metadata: dict = {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pygame": pygame.version.ver,
+        "numba": None,
+    }
+    if NUMBA_AVAILABLE:
+        import numba
+
+        metadata["numba"] = numba.__version__
+    return metadata
+
+
+def compare_memory(baseline: dict, current: dict) -> list[str]:
+    """
+    Returns a line for every case whose bytes per entity changed between two result files
+    """
+    baseline_bytes: dict[tuple, float] = {
+        (case["scenario"], case["size"], case["backend"]): case["entity_bytes"]
+        for case in baseline["results"]
+        if "entity_bytes" in case
+    }
+    lines: list[str] = []
+    for case in current["results"]:
+        key: tuple = (case["scenario"], case["size"], case["backend"])
+        old: float | None = baseline_bytes.get(key)
+        if old is None or "entity_bytes" not in case or case["entity_bytes"] == old:
+            continue
+        lines.append(
+            "{} {} {}: {:.0f} -> {:.0f} bytes per entity ({:+.0%})".format(
+                *key, old, case["entity_bytes"], case["entity_bytes"] / old - 1
+            )
+        )
+    return lines
+
+
+def compare_results(
+    baseline: dict, current: dict, threshold: float, min_ms: float
+) -> list[str]:
+    """
+    Compares the median phase timings of two result files and returns a line for every phase that got more than threshold (a fraction) slower.\n
+    Phases faster than min_ms in the baseline are ignored, since their timings are mostly noise
+    """
+    baseline_cases: dict[tuple, dict] = {
+        (case["scenario"], case["size"], case["backend"]): case
+        for case in baseline["results"]
+    }
+    regressions: list[str] = []
+    for case in current["results"]:
+        key: tuple = (case["scenario"], case["size"], case["backend"])
+        old: dict | None = baseline_cases.get(key)
+        if old is None or "phases" not in old or "phases" not in case:
+            continue
+        for phase, timing in case["phases"].items():
+            old_timing: dict | None = old["phases"].get(phase)
+            if old_timing is None or old_timing["median_ms"] < min_ms:
+                continue
+            change: float = timing["median_ms"] / old_timing["median_ms"] - 1
+            if change > threshold:
+                regressions.append(
+                    "{} {} {} {}: {:.3f} ms -> {:.3f} ms ({:+.0%})".format(
+                        *key,
+                        phase,
+                        old_timing["median_ms"],
+                        timing["median_ms"],
+                        change,
+                    )
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Times the model and view hot paths over a set of scripted scenarios and writes the results as JSON"
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=[1000, 5000, 20000, 100000]
+    )
+    parser.add_argument(
+        "--backends", nargs="+", choices=list(BACKENDS), default=["object", "array"]
+    )
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--warmup-frames", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--max-pairs",
+        type=float,
+        default=None,
+        help="Skip cases with more estimated neighbor pairs than this. Defaults to a limit per backend",
+    )
+    parser.add_argument(
+        "--snapshot-dir",
+        default=None,
+        help="Load every world from a snapshot in this directory, saving it there the first time, so that runs use the same inputs",
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument(
+        "--compare", default=None, help="Baseline result file to compare against"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Slowdown (as a fraction) that counts as a regression",
+    )
+    parser.add_argument(
+        "--min-ms",
+        type=float,
+        default=0.1,
+        help="Ignore phases faster than this in the baseline",
+    )
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    results: dict = {"metadata": get_metadata(), "results": []}
+    for scenario in args.scenarios:
+        for size in args.sizes:
+            for backend in args.backends:
+                result: dict = run_case(
+                    scenario,
+                    size,
+                    backend,
+                    args.frames,
+                    args.warmup_frames,
+                    args.seed,
+                    args.max_pairs,
+                    args.snapshot_dir,
+                )
+                results["results"].append(result)
+                if "skipped" in result:
+                    print(scenario, size, backend, "skipped:", result["skipped"])
+                else:
+                    print(
+                        scenario,
+                        size,
+                        backend,
+                        "update {:.2f} ms, render {:.2f} ms, {:.0f} bytes per entity".format(
+                            result["phases"]["update_model"]["median_ms"],
+                            result["phases"]["render"]["median_ms"],
+                            result["entity_bytes"],
+                        ),
+                    )
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print("Wrote", args.output)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline: dict = json.load(file)
+        regressions: list[str] = compare_results(
+            baseline, results, args.threshold, args.min_ms
+        )
+        for line in compare_memory(baseline, results):
+            print("Memory:", line)
+        for line in regressions:
+            print("Regression:", line)
+        if regressions:
+            return 1
+        print("No regressions over", "{:.0%}".format(args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import math
+from typing import Callable
+
+from pygame import Vector2
+
+from model.entities.boid import FishFactory, FishTypes, FlockingParameters
+from model.world.schools import add_default_schools
+from model.world.spatial_partitioning_model import SpatialPartitioningModel
+
+
+def add_school_mix(model: SpatialPartitioningModel, size: int) -> None:
+    """
+    The school mix of main.py (10 red schools with targets, one green and one yellow school) scaled up or down to size entities
+    """
+    red_count: int = size * 500 // 1100 // 10
+    green_count: int = size * 300 // 1100
+    add_default_schools(
+        model,
+        red_count=red_count,
+        green_count=green_count,
+        yellow_count=size - red_count * 10 - green_count,
+    )
+
+
+def add_square_school(
+    model: SpatialPartitioningModel,
+    size: int,
+    side: float,
+    center: Vector2 | None = None,
+) -> None:
+    """
+    Adds one school of size entities spread over a square of the given side length, centered on the middle of the world by default
+    """
+    if center is None:
+        center = Vector2(model.world_width / 2, model.world_height / 2)
+    side = min(side, model.world_width, model.world_height)
+    school: FishFactory = FishFactory(
+        FishTypes.RED,
+        FlockingParameters(128.0, 48.0, 1.0, 1.8, 1.0, 0, None, 1.0),
+        32.0,
+        32.0,
+        200.0,
+        1.0,
+        (center.x - side / 2, center.x + side / 2),
+        (center.y - side / 2, center.y + side / 2),
+        1,
+        rng=model.rng,
+    )
+    model.add_game_entities(school.create_school(size).create_boids())
+
+
+def add_uniform(model: SpatialPartitioningModel, size: int) -> None:
+    """
+    One school spread uniformly over the whole world
+    """
+    add_square_school(model, size, max(model.world_width, model.world_height))
+
+
+def add_dense_school(model: SpatialPartitioningModel, size: int) -> None:
+    """
+    One giant school packed at about one boid per 16x16 pixels
+    """
+    add_square_school(model, size, math.sqrt(size) * 16.0)
+
+
+def add_single_cell(model: SpatialPartitioningModel, size: int) -> None:
+    """
+    Worst case clustering: every entity starts in the same grid cell
+    """
+    cell_center: Vector2 = (
+        Vector2(
+            math.floor(model.world_width / 2 / model.cell_size),
+            math.floor(model.world_height / 2 / model.cell_size),
+        )
+        + Vector2(0.5, 0.5)
+    ) * model.cell_size
+    add_square_school(model, size, model.cell_size - 1.0, cell_center)
+
+
+# Scenario name -> function that fills an empty model with that many entities
+SCENARIOS: dict[str, Callable[[SpatialPartitioningModel, int], None]] = {
+    "schools": add_school_mix,
+    "uniform": add_uniform,
+    "dense_school": add_dense_school,
+    "single_cell": add_single_cell,
+}
@@ -1,23 +1,69 @@
+import random
 import sys
 import time
+from enum import Enum
 from typing import Tuple
 
+import numpy as np
 import pygame
-from pygame import Vector2, Surface
+from pygame import Rect, Vector2, Surface
 from pygame.key import ScancodeWrapper
 from pygame.time import Clock
 
+from controller.profiler import FrameProfiler
+from controller.replay import InputRecorder, Recording, compute_checksum
 from model.entities.gameentity import GameEntity
-from model.entities.player import Turtle
-from model.world.spatial_partitioning_model import SpatialPartitioningModel
+from model.entities.player import Player, Turtle
+from model.utils.assets import AssetKey, asset_cache
+from model.world.array_model import ArraySpatialPartitioningModel, KernelBackend
+from model.world.flock_aggregates import AggregateSettings, ApproximationMode
+from model.world.lod import LodSettings
+from model.world.parallel_model import ParallelArraySpatialPartitioningModel
+from model.world.snapshot import load_snapshot, save_snapshot
+from model.world.spatial_partitioning_model import (
+    GridMode,
+    SpatialPartitioningModel,
+    UpdateMode,
+)
 from view.view import View
 
 
+class ModelBackend(Enum):
+    OBJECT = 0
+    ARRAY = 1
+    PARALLEL = 2
+
+
 class ControllerOptions:
     """
-    :param world_width: The size of the world model. This must be divisible by the grid cell size
-    :param world_height: The size of the world model. This must be divisible by the grid cell size
+    :param world_width: The size of the world model. Sizes that aren't a multiple of the grid cell size are rounded up to whole cells
+    :param world_height: The size of the world model. Sizes that aren't a multiple of the grid cell size are rounded up to whole cells
     :param grid_cell_size: The map will be divided into grids of this size. In order for flocking to work, must be at least as large as the smallest coherence radius of the boids being used
+    :param model_backend: OBJECT keeps physics state on each GameEntity. ARRAY keeps it in NumPy arrays and updates all entities with batched array operations, which scales to far more entities. PARALLEL is the ARRAY backend split across worker processes
+    :param grid_mode: How the OBJECT backend buckets entities into grid cells. The ARRAY backend always uses a sorted cell index
+    :param update_mode: How the OBJECT backend gathers neighborhoods when applying forces
+    :param kernel_backend: Which kernels the ARRAY and PARALLEL backends run. By default Numba compiled kernels are used when numba is installed
+    :param worker_count: Number of worker processes for the PARALLEL backend. Defaults to the number of CPUs
+    :param profile: Record per-phase frame timings with a FrameProfiler. F3 toggles the on-screen graph and F4 writes the recorded frames to a CSV file
+    :param profiler_capacity: Number of frames the profiler keeps
+    :param tick_rate: Simulation steps per second. The model is always advanced in steps of 1 / tick_rate seconds, however long frames take, and entities are drawn interpolated between their last two simulated positions.
+        None advances the model once per frame by the frame's duration instead
+    :param render_rate: Frames drawn per second (at most), independent of tick_rate
+    :param max_catch_up_steps: Most simulation steps run in one frame. After a longer stall the rest of the backlog is dropped, so one slow frame doesn't make the following frames slower
+    :param lod_near_cells: Turns on distance based simulation tiers (see SimulationTier): cells at most this many cells outside of the camera's view get full flocking every tick. None simulates every entity fully
+    :param lod_far_cells: Cells further than this many cells outside of the camera's view only seek their target and move. Cells in between flock every lod_mid_interval ticks
+    :param lod_mid_interval: How often mid range cells flock, in ticks
+    :param flocking_approximation: Whether the OBJECT backend sums cohesion and alignment of cells inside the cohere radius from per-cell aggregates, see ApproximationMode. Requires GridMode.CELL_LISTS
+    :param approximation_tolerance: How far past the cohere radius a cell may reach and still be summed as a whole, as a fraction of the cohere distance. 0 gives the same result as EXACT
+    :param collisions: Run a collision pass after every model update, testing the player's hitbox against the entities around it, see CollisionSystem
+    :param dirty_rects: Whether the default View only presents the changed parts of the screen while the camera is still, see View
+    :param snapshot_path: Snapshot file (see save_snapshot) to fill the model with. Its world size and cell size must match these options. In game, F5 saves the current world to a new snapshot file
+    :param seed: Seed of the model's rng (see SpatialPartitioningModel.set_seed), which the world should be populated from. None picks a random seed
+    :param record_path: File to record the input of every frame to, see InputRecorder
+    :param replay_path: Recording (see Recording) to replay instead of reading the keyboard and mouse. The model is seeded from the recording, and the game exits after its last frame.
+        The world has to be populated the same way as in the recorded run
+    :param asset_manifest: Sprites to load into asset_cache as soon as the display is set up, before the player and the world are created
+    :param preload_in_background: Load the asset manifest on a background thread instead of waiting for it. Sprites needed before the thread gets to them are loaded right away
     """
 
     def __init__(
@@ -26,56 +72,207 @@ class ControllerOptions:
         world_height: float,
         grid_cell_size: float,
         background_color: Tuple[int, int, int],
+        model_backend: ModelBackend = ModelBackend.OBJECT,
+        grid_mode: GridMode = GridMode.CELL_LISTS,
+        update_mode: UpdateMode = UpdateMode.PER_ENTITY,
+        kernel_backend: KernelBackend = KernelBackend.AUTO,
+        worker_count: int | None = None,
+        profile: bool = False,
+        profiler_capacity: int = 600,
+        tick_rate: float | None = 60.0,
+        render_rate: int = 60,
+        max_catch_up_steps: int = 5,
+        lod_near_cells: int | None = None,
+        lod_far_cells: int = 12,
+        lod_mid_interval: int = 4,
+        flocking_approximation: ApproximationMode = ApproximationMode.EXACT,
+        approximation_tolerance: float = 0.0,
+        collisions: bool = False,
+        dirty_rects: bool = True,
+        snapshot_path: str | None = None,
+        seed: int | None = None,
+        record_path: str | None = None,
+        replay_path: str | None = None,
+        asset_manifest: list[AssetKey] | None = None,
+        preload_in_background: bool = False,
     ) -> None:
         self.world_width: float = world_width
         self.world_height: float = world_height
         self.grid_cell_size: float = grid_cell_size
         self.background_color: Tuple[int, int, int] = background_color
+        self.model_backend: ModelBackend = model_backend
+        self.grid_mode: GridMode = grid_mode
+        self.update_mode: UpdateMode = update_mode
+        self.kernel_backend: KernelBackend = kernel_backend
+        self.worker_count: int | None = worker_count
+        self.profile: bool = profile
+        self.profiler_capacity: int = profiler_capacity
+        self.tick_rate: float | None = tick_rate
+        self.render_rate: int = render_rate
+        self.max_catch_up_steps: int = max_catch_up_steps
+        self.lod_near_cells: int | None = lod_near_cells
+        self.lod_far_cells: int = lod_far_cells
+        self.lod_mid_interval: int = lod_mid_interval
+        self.flocking_approximation: ApproximationMode = flocking_approximation
+        self.approximation_tolerance: float = approximation_tolerance
+        self.collisions: bool = collisions
+        self.dirty_rects: bool = dirty_rects
+        self.snapshot_path: str | None = snapshot_path
+        self.seed: int | None = seed
+        self.record_path: str | None = record_path
+        self.replay_path: str | None = replay_path
+        self.asset_manifest: list[AssetKey] | None = asset_manifest
+        self.preload_in_background: bool = preload_in_background
+
+
+def create_model(
+    options: ControllerOptions, player: Player, seed: int | None = None
+) -> SpatialPartitioningModel:
+    """
+    Builds the world model selected by the options, filled from the options' snapshot file if there is one
+    :param seed: Seed of the model's rng instead of the options' seed, for example a recording's
+    """
+    model: SpatialPartitioningModel
+    if options.model_backend == ModelBackend.PARALLEL:
+        model = ParallelArraySpatialPartitioningModel(
+            options.world_width,
+            options.world_height,
+            options.grid_cell_size,
+            player,
+            options.kernel_backend,
+            options.worker_count,
+        )
+    elif options.model_backend == ModelBackend.ARRAY:
+        model = ArraySpatialPartitioningModel(
+            options.world_width,
+            options.world_height,
+            options.grid_cell_size,
+            player,
+            options.kernel_backend,
+        )
+    else:
+        model = SpatialPartitioningModel(
+            options.world_width,
+            options.world_height,
+            options.grid_cell_size,
+            player,
+            options.grid_mode,
+            options.update_mode,
+        )
+    if seed is None:
+        seed = options.seed if options.seed is not None else random.getrandbits(63)
+    model.set_seed(seed)
+    if options.lod_near_cells is not None:
+        model.set_lod(
+            LodSettings(
+                options.lod_near_cells, options.lod_far_cells, options.lod_mid_interval
+            )
+        )
+    if options.flocking_approximation != ApproximationMode.EXACT:
+        model.set_flocking_approximation(
+            AggregateSettings(
+                options.flocking_approximation, options.approximation_tolerance
+            )
+        )
+    model.set_collisions(options.collisions)
+    if options.snapshot_path is not None:
+        # Without a display the stored sprites can't be converted, as with placeholder_surface elsewhere
+        load_snapshot(
+            model, options.snapshot_path, pygame.display.get_surface() is None
+        )
+    return model
 
 
 class GameController:
     """
     Orchestration class for running the current state of the game. Contains a model which is the simulated world and a view that is responsible for drawing on the screen.
     In the current implementation, the simulated world and the screen size are the same, but eventually the screen will only be displaying part of a larger simulation.
+    :param view: View to draw with, for example one that renders offscreen. Defaults to a full screen View
+    :param placeholder_surface: Whether the player uses a placeholder surface instead of its sprites, see Turtle
     """
 
     def __init__(
         self,
         options: ControllerOptions,
+        view: View | None = None,
+        placeholder_surface: bool = False,
     ) -> None:
         pygame.init()
-        self.view: View = View(
-            options.background_color,
+        self.view: View = (
+            view
+            if view is not None
+            else View(options.background_color, dirty_rects=options.dirty_rects)
         )
-        self.model: SpatialPartitioningModel = SpatialPartitioningModel(
-            options.world_width,
-            options.world_height,
-            options.grid_cell_size,
-            Turtle(
-                self.view.screen_width,
-                self.view.screen_height,
-                (options.world_width, options.world_height),
-            ),
+        if options.asset_manifest is not None:
+            if options.preload_in_background:
+                asset_cache.preload_in_background(options.asset_manifest)
+            else:
+                asset_cache.preload(options.asset_manifest)
+        player: Turtle = Turtle(
+            self.view.screen_width,
+            self.view.screen_height,
+            (options.world_width, options.world_height),
+            placeholder_surface,
+        )
+        # Replays read their input from the recording instead of pygame
+        self.replay: Recording | None = (
+            Recording(options.replay_path) if options.replay_path is not None else None
         )
+        self.model: SpatialPartitioningModel = create_model(
+            options, player, self.replay.seed if self.replay is not None else None
+        )
+        self.model.background_palette.convert_tiles()
+        self.recorder: InputRecorder | None = (
+            InputRecorder(options.record_path, self.model.seed)
+            if options.record_path is not None
+            else None
+        )
+        # Frames run so far, the current frame of a replay
+        self.frame: int = 0
         self.clock: Clock = pygame.time.Clock()
-        self.fps: int = 60
+        self.fps: int = options.render_rate
         self.game_start: float = -1
+        # Duration of the last frame
         self.dt: float = 0.0
-        # Used to trigger logging when dt exceeds the max value required for 60fps
-        self.max_dt: float = 0.017
+        # Used to trigger logging when dt exceeds the max value required for the render rate
+        self.max_dt: float = 1.02 / self.fps
+        # Fixed timestep. Simulation time not yet simulated is kept in the accumulator
+        self.tick_dt: float | None = (
+            1 / options.tick_rate if options.tick_rate is not None else None
+        )
+        self.max_catch_up_steps: int = options.max_catch_up_steps
+        self.accumulator: float = 0.0
+        # How far the drawn frame is between the previous and the current simulation step, from 0 to 1
+        self.interpolation_alpha: float = 1.0
+        self.dropped_steps: int = 0
         # Tracking player inputs
         self.mouse_pos: Tuple[int, int] = (0, 0)
         self.key_presses: ScancodeWrapper = ScancodeWrapper(())
+        # Profiling
+        self.profiler: FrameProfiler | None = None
+        if options.profile:
+            self.profiler = FrameProfiler(options.profiler_capacity)
+            self.model.count_statistics = True
+        self.show_profiler_overlay: bool = False
+        # The overlay text is only re-rendered every this many frames
+        self.overlay_text_interval: int = 30
+        self.overlay_text: list[Surface] = []
 
     def start_game(self):
         self.game_start = time.time()
-        # Loop frames
-        while True:
-            self.do_game_loop()
+        try:
+            # Loop frames
+            while True:
+                self.do_game_loop()
+        finally:
+            if self.recorder is not None:
+                self.recorder.close()
 
     def do_game_loop(self) -> None:
-        self.key_presses = pygame.key.get_pressed()
-        self.mouse_pos = pygame.mouse.get_pos()
+        if self.profiler is not None:
+            self.do_profiled_game_loop()
+            return
+        self.read_input()
         self.check_for_terminate()
         model_update_time = time.time()
         self.update_model()
@@ -88,52 +285,331 @@ class GameController:
         self.fps_logging(model_update_time, view_update_time)
         self.dt = self.clock.tick(self.fps) / 1000
 
+    def do_profiled_game_loop(self) -> None:
+        """
+        Same as do_game_loop, but every phase is timed by the profiler instead of printing slow frames
+        """
+        profiler: FrameProfiler = self.profiler
+        profiler.begin_frame()
+        self.read_input()
+        self.check_for_terminate()
+        steps, step_dt = self.get_simulation_steps()
+        for _ in range(steps):
+            for name, phase in self.model.get_update_phases(
+                step_dt, Vector2(self.mouse_pos), self.key_presses
+            ):
+                start: int = time.perf_counter_ns()
+                phase()
+                profiler.add_span(name, start)
+        self.end_simulation_frame(steps, step_dt)
+        start = time.perf_counter_ns()
+        self.draw_background()
+        profiler.add_span("background", start)
+        self.draw_game_entities()
+        if self.show_profiler_overlay:
+            self.draw_profiler_overlay()
+        start = time.perf_counter_ns()
+        self.view.update_screen()
+        profiler.add_span("flip", start)
+        profiler.end_frame(
+            self.model.entity_count,
+            self.model.pairs_tested,
+            self.model.cells_migrated,
+            self.model.tier_counts,
+        )
+        self.dt = self.clock.tick(self.fps) / 1000
+
+    def read_input(self) -> None:
+        """
+        Reads this frame's key state and mouse position, from pygame or from the replayed recording.
+        A replay also uses the recorded frame duration, so entities are drawn at the same interpolated positions
+        """
+        if self.replay is None:
+            self.key_presses = pygame.key.get_pressed()
+            self.mouse_pos = pygame.mouse.get_pos()
+            return
+        if self.frame >= len(self.replay):
+            print(self.replay.get_report())
+            sys.exit()
+        self.key_presses = self.replay.get_keys(self.frame)
+        self.mouse_pos = self.replay.get_mouse_pos(self.frame)
+        self.dt = self.replay.get_dt(self.frame)
+
+    def end_simulation_frame(self, steps: int, step_dt: float) -> None:
+        """
+        Records the frame's input and the resulting entity state, or checks the state against the replayed recording
+        """
+        if self.recorder is not None:
+            self.recorder.record_frame(
+                self.dt,
+                steps,
+                step_dt,
+                self.mouse_pos,
+                self.key_presses,
+                compute_checksum(self.model),
+            )
+        if self.replay is not None:
+            if not self.replay.check_frame(self.frame, compute_checksum(self.model)):
+                if len(self.replay.mismatched_frames) == 1:
+                    print("Replay diverged from the recording at frame", self.frame)
+        self.frame += 1
+
     def check_for_terminate(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 sys.exit()
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F5:
+                snapshot_path: str = time.strftime("world_%Y%m%d_%H%M%S.snapshot")
+                save_snapshot(self.model, snapshot_path)
+                print("Wrote world snapshot to", snapshot_path)
+            elif event.type == pygame.KEYDOWN and self.profiler is not None:
+                if event.key == pygame.K_F3:
+                    self.show_profiler_overlay = not self.show_profiler_overlay
+                elif event.key == pygame.K_F4:
+                    path: str = time.strftime("profile_%Y%m%d_%H%M%S.csv")
+                    self.profiler.dump_csv(path)
+                    print("Wrote profiler frames to", path)
         if self.key_presses[pygame.K_ESCAPE]:
             sys.exit()
 
     def update_model(self) -> None:
-        self.model.update_model(self.dt, Vector2(self.mouse_pos), self.key_presses)
+        steps, step_dt = self.get_simulation_steps()
+        for _ in range(steps):
+            self.model.update_model(step_dt, Vector2(self.mouse_pos), self.key_presses)
+        self.end_simulation_frame(steps, step_dt)
+
+    def get_simulation_steps(self) -> Tuple[int, float]:
+        """
+        Adds the last frame's duration to the accumulator and returns how many model updates to run this frame and the dt of each.
+        Also sets interpolation_alpha to the fraction of a step left in the accumulator afterwards.
+        A replay runs the recorded updates, even if the tick rate settings differ from the recorded run
+        """
+        if self.tick_dt is None:
+            if self.replay is not None:
+                return self.replay.get_steps(self.frame)
+            return 1, self.dt
+        self.accumulator += self.dt
+        steps: int = int(self.accumulator / self.tick_dt)
+        if steps > self.max_catch_up_steps:
+            self.dropped_steps += steps - self.max_catch_up_steps
+            steps = self.max_catch_up_steps
+            self.accumulator %= self.tick_dt
+        else:
+            self.accumulator -= steps * self.tick_dt
+        self.interpolation_alpha = self.accumulator / self.tick_dt
+        if self.replay is not None:
+            return self.replay.get_steps(self.frame)
+        return steps, self.tick_dt
 
     def draw_background(self) -> None:
-        for grid_cell in self.model.get_grid_cells_in_camera_range():
-            self.view.draw_surface(
-                grid_cell.background_surface,
-                self.convert_model_pos_to_view_pos(
-                    grid_cell.center_pos, grid_cell.background_surface
-                ),
+        """
+        Draws the grid cell backgrounds. They are kept in the view's background layer, which is only scrolled when the camera moves, so only the cells along the edges that scrolled into view are drawn
+        """
+        left, top = self.get_camera_origin()
+        # Scroll by whole pixels, in view space (y pointing down)
+        origin: Tuple[int, int] = (round(left), -round(top))
+        for region in self.view.scroll_background_layer(origin):
+            self.view.draw_background_region(
+                region, self.get_background_blit_sequence(region, origin)
             )
-
+        self.view.draw_background_layer()
         self.view.print_fps(self.clock.get_fps())
 
+    def get_background_blit_sequence(
+        self, region: Rect, origin: Tuple[int, int]
+    ) -> list[Tuple[Surface, Tuple[float, float]]]:
+        """
+        Returns (surface, top left corner) of the grid cells that overlap a region of the screen, when the top left corner of the screen is at origin in view space
+        """
+        world_top: int = -origin[1]
+        blit_sequence: list[Tuple[Surface, Tuple[float, float]]] = []
+        for grid_cell in self.model.get_grid_cells_in_range(
+            (
+                max(origin[0] + region.left, 0),
+                min(origin[0] + region.right, self.model.world_width - 1),
+            ),
+            (
+                max(world_top - region.bottom, 0),
+                min(world_top - region.top, self.model.world_height - 1),
+            ),
+        ):
+            surface: Surface = grid_cell.background_surface
+            blit_sequence.append(
+                (
+                    surface,
+                    (
+                        grid_cell.center_pos.x - origin[0] - surface.get_width() / 2,
+                        world_top - grid_cell.center_pos.y - surface.get_height() / 2,
+                    ),
+                )
+            )
+        return blit_sequence
+
     def draw_game_entities(self) -> None:
-        for entity in self.model.get_entities_in_camera_range():
-            entity_surface = entity.get_surface()
-            self.view.draw_surface(
-                entity_surface,
-                self.convert_model_pos_to_view_pos(entity.position, entity_surface),
+        """
+        Draws every entity in camera range, then the player.\n
+        All entity sprites are collected into one list, grouped by surface, and handed to the view in a single call instead of one blit call per entity.
+        With a profiler, camera culling, picking sprites (rotation) and blitting are timed separately
+        """
+        start: int = time.perf_counter_ns()
+        if isinstance(self.model, ArraySpatialPartitioningModel):
+            rows: np.ndarray = self.model.get_entity_rows_in_range(
+                *self.model.get_camera_range()
+            )
+            self.add_profiler_span("culling", start)
+            start = time.perf_counter_ns()
+            blit_sequence: list[Tuple[Surface, Tuple[float, float]]] = (
+                self.get_array_blit_sequence(rows)
             )
+        else:
+            entities: list[GameEntity] = self.model.get_entities_in_camera_range()
+            self.add_profiler_span("culling", start)
+            start = time.perf_counter_ns()
+            blit_sequence = self.get_entity_blit_sequence(entities)
+        self.add_profiler_span("rotation", start)
+        start = time.perf_counter_ns()
+        self.view.draw_surfaces(blit_sequence)
         self.view.draw_surface(
             self.model.player.get_surface(),
             self.model.player.get_camera_adjusted_position(),
         )
+        self.add_profiler_span("blit", start)
 
-    def convert_model_pos_to_view_pos(
-        self, model_pos: Vector2, blit_surface: Surface
-    ) -> Tuple[float, float]:
-        camera_pos = self.model.player.position
-        camera_w = self.model.player.camera_width
-        camera_h = self.model.player.camera_height
-        # Find the center of my object in pygame view space (inverted y-axis). 0,0 is top left corner
-        view_center_x = model_pos.x - (camera_pos.x - camera_w / 2)
-        view_center_y = (camera_pos.y + camera_h / 2) - model_pos.y
-        # Adjust to the top left corner of the object
-        view_x = view_center_x - blit_surface.get_width() / 2
-        view_y = view_center_y - blit_surface.get_height() / 2
-        return view_x, view_y
+    def get_entity_blit_sequence(
+        self, entities: list[GameEntity]
+    ) -> list[Tuple[Surface, Tuple[float, float]]]:
+        """
+        Returns (surface, top left corner) of every given entity, at its position interpolated between the last two simulation steps. Entities that share a surface are next to each other
+        """
+        left, top = self.get_camera_origin()
+        alpha: float = self.interpolation_alpha
+        interpolate: bool = alpha < 1.0
+        half_w: float = self.model.world_width / 2
+        half_h: float = self.model.world_height / 2
+        groups: dict[Surface, list[Tuple[float, float]]] = {}
+        for entity in entities:
+            entity_surface, blit_offset = entity.get_sprite()
+            x: float = entity.position.x
+            y: float = entity.position.y
+            if interpolate:
+                previous: Vector2 = entity.previous_position
+                # Entities that wrapped around the world edge are drawn where they are now
+                if abs(x - previous.x) < half_w and abs(y - previous.y) < half_h:
+                    x = previous.x + (x - previous.x) * alpha
+                    y = previous.y + (y - previous.y) * alpha
+            dest: Tuple[float, float] = (
+                x - left - blit_offset[0],
+                top - y - blit_offset[1],
+            )
+            destinations: list[Tuple[float, float]] | None = groups.get(entity_surface)
+            if destinations is None:
+                groups[entity_surface] = [dest]
+            else:
+                destinations.append(dest)
+        return [
+            (entity_surface, dest)
+            for entity_surface, destinations in groups.items()
+            for dest in destinations
+        ]
+
+    def get_array_blit_sequence(
+        self, rows: np.ndarray
+    ) -> list[Tuple[Surface, Tuple[float, float]]]:
+        """
+        Same as get_entity_blit_sequence, but for rows of the array model. Sprites and positions are worked out for all rows at once from the entity arrays,
+        so the GameEntity objects are only synced for entities without pre-rendered rotations
+        """
+        model: ArraySpatialPartitioningModel = self.model
+        left, top = self.get_camera_origin()
+        sprite_set_ids: np.ndarray = model.get_sprite_set_ids(rows)
+        position: np.ndarray = model.arrays.position[rows]
+        if self.interpolation_alpha < 1.0:
+            previous: np.ndarray = model.arrays.previous_position[rows]
+            step: np.ndarray = position - previous
+            # Entities that wrapped around the world edge are drawn where they are now
+            wrapped: np.ndarray = (
+                np.abs(step) >= (model.world_width / 2, model.world_height / 2)
+            ).any(axis=1)
+            step[wrapped] = 0.0
+            previous[wrapped] = position[wrapped]
+            position = previous + step * self.interpolation_alpha
+        velocity: np.ndarray = model.arrays.velocity[rows]
+        view_x: np.ndarray = position[:, 0] - left
+        view_y: np.ndarray = top - position[:, 1]
+        blit_sequence: list[Tuple[Surface, Tuple[float, float]]] = []
+        for sprite_set_id, rotations in enumerate(model.sprite_sets):
+            in_set: np.ndarray = np.flatnonzero(sprite_set_ids == sprite_set_id)
+            if len(in_set) == 0:
+                continue
+            steps: np.ndarray = rotations.get_steps(
+                velocity[in_set, 0], velocity[in_set, 1]
+            )
+            # Group the rows by rotation so that equal surfaces are blitted one after another
+            order: np.ndarray = np.argsort(steps, kind="stable")
+            in_set = in_set[order]
+            steps = steps[order]
+            offsets: np.ndarray = rotations.offset_array[steps]
+            blit_sequence.extend(
+                zip(
+                    map(rotations.surfaces.__getitem__, steps.tolist()),
+                    zip(
+                        (view_x[in_set] - offsets[:, 0]).tolist(),
+                        (view_y[in_set] - offsets[:, 1]).tolist(),
+                    ),
+                )
+            )
+        without_rotations: np.ndarray = rows[sprite_set_ids < 0]
+        if len(without_rotations) > 0:
+            blit_sequence.extend(
+                self.get_entity_blit_sequence(model.sync_entities(without_rotations))
+            )
+        return blit_sequence
+
+    def add_profiler_span(self, phase: str, start_ns: int) -> None:
+        if self.profiler is not None:
+            self.profiler.add_span(phase, start_ns)
+
+    def draw_profiler_overlay(self) -> None:
+        """
+        Draws the frame time graph, and p50/p95/p99 of every phase together with the last frame's counters
+        """
+        profiler: FrameProfiler = self.profiler
+        if (
+            profiler.frame_count % self.overlay_text_interval == 0
+            or not self.overlay_text
+        ):
+            lines: list[str] = ["phase: p50 / p95 / p99 ms"]
+            for name, values in profiler.get_percentiles().items():
+                lines.append(
+                    "{}: {:.2f} / {:.2f} / {:.2f}".format(name, *values.tolist())
+                )
+            for name, value in profiler.get_last_counters().items():
+                lines.append("{}: {}".format(name, value))
+            self.overlay_text = self.view.render_text_lines(lines)
+        self.view.draw_text_lines(self.overlay_text, (0, 60))
+        self.view.draw_frame_graph(
+            profiler.get_frame_ms()[-self.view.graph_width :].tolist(),
+            1000 / self.fps,
+        )
+
+    def get_camera_position(self) -> Vector2:
+        """
+        Returns the player's position interpolated between the last two simulation steps
+        """
+        player: Player = self.model.player
+        if self.interpolation_alpha >= 1.0:
+            return player.position
+        return player.previous_position.lerp(player.position, self.interpolation_alpha)
+
+    def get_camera_origin(self) -> Tuple[float, float]:
+        """
+        Returns the model position of the top left corner of the screen
+        """
+        camera_pos: Vector2 = self.get_camera_position()
+        return (
+            camera_pos.x - self.model.player.camera_width / 2,
+            camera_pos.y + self.model.player.camera_height / 2,
+        )
 
     def add_game_entity(self, entity: GameEntity) -> None:
         self.model.add_game_entity(entity)
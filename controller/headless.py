@@ -0,0 +1,141 @@
+import os
+import time
+
+import pygame
+from pygame import Vector2
+from pygame.key import ScancodeWrapper
+
+from controller.controller import ControllerOptions, create_model
+from controller.replay import Recording, compute_checksum
+from model.entities.gameentity import GameEntity
+from model.entities.player import Turtle
+from model.world.spatial_partitioning_model import SpatialPartitioningModel
+
+
+class ScriptedKeys:
+    """
+    Stand-in for the pygame.key.get_pressed() result. Indexing with a pygame key constant returns whether that key is held
+    """
+
+    def __init__(self, pressed: set[int] | None = None) -> None:
+        self.pressed: set[int] = pressed if pressed is not None else set()
+
+    def __getitem__(self, key: int) -> bool:
+        return key in self.pressed
+
+
+class ScriptedInput:
+    """
+    Player input for a headless run, decided ahead of time per frame instead of read from pygame.\n
+    Keys are held for frame ranges, and the mouse position stays where it was last moved to.
+    """
+
+    def __init__(self) -> None:
+        # (first frame, last frame, key)
+        self.key_holds: list[tuple[int, int, int]] = []
+        # frame -> mouse position from that frame on
+        self.mouse_moves: dict[int, Vector2] = {}
+
+    def hold_key(self, key: int, first_frame: int, last_frame: int) -> None:
+        """
+        Holds a key down from first_frame through last_frame (inclusive)
+        """
+        self.key_holds.append((first_frame, last_frame, key))
+
+    def move_mouse(self, frame: int, position: Vector2) -> None:
+        self.mouse_moves[frame] = Vector2(position)
+
+    def get_keys(self, frame: int) -> ScriptedKeys:
+        return ScriptedKeys(
+            {
+                key
+                for first_frame, last_frame, key in self.key_holds
+                if first_frame <= frame <= last_frame
+            }
+        )
+
+    def get_mouse_pos(self, frame: int) -> Vector2:
+        moves: list[int] = [f for f in self.mouse_moves if f <= frame]
+        if not moves:
+            return Vector2(0.0, 0.0)
+        return Vector2(self.mouse_moves[max(moves)])
+
+
+class HeadlessSimulation:
+    """
+    Runs the world model without a display, for load testing, benchmarks and offline simulation.\n
+    Nothing is drawn and no sprites are loaded. Every frame advances the model by the same fixed dt, and frames run back to back as fast as possible instead of being throttled to a frame rate.
+    Use placeholder surfaces (see add_default_schools and FishFactory) for any entities added, since loading sprites requires a display.
+    :param options: Model settings. The background color is ignored
+    :param dt: Simulated seconds per frame
+    :param scripted_input: Player input to feed the model, defaults to no input
+    :param camera_size: Camera size of the player, which decides the area get_entities_in_camera_range covers
+    """
+
+    def __init__(
+        self,
+        options: ControllerOptions,
+        dt: float = 1 / 60,
+        scripted_input: ScriptedInput | None = None,
+        camera_size: tuple[float, float] = (1920.0, 1080.0),
+    ) -> None:
+        player: Turtle = Turtle(
+            camera_size[0],
+            camera_size[1],
+            (options.world_width, options.world_height),
+            True,
+        )
+        self.model: SpatialPartitioningModel = create_model(options, player)
+        self.dt: float = dt
+        self.scripted_input: ScriptedInput = (
+            scripted_input if scripted_input is not None else ScriptedInput()
+        )
+        self.frame: int = 0
+
+    def add_game_entity(self, entity: GameEntity) -> None:
+        self.model.add_game_entity(entity)
+
+    def step(self) -> None:
+        """
+        Advances the model by one frame
+        """
+        self.model.update_model(
+            self.dt,
+            self.scripted_input.get_mouse_pos(self.frame),
+            self.scripted_input.get_keys(self.frame),
+        )
+        self.frame += 1
+
+    def run(self, frames: int) -> float:
+        """
+        Advances the model by the given number of frames and returns the wall clock time it took in seconds
+        """
+        start: float = time.perf_counter()
+        for _ in range(frames):
+            self.step()
+        return time.perf_counter() - start
+
+    def replay(self, recording: Recording, verify: bool = True) -> float:
+        """
+        Runs the recorded model updates and input of a recording and returns the wall clock time the updates took in seconds.
+        The model has to start like the recorded one: created with the recording's seed and populated the same way, before any frame is run
+        :param verify: Compare the state after every frame with the recorded checksum, see Recording.check_frame. Checksums are not included in the returned time
+        """
+        if not pygame.display.get_init():
+            # Looking keys up by key constant in the recorded state goes through SDL's keymap, which needs the video subsystem. The dummy driver provides it without a display
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+            pygame.display.init()
+        recording.mismatched_frames.clear()
+        elapsed: float = 0.0
+        for frame in range(len(recording)):
+            steps, step_dt = recording.get_steps(frame)
+            mouse_pos: Vector2 = Vector2(recording.get_mouse_pos(frame))
+            keys: ScancodeWrapper = recording.get_keys(frame)
+            start: float = time.perf_counter()
+            for _ in range(steps):
+                self.model.update_model(step_dt, mouse_pos, keys)
+            elapsed += time.perf_counter() - start
+            if verify:
+                recording.check_frame(frame, compute_checksum(self.model))
+            self.frame += 1
+        return elapsed
@@ -0,0 +1,148 @@
+import time
+
+import numpy as np
+
+# Phases of a frame, in the order they run. The first seven are the update_model phases (see SpatialPartitioningModel.get_update_phases)
+PHASES: list[str] = [
+    "spawn",
+    "index",
+    "forces",
+    "move",
+    "migrate",
+    "player",
+    "collide",
+    "culling",
+    "background",
+    "rotation",
+    "blit",
+    "flip",
+]
+
+# The last three are the number of entities simulated at each SimulationTier
+COUNTERS: list[str] = [
+    "entities_updated",
+    "pairs_tested",
+    "cells_migrated",
+    "full_tier",
+    "mid_tier",
+    "far_tier",
+]
+
+
+class FrameProfiler:
+    """
+    Records how long each phase of a frame took, in nanoseconds from time.perf_counter_ns, together with a few per-frame counters.\n
+    Frames go into a fixed-size ring buffer that is allocated up front, so recording a frame only writes into existing arrays and the oldest frames are overwritten once the buffer is full.
+    Durations of a phase that runs several times in a frame (for example once per entity) are summed.
+    :param capacity: Number of frames kept
+    """
+
+    def __init__(self, capacity: int = 600) -> None:
+        self.capacity: int = capacity
+        self.phase_columns: dict[str, int] = {
+            name: column for column, name in enumerate(PHASES)
+        }
+        self.frame_ns: np.ndarray = np.zeros(capacity, dtype=np.int64)
+        self.phase_ns: np.ndarray = np.zeros((capacity, len(PHASES)), dtype=np.int64)
+        self.counters: np.ndarray = np.zeros((capacity, len(COUNTERS)), dtype=np.int64)
+        # Total number of frames recorded. The next frame goes into row frame_count % capacity
+        self.frame_count: int = 0
+        # The frame being recorded
+        self._frame_start: int = 0
+        self._current: list[int] = [0] * len(PHASES)
+
+    def begin_frame(self) -> None:
+        for column in range(len(self._current)):
+            self._current[column] = 0
+        self._frame_start = time.perf_counter_ns()
+
+    def add_span(self, phase: str, start_ns: int) -> None:
+        """
+        Adds the time from start_ns (a time.perf_counter_ns value) until now to a phase of the current frame
+        """
+        self._current[self.phase_columns[phase]] += time.perf_counter_ns() - start_ns
+
+    def add_duration(self, phase: str, duration_ns: int) -> None:
+        self._current[self.phase_columns[phase]] += duration_ns
+
+    def end_frame(
+        self,
+        entities_updated: int,
+        pairs_tested: int,
+        cells_migrated: int,
+        tier_counts: list[int] | None = None,
+    ) -> None:
+        row: int = self.frame_count % self.capacity
+        self.frame_ns[row] = time.perf_counter_ns() - self._frame_start
+        self.phase_ns[row] = self._current
+        counters: np.ndarray = self.counters[row]
+        counters[0] = entities_updated
+        counters[1] = pairs_tested
+        counters[2] = cells_migrated
+        counters[3:6] = tier_counts if tier_counts is not None else 0
+        self.frame_count += 1
+
+    def get_recorded_rows(self) -> np.ndarray:
+        """
+        Returns the ring buffer rows that hold frames, oldest first
+        """
+        if self.frame_count <= self.capacity:
+            return np.arange(self.frame_count)
+        return np.roll(np.arange(self.capacity), -(self.frame_count % self.capacity))
+
+    def get_frame_ms(self) -> np.ndarray:
+        """
+        Returns the recorded frame times in milliseconds, oldest first
+        """
+        return self.frame_ns[self.get_recorded_rows()] / 1e6
+
+    def get_percentiles(
+        self, percentiles: tuple[float, ...] = (50, 95, 99)
+    ) -> dict[str, np.ndarray]:
+        """
+        Returns phase name -> the given percentiles of that phase's recorded durations in milliseconds. "frame" holds the percentiles of the whole frame
+        """
+        rows: np.ndarray = self.get_recorded_rows()
+        if len(rows) == 0:
+            return {}
+        result: dict[str, np.ndarray] = {
+            "frame": np.percentile(self.frame_ns[rows], percentiles) / 1e6
+        }
+        phase_percentiles: np.ndarray = (
+            np.percentile(self.phase_ns[rows], percentiles, axis=0) / 1e6
+        )
+        for name, column in self.phase_columns.items():
+            result[name] = phase_percentiles[:, column]
+        return result
+
+    def get_last_counters(self) -> dict[str, int]:
+        if self.frame_count == 0:
+            return {name: 0 for name in COUNTERS}
+        row: int = (self.frame_count - 1) % self.capacity
+        return {
+            name: int(self.counters[row, column])
+            for column, name in enumerate(COUNTERS)
+        }
+
+    def dump_csv(self, path: str) -> None:
+        """
+        Writes every recorded frame to a CSV file, oldest first. Durations are in nanoseconds
+        """
+        rows: np.ndarray = self.get_recorded_rows()
+        first_frame: int = self.frame_count - len(rows)
+        table: np.ndarray = np.column_stack(
+            (
+                np.arange(first_frame, self.frame_count),
+                self.frame_ns[rows],
+                self.phase_ns[rows],
+                self.counters[rows],
+            )
+        )
+        np.savetxt(
+            path,
+            table,
+            fmt="%d",
+            delimiter=",",
+            header=",".join(["frame", "frame_ns"] + PHASES + COUNTERS),
+            comments="",
+        )
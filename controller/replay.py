@@ -0,0 +1,162 @@
+import hashlib
+import struct
+from typing import BinaryIO, Sequence, Tuple
+
+import numpy as np
+from pygame.key import ScancodeWrapper
+
+from model.world.spatial_partitioning_model import SpatialPartitioningModel
+
+REPLAY_MAGIC: bytes = b"BOIDRPLY"
+# Incremented whenever the layout changes. Files of a newer version than this can't be read
+REPLAY_VERSION: int = 1
+# Magic, version, seed of the model and number of keys in every frame's key state
+_HEADER: struct.Struct = struct.Struct("<8sIQI")
+
+
+def get_frame_dtype(key_count: int) -> np.dtype:
+    """
+    Layout of one recorded frame: the frame's duration, how many model updates it ran and the dt of each,
+    the mouse position, the key state packed to one bit per key and the checksum of the entity state after the updates
+    """
+    return np.dtype(
+        [
+            ("dt", "<f8"),
+            ("steps", "<u2"),
+            ("step_dt", "<f8"),
+            ("mouse", "<i4", (2,)),
+            ("keys", "u1", ((key_count + 7) // 8,)),
+            ("checksum", "<u8"),
+        ]
+    )
+
+
+def compute_checksum(model: SpatialPartitioningModel) -> int:
+    """
+    Returns a 64 bit hash of the position and velocity of every entity and of the player.\n
+    Entities are hashed sorted by position, so the checksum doesn't depend on the order the model keeps them in. It does depend on every bit of every value,
+    so it only matches between runs that do the same floating point operations in the same order, for example the same backend before and after a change that should only make it faster
+    """
+    state: np.ndarray = model.get_entity_state()
+    state = state[np.lexsort((state[:, 3], state[:, 2], state[:, 1], state[:, 0]))]
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(np.ascontiguousarray(state).tobytes())
+    digest.update(struct.pack("<2d", model.player.position.x, model.player.position.y))
+    return int.from_bytes(digest.digest(), "little")
+
+
+class InputRecorder:
+    """
+    Writes the input of every frame (see get_frame_dtype) to a file, so the run can be replayed with Recording.\n
+    Frames are appended as they are recorded, so the file is readable up to the last whole frame even if the game doesn't exit cleanly
+    :param path: File to write, replaced if it exists
+    :param seed: Seed of the model, see SpatialPartitioningModel.set_seed. The world has to be populated from the model's rng for a replay to start from the same world
+    """
+
+    def __init__(self, path: str, seed: int) -> None:
+        self.path: str = path
+        self.seed: int = seed
+        self.frame_count: int = 0
+        self._file: BinaryIO = open(path, "wb")
+        # Written with the first frame, once the number of keys is known
+        self._frame_dtype: np.dtype | None = None
+
+    def record_frame(
+        self,
+        dt: float,
+        steps: int,
+        step_dt: float,
+        mouse_pos: Tuple[int, int],
+        key_presses: Sequence[bool],
+        checksum: int,
+    ) -> None:
+        if self._frame_dtype is None:
+            self._frame_dtype = get_frame_dtype(len(key_presses))
+            self._file.write(
+                _HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.seed, len(key_presses))
+            )
+        frame: np.ndarray = np.zeros(1, self._frame_dtype)
+        frame["dt"] = dt
+        frame["steps"] = steps
+        frame["step_dt"] = step_dt
+        frame["mouse"] = mouse_pos
+        frame["keys"] = np.packbits(np.array(key_presses, dtype=bool))
+        frame["checksum"] = checksum
+        self._file.write(frame.tobytes())
+        self.frame_count += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class Recording:
+    """
+    A file written by InputRecorder. Replaying it runs the model with the same seed, updates and input as the recorded run,
+    and check_frame compares the state after every frame with the recorded checksum
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        with open(path, "rb") as file:
+            data: bytes = file.read()
+        if len(data) < _HEADER.size:
+            raise ValueError(path + " is not an input recording")
+        magic, version, seed, key_count = _HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC:
+            raise ValueError(path + " is not an input recording")
+        if version > REPLAY_VERSION:
+            raise ValueError(
+                "{} is recording version {}, only versions up to {} can be read".format(
+                    path, version, REPLAY_VERSION
+                )
+            )
+        self.seed: int = seed
+        self.key_count: int = key_count
+        dtype: np.dtype = get_frame_dtype(self.key_count)
+        # A frame cut off by a crash is dropped
+        frame_count: int = (len(data) - _HEADER.size) // dtype.itemsize
+        self.frames: np.ndarray = np.frombuffer(data, dtype, frame_count, _HEADER.size)
+        # Frames whose replayed checksum didn't match the recording, see check_frame
+        self.mismatched_frames: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def get_steps(self, frame: int) -> Tuple[int, float]:
+        """
+        Returns how many model updates the frame ran and the dt of each
+        """
+        return int(self.frames["steps"][frame]), float(self.frames["step_dt"][frame])
+
+    def get_dt(self, frame: int) -> float:
+        return float(self.frames["dt"][frame])
+
+    def get_mouse_pos(self, frame: int) -> Tuple[int, int]:
+        x, y = self.frames["mouse"][frame].tolist()
+        return x, y
+
+    def get_keys(self, frame: int) -> ScancodeWrapper:
+        """
+        Returns the frame's key state in the form pygame.key.get_pressed() returns it
+        """
+        return ScancodeWrapper(
+            np.unpackbits(self.frames["keys"][frame], count=self.key_count)
+            .astype(bool)
+            .tolist()
+        )
+
+    def check_frame(self, frame: int, checksum: int) -> bool:
+        """
+        Returns whether the checksum of the replayed frame matches the recorded one, and remembers the frame if it doesn't
+        """
+        if int(self.frames["checksum"][frame]) == checksum:
+            return True
+        self.mismatched_frames.append(frame)
+        return False
+
+    def get_report(self) -> str:
+        if not self.mismatched_frames:
+            return "Replay of {} matched all {} frames".format(self.path, len(self))
+        return "Replay of {} diverged at frame {}, {} of {} frames didn't match".format(
+            self.path, self.mismatched_frames[0], len(self.mismatched_frames), len(self)
+        )
@@ -1,48 +1,61 @@
 import random
 from enum import Enum
-from typing import Tuple
+from typing import TYPE_CHECKING, NamedTuple, Tuple
 
+import numpy as np
 import pygame
 from pygame import Vector2, Surface
 
 from model.entities.gameentity import GameEntity
+from model.entities.spawning import (
+    School,
+    SpawnDistribution,
+    create_generator,
+    sample_positions,
+    sample_velocities,
+)
+from model.utils.sprite_rotations import (
+    DEFAULT_ANGLE_COUNT,
+    RotationSet,
+    rotation_cache,
+)
+from model.utils.assets import asset_cache
 from model.utils.vectorutils import limit_magnitude
 
+if TYPE_CHECKING:
+    from model.world.flock_aggregates import AggregateNeighborhood
+    from model.world.neighborhood import NeighborhoodSnapshot
 
-class FlockingParameters:
+
+class FlockingParameters(NamedTuple):
     """
-    Parameters for controlling how an entity behaves with its flock
+    Parameters for controlling how an entity behaves with its flock. One immutable record is shared by every boid of a flock, boids only keep a reference to it
     :param cohere_distance: The maximum distance at which boids will try to cohere with their 'friends'
     :param avoid_distance: The maximum distance at which boids will try to avoid their neighbors
     :param cohere_k: A constant that represents how much a boid will prioritize cohering with friends
     :param align_k: A constant that represents how much a boid will prioritize aligning with friends
-    :param flock_id: Unique identifier for a flock. Currently not used, but will be used to have multiple flocks that don't cohere to each other
-    :param target_mouse: Whether the flock will move towards the mouse - temporary for testing
-    :param target_k: How much the boids will prioritize moving towards their 'target' (currently just the mouse) - temporary for testing
+    :param flock_id: Unique identifier for a flock, used as the group id of its boids. Boids only flock with boids of the same group
+    :param target_location: Where the flock swims towards. The Vector2 itself is shared too, so moving it in place moves the target of the whole flock
+    :param target_k: How much the boids will prioritize moving towards their target
     """
 
-    def __init__(
-        self,
-        cohere_distance: float,
-        avoid_distance: float,
-        cohere_k: float = 1.0,
-        avoid_k: float = 1.5,
-        align_k: float = 1.0,
-        flock_id: int = -1,
-        target_location: Vector2 | None = None,
-        target_k: float = 1.0,
-    ) -> None:
-        self.cohere_distance: float = cohere_distance
-        self.avoid_distance: float = avoid_distance
-        self.cohere_k: float = cohere_k
-        self.avoid_k: float = avoid_k
-        self.align_k: float = align_k
-        self.flock_id: int = flock_id
-        self.target_location: Vector2 | None = target_location
-        self.target_k: float = target_k
+    cohere_distance: float
+    avoid_distance: float
+    cohere_k: float = 1.0
+    avoid_k: float = 1.5
+    align_k: float = 1.0
+    flock_id: int = -1
+    target_location: Vector2 | None = None
+    target_k: float = 1.0
 
 
 class Boid(GameEntity):
+    """
+    An entity that flocks with the other boids of its group. Flocking parameters are read from the flock's shared FlockingParameters
+    """
+
+    __slots__ = ("flocking_parameters",)
+
     def __init__(
         self,
         flocking_parameters: FlockingParameters,
@@ -54,14 +67,9 @@ class Boid(GameEntity):
         max_speed: float,
         max_acceleration: float,
         interaction_range: int = 1,
+        rotations: RotationSet | None = None,
     ) -> None:
-        self.cohere_distance: float = flocking_parameters.cohere_distance
-        self.avoid_distance: float = flocking_parameters.avoid_distance
-        self.cohere_k: float = flocking_parameters.cohere_k
-        self.avoid_k: float = flocking_parameters.avoid_k
-        self.align_k: float = flocking_parameters.align_k
-        self.target_location: Vector2 | None = flocking_parameters.target_location
-        self.target_k: float = flocking_parameters.target_k
+        self.flocking_parameters: FlockingParameters = flocking_parameters
         super().__init__(
             surface,
             width,
@@ -73,11 +81,18 @@ class Boid(GameEntity):
             flocking_parameters.flock_id,
             interaction_range,
         )
+        self.rotations = rotations
 
     def apply_forces(self, entities: list[GameEntity], mouse_pos: Vector2) -> None:
         self.apply_flocking_forces(entities)
-        if self.target_location is not None:
-            self.flock_to_target_location(self.target_location)
+        target_location: Vector2 | None = self.flocking_parameters.target_location
+        if target_location is not None:
+            self.flock_to_target_location(target_location)
+
+    def apply_far_forces(self, mouse_pos: Vector2) -> None:
+        target_location: Vector2 | None = self.flocking_parameters.target_location
+        if target_location is not None:
+            self.flock_to_target_location(target_location)
 
     def apply_flocking_forces(self, others: list[GameEntity]) -> None:
         """
@@ -87,40 +102,168 @@ class Boid(GameEntity):
         #. Each entity moves towards the average position of other entities in its coherence range.\n
         :param others: Other boid entities that forces on this entity will be calculated with
         """
+        parameters: FlockingParameters = self.flocking_parameters
+        cohere_distance: float = parameters.cohere_distance
+        avoid_distance: float = parameters.avoid_distance
+        group_id: int = self.group_id
         sum_avoid: Vector2 = Vector2(0.0, 0.0)
         sum_align: Vector2 = Vector2(0.0, 0.0)
         sum_cohere: Vector2 = Vector2(0.0, 0.0)
         count_n: int = 0
         count_s: int = 0
         for other in others:
-            if self.group_id >= 0 and self.group_id == other.group_id:
+            if group_id >= 0 and group_id == other.group_id:
                 # TODO add check to make sure not to check this entity against itself
                 d: float = self.position.distance_to(other.position)
-                if (d > 0) and d < self.cohere_distance:
+                if (d > 0) and d < cohere_distance:
                     sum_align += other.velocity
                     sum_cohere += other.position
                     count_n += 1
-                if (d > 0) and (d < self.avoid_distance):
+                if (d > 0) and (d < avoid_distance):
                     diff: Vector2 = self.position - other.position
                     diff.normalize_ip()
                     diff /= d
                     sum_avoid += diff
                     count_s += 1
         if count_s > 0:
-            self.target(sum_avoid, self.avoid_k)
+            self.target(sum_avoid, parameters.avoid_k)
         if count_n > 0:
-            self.target(sum_align, self.align_k)
+            self.target(sum_align, parameters.align_k)
             sum_cohere /= float(count_n)
             sum_cohere -= self.position
-            self.target(sum_cohere, self.cohere_k)
+            self.target(sum_cohere, parameters.cohere_k)
+
+    def apply_forces_from_snapshot(
+        self, snapshot: "NeighborhoodSnapshot", mouse_pos: Vector2
+    ) -> None:
+        self.apply_flocking_forces_from_snapshot(snapshot)
+        target_location: Vector2 | None = self.flocking_parameters.target_location
+        if target_location is not None:
+            self.flock_to_target_location(target_location)
+
+    def apply_flocking_forces_from_snapshot(
+        self, snapshot: "NeighborhoodSnapshot"
+    ) -> None:
+        """
+        Same as apply_flocking_forces, but reads neighbor state from the flat lists of a NeighborhoodSnapshot and sums with plain floats instead of Vector2s.
+        Only neighbors in this entity's group are visited
+        """
+        if self.group_id < 0:
+            return
+        columns = snapshot.get_group(self.group_id)
+        if columns is None:
+            return
+        parameters: FlockingParameters = self.flocking_parameters
+        px: float = self.position.x
+        py: float = self.position.y
+        # Compare squared distances to skip the square root
+        cohere_d2: float = parameters.cohere_distance * parameters.cohere_distance
+        avoid_d2: float = parameters.avoid_distance * parameters.avoid_distance
+        avoid_x = avoid_y = align_x = align_y = cohere_x = cohere_y = 0.0
+        count_n: int = 0
+        count_s: int = 0
+        for ox, oy, ovx, ovy in zip(*columns):
+            dx: float = px - ox
+            dy: float = py - oy
+            d2: float = dx * dx + dy * dy
+            if d2 == 0.0:
+                continue
+            if d2 < cohere_d2:
+                align_x += ovx
+                align_y += ovy
+                cohere_x += ox
+                cohere_y += oy
+                count_n += 1
+            if d2 < avoid_d2:
+                # Normalized difference divided by the distance
+                avoid_x += dx / d2
+                avoid_y += dy / d2
+                count_s += 1
+        if count_s > 0:
+            self.target(Vector2(avoid_x, avoid_y), parameters.avoid_k)
+        if count_n > 0:
+            self.target(Vector2(align_x, align_y), parameters.align_k)
+            self.target(
+                Vector2(cohere_x / count_n - px, cohere_y / count_n - py),
+                parameters.cohere_k,
+            )
+
+    def apply_forces_from_aggregates(
+        self, neighborhood: "AggregateNeighborhood", mouse_pos: Vector2
+    ) -> None:
+        self.apply_flocking_forces_from_aggregates(neighborhood)
+        target_location: Vector2 | None = self.flocking_parameters.target_location
+        if target_location is not None:
+            self.flock_to_target_location(target_location)
+
+    def apply_flocking_forces_from_aggregates(
+        self, neighborhood: "AggregateNeighborhood"
+    ) -> None:
+        """
+        Same as apply_flocking_forces_from_snapshot, but cells inside the cohere radius add to cohesion and alignment through their cell aggregates instead of neighbor by neighbor.
+        Avoidance is always computed neighbor by neighbor
+        """
+        if self.group_id < 0:
+            return
+        parameters: FlockingParameters = self.flocking_parameters
+        summed, visit_columns, avoid_columns = neighborhood.gather(
+            self, parameters.cohere_distance, parameters.avoid_distance
+        )
+        px: float = self.position.x
+        py: float = self.position.y
+        cohere_d2: float = parameters.cohere_distance * parameters.cohere_distance
+        avoid_d2: float = parameters.avoid_distance * parameters.avoid_distance
+        align_x: float = summed.sum_vx
+        align_y: float = summed.sum_vy
+        cohere_x: float = summed.sum_x
+        cohere_y: float = summed.sum_y
+        avoid_x = avoid_y = 0.0
+        count_n: int = summed.count
+        count_s: int = 0
+        for columns in visit_columns:
+            for ox, oy, ovx, ovy in zip(*columns):
+                dx: float = px - ox
+                dy: float = py - oy
+                d2: float = dx * dx + dy * dy
+                if d2 == 0.0:
+                    continue
+                if d2 < cohere_d2:
+                    align_x += ovx
+                    align_y += ovy
+                    cohere_x += ox
+                    cohere_y += oy
+                    count_n += 1
+                if d2 < avoid_d2:
+                    avoid_x += dx / d2
+                    avoid_y += dy / d2
+                    count_s += 1
+        # Whole cells only count for avoidance, their cohesion and alignment are in the sums
+        for columns in avoid_columns:
+            for ox, oy in zip(columns[0], columns[1]):
+                dx = px - ox
+                dy = py - oy
+                d2 = dx * dx + dy * dy
+                if 0.0 < d2 < avoid_d2:
+                    avoid_x += dx / d2
+                    avoid_y += dy / d2
+                    count_s += 1
+        if count_s > 0:
+            self.target(Vector2(avoid_x, avoid_y), parameters.avoid_k)
+        if count_n > 0:
+            self.target(Vector2(align_x, align_y), parameters.align_k)
+            self.target(
+                Vector2(cohere_x / count_n - px, cohere_y / count_n - py),
+                parameters.cohere_k,
+            )
 
     def flock_to_target_location(self, target_location: Vector2) -> None:
+        parameters: FlockingParameters = self.flocking_parameters
         diff = target_location - self.position
         d = self.position.distance_to(target_location)
-        if d > (self.cohere_distance * 2):
-            self.target(diff, self.target_k)
+        if d > (parameters.cohere_distance * 2):
+            self.target(diff, parameters.target_k)
         else:
-            self.target(diff, -1 * self.target_k)
+            self.target(diff, -1 * parameters.target_k)
 
 
 class BoidFactory:
@@ -128,6 +271,8 @@ class BoidFactory:
     Creates Boids with the specified settings
     :param position_x_range: A tuple specifying the range of x coordinates that a random boid can be created at
     :param position_y_range: A tuple specifying the range of y coordinates that a random boid can be created at
+    :param angle_count: Number of angles the surface is pre-rendered at. All boids of the factory share these rotations. 0 rotates the surface every frame instead
+    :param rng: Random source of start positions and velocities, usually the model's rng (see SpatialPartitioningModel.set_seed). By default one is seeded from the random module
     """
 
     def __init__(
@@ -141,6 +286,8 @@ class BoidFactory:
         position_y_range: Tuple[float, float],
         interaction_range: int = 1,
         surface: Surface = None,
+        angle_count: int = DEFAULT_ANGLE_COUNT,
+        rng: random.Random | None = None,
     ) -> None:
         self.parameters: FlockingParameters = parameters
         self.width: float = width
@@ -155,29 +302,91 @@ class BoidFactory:
             self.surface.fill((255, 255, 255))
         else:
             self.surface = surface
+        self.rotations: RotationSet | None = rotation_cache.get_rotations(
+            self.surface, angle_count
+        )
+        self.rng: random.Random = (
+            rng if rng is not None else random.Random(random.getrandbits(64))
+        )
 
     def create_random_boid(self) -> Boid:
         """
         Creates a Boid at a random position using settings from this factory. The boid has a random starting velocity that is limited by its max speed.
         """
+        rng: random.Random = self.rng
         start_velocity: Vector2 = Vector2(
-            random.uniform(-self.max_speed, self.max_speed),
-            random.uniform(-self.max_speed, self.max_speed),
+            rng.uniform(-self.max_speed, self.max_speed),
+            rng.uniform(-self.max_speed, self.max_speed),
         )
         limit_magnitude(start_velocity, self.max_speed)
+        return self.create_boid(
+            Vector2(
+                rng.uniform(self.position_x_range[0], self.position_x_range[1]),
+                rng.uniform(self.position_y_range[0], self.position_y_range[1]),
+            ),
+            start_velocity,
+        )
+
+    def create_boid(self, start_pos: Vector2, start_v: Vector2) -> Boid:
+        """
+        Creates a Boid with settings from this factory at the given position and velocity
+        """
         return Boid(
             self.parameters,
             self.surface,
             self.width,
             self.height,
-            Vector2(
-                random.uniform(self.position_x_range[0], self.position_x_range[1]),
-                random.uniform(self.position_y_range[0], self.position_y_range[1]),
-            ),
-            start_velocity,
+            start_pos,
+            start_v,
             self.max_speed,
             self.max_acceleration,
             self.interaction_range,
+            self.rotations,
+        )
+
+    def create_school(
+        self,
+        count: int,
+        distribution: SpawnDistribution = SpawnDistribution.UNIFORM,
+        center: Vector2 | None = None,
+        spread: float | None = None,
+        radius: float = 0.0,
+        rng: np.random.Generator | None = None,
+    ) -> School:
+        """
+        Generates the start positions and velocities of count boids at once. Velocities are random and limited by the max speed like in create_random_boid.
+        Positions follow the distribution and are wrapped into the factory's position ranges
+        :param center: Center of GAUSSIAN_CLUSTER and RING. GAUSSIAN_CLUSTER defaults to the flock's target location, or the middle of the position ranges when there is none. RING requires a center, usually the player's position
+        :param spread: Standard deviation of GAUSSIAN_CLUSTER and width of the RING. Defaults to the cohere distance
+        :param radius: Inner radius of the RING
+        :param rng: NumPy generator to draw from. By default one is seeded from the factory's rng, so seeding that makes schools reproducible
+        """
+        if center is None:
+            if distribution == SpawnDistribution.RING:
+                raise ValueError("SpawnDistribution.RING needs a center")
+            if self.parameters.target_location is not None:
+                center = self.parameters.target_location
+            else:
+                center = Vector2(
+                    sum(self.position_x_range) / 2, sum(self.position_y_range) / 2
+                )
+        if spread is None:
+            spread = self.parameters.cohere_distance
+        if rng is None:
+            rng = create_generator(self.rng)
+        return School(
+            self,
+            sample_positions(
+                rng,
+                count,
+                distribution,
+                self.position_x_range,
+                self.position_y_range,
+                (center.x, center.y),
+                spread,
+                radius,
+            ),
+            sample_velocities(rng, count, self.max_speed),
         )
 
 
@@ -187,7 +396,18 @@ class FishTypes(Enum):
     YELLOW = 2
 
 
+FISH_IMAGES: dict[FishTypes, str] = {
+    FishTypes.RED: "images/red_fish.png",
+    FishTypes.GREEN: "images/green_fish.png",
+    FishTypes.YELLOW: "images/yellow_fish.png",
+}
+
+
 class FishFactory(BoidFactory):
+    """
+    BoidFactory that uses the sprite of the given fish type. Sprites come from asset_cache, so all factories of a fish type and size share one surface
+    :param placeholder_surface: Skip loading the sprite and use a plain surface instead. Sprites are only converted to the display format when a display mode is set, so this is used to build fish without a display
+    """
 
     def __init__(
         self,
@@ -200,19 +420,13 @@ class FishFactory(BoidFactory):
         position_x_range: Tuple[float, float],
         position_y_range: Tuple[float, float],
         interaction_range: int = 1,
+        placeholder_surface: bool = False,
+        angle_count: int = DEFAULT_ANGLE_COUNT,
+        rng: random.Random | None = None,
     ) -> None:
         surface: Surface | None = None
-        if fish_type == FishTypes.RED:
-            surface: Surface = pygame.image.load("images/red_fish.png").convert_alpha()
-        elif fish_type == FishTypes.GREEN:
-            surface: Surface = pygame.image.load(
-                "images/green_fish.png"
-            ).convert_alpha()
-        elif fish_type == FishTypes.YELLOW:
-            surface: Surface = pygame.image.load(
-                "images/yellow_fish.png"
-            ).convert_alpha()
-        surface = pygame.transform.scale(surface, (width, height))
+        if not placeholder_surface:
+            surface = asset_cache.get(FISH_IMAGES[fish_type], (width, height))
         super().__init__(
             parameters,
             width,
@@ -223,4 +437,6 @@ class FishFactory(BoidFactory):
             position_y_range,
             interaction_range,
             surface,
+            angle_count,
+            rng,
         )
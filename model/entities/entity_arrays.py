@@ -0,0 +1,222 @@
+import numpy as np
+
+from model.entities.boid import Boid, FlockingParameters
+from model.entities.gameentity import GameEntity
+
+
+class FlockParameterTable:
+    """
+    Flat columns of flocking parameters with one row per flock. Entities in the array model store a row index into this table instead of copying the parameters.\n
+    Row 0 is reserved for entities that do not flock (plain GameEntities)
+    """
+
+    def __init__(self) -> None:
+        self.parameters: list[FlockingParameters | None] = [None]
+        self._rows: dict[int, int] = {}
+        self.flocking: np.ndarray = np.zeros(1, dtype=bool)
+        self.cohere_distance: np.ndarray = np.zeros(1)
+        self.avoid_distance: np.ndarray = np.zeros(1)
+        self.cohere_k: np.ndarray = np.zeros(1)
+        self.avoid_k: np.ndarray = np.zeros(1)
+        self.align_k: np.ndarray = np.zeros(1)
+        self.target_k: np.ndarray = np.zeros(1)
+        self.has_target: np.ndarray = np.zeros(1, dtype=bool)
+        self.target_location: np.ndarray = np.zeros((1, 2))
+
+    def get_row(self, entity: GameEntity) -> int:
+        """
+        Returns the row holding the flocking parameters of the entity, adding a new row the first time a flock is seen
+        """
+        if not isinstance(entity, Boid):
+            return 0
+        return self.get_parameters_row(entity.flocking_parameters)
+
+    def get_parameters_row(self, parameters: FlockingParameters) -> int:
+        """
+        Returns the row holding the given flocking parameters, adding a new row the first time they are seen
+        """
+        row: int | None = self._rows.get(id(parameters))
+        if row is not None:
+            return row
+        row = len(self.parameters)
+        self._rows[id(parameters)] = row
+        self.parameters.append(parameters)
+        self.flocking = np.append(self.flocking, True)
+        self.cohere_distance = np.append(
+            self.cohere_distance, parameters.cohere_distance
+        )
+        self.avoid_distance = np.append(self.avoid_distance, parameters.avoid_distance)
+        self.cohere_k = np.append(self.cohere_k, parameters.cohere_k)
+        self.avoid_k = np.append(self.avoid_k, parameters.avoid_k)
+        self.align_k = np.append(self.align_k, parameters.align_k)
+        self.target_k = np.append(self.target_k, parameters.target_k)
+        self.has_target = np.append(self.has_target, False)
+        self.target_location = np.append(self.target_location, [[0.0, 0.0]], axis=0)
+        self.refresh_targets()
+        return row
+
+    def __getstate__(self) -> dict:
+        # Copies sent to other processes only need the columns, not the FlockingParameters they were read from
+        state: dict = self.__dict__.copy()
+        state["parameters"] = [None] * len(self.parameters)
+        state["_rows"] = {}
+        return state
+
+    def refresh_targets(self) -> None:
+        """
+        Copies the current target locations out of the FlockingParameters. Target locations are Vector2s shared with the flock, so they can be moved at runtime
+        """
+        for row in range(1, len(self.parameters)):
+            target = self.parameters[row].target_location
+            if target is None:
+                self.has_target[row] = False
+            else:
+                self.has_target[row] = True
+                self.target_location[row, 0] = target.x
+                self.target_location[row, 1] = target.y
+
+
+# name -> (shape of one row, dtype) of every EntityArrays column
+COLUMNS: dict[str, tuple[tuple[int, ...], type]] = {
+    "position": ((2,), np.float64),
+    # Position before the last integration step, for drawing in between simulation steps
+    "previous_position": ((2,), np.float64),
+    "velocity": ((2,), np.float64),
+    "acceleration": ((2,), np.float64),
+    "max_speed": ((), np.float64),
+    "max_acceleration": ((), np.float64),
+    "group_id": ((), np.int64),
+    # Dense 0..n_groups-1 renumbering of group_id, used to bucket each cell by group
+    "group_slot": ((), np.int64),
+    "interaction_range": ((), np.int64),
+    "flock_row": ((), np.int64),
+    # Index of the GameEntity object in the model's entity list. Rows can be reordered, this can't
+    "entity_id": ((), np.int64),
+    # Simulation tiers (see SimulationTier): ticks since the row's forces were last computed, and what this tick's flocking acceleration is multiplied by, 0 to skip it
+    "ticks_since_forces": ((), np.int64),
+    "force_scale": ((), np.float64),
+}
+
+
+class EntityArrays:
+    """
+    Structure-of-arrays storage for entity physics state. Every column is a contiguous NumPy array where row i describes one entity.\n
+    Only the first 'count' rows are in use, the rest is spare capacity so that appending stays amortized O(1)
+    :param capacity: The number of rows to allocate up front
+    """
+
+    position: np.ndarray
+    previous_position: np.ndarray
+    velocity: np.ndarray
+    acceleration: np.ndarray
+    max_speed: np.ndarray
+    max_acceleration: np.ndarray
+    group_id: np.ndarray
+    group_slot: np.ndarray
+    interaction_range: np.ndarray
+    flock_row: np.ndarray
+    entity_id: np.ndarray
+    ticks_since_forces: np.ndarray
+    force_scale: np.ndarray
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self.count: int = 0
+        self.capacity: int = capacity
+        for name, (row_shape, dtype) in COLUMNS.items():
+            setattr(self, name, self._allocate(name, (capacity,) + row_shape, dtype))
+
+    def _allocate(self, name: str, shape: tuple[int, ...], dtype) -> np.ndarray:
+        """
+        Allocates a zeroed column. Subclasses can override this to place the columns somewhere else, such as shared memory
+        """
+        return np.zeros(shape, dtype=dtype)
+
+    def _grow(self, min_capacity: int) -> None:
+        new_capacity: int = max(self.capacity * 2, min_capacity)
+        for name, (row_shape, dtype) in COLUMNS.items():
+            old: np.ndarray = getattr(self, name)
+            new: np.ndarray = self._allocate(name, (new_capacity,) + row_shape, dtype)
+            new[: self.count] = old[: self.count]
+            setattr(self, name, new)
+        self.capacity = new_capacity
+
+    def append(
+        self, entity: GameEntity, entity_id: int, flock_row: int, group_slot: int
+    ) -> int:
+        """
+        Copies the state of the entity into a new row and returns the row index
+        """
+        if self.count == self.capacity:
+            self._grow(self.count + 1)
+        i: int = self.count
+        self.position[i] = (entity.position.x, entity.position.y)
+        self.previous_position[i] = (
+            entity.previous_position.x,
+            entity.previous_position.y,
+        )
+        self.velocity[i] = (entity.velocity.x, entity.velocity.y)
+        self.acceleration[i] = (entity.acceleration.x, entity.acceleration.y)
+        self.max_speed[i] = entity.max_speed
+        self.max_acceleration[i] = entity.max_acceleration
+        self.group_id[i] = entity.group_id
+        self.group_slot[i] = group_slot
+        self.interaction_range[i] = entity.interaction_range
+        self.flock_row[i] = flock_row
+        self.entity_id[i] = entity_id
+        self.ticks_since_forces[i] = entity.ticks_since_forces
+        self.force_scale[i] = 1.0
+        self.count += 1
+        return i
+
+    def append_many(
+        self,
+        entities: list[GameEntity],
+        first_entity_id: int,
+        flock_rows: list[int],
+        group_slots: list[int],
+    ) -> None:
+        """
+        Same as calling append for every entity, with entity ids counting up from first_entity_id, but every column is filled for the whole batch at once
+        """
+        n: int = len(entities)
+        if self.count + n > self.capacity:
+            self._grow(self.count + n)
+        rows: slice = slice(self.count, self.count + n)
+        # Filling one component at a time from flat lists is several times faster than from a list of pairs
+        self.position[rows, 0] = [e.position.x for e in entities]
+        self.position[rows, 1] = [e.position.y for e in entities]
+        self.previous_position[rows, 0] = [e.previous_position.x for e in entities]
+        self.previous_position[rows, 1] = [e.previous_position.y for e in entities]
+        self.velocity[rows, 0] = [e.velocity.x for e in entities]
+        self.velocity[rows, 1] = [e.velocity.y for e in entities]
+        self.acceleration[rows, 0] = [e.acceleration.x for e in entities]
+        self.acceleration[rows, 1] = [e.acceleration.y for e in entities]
+        self.max_speed[rows] = [e.max_speed for e in entities]
+        self.max_acceleration[rows] = [e.max_acceleration for e in entities]
+        self.group_id[rows] = [e.group_id for e in entities]
+        self.group_slot[rows] = group_slots
+        self.interaction_range[rows] = [e.interaction_range for e in entities]
+        self.flock_row[rows] = flock_rows
+        self.entity_id[rows] = np.arange(first_entity_id, first_entity_id + n)
+        self.ticks_since_forces[rows] = [e.ticks_since_forces for e in entities]
+        self.force_scale[rows] = 1.0
+        self.count += n
+
+    def adopt_columns(self, columns: dict[str, np.ndarray], count: int) -> None:
+        """
+        Uses the given arrays as the columns, without copying them. Every column of COLUMNS must be given, with at least count rows.
+        Used to load memory-mapped columns from a snapshot file
+        """
+        for name in COLUMNS:
+            setattr(self, name, columns[name])
+        self.count = count
+        self.capacity = min(len(columns[name]) for name in COLUMNS)
+
+    def permute(self, order: np.ndarray) -> None:
+        """
+        Reorders the rows in use so that new row i is old row order[i]
+        """
+        n: int = self.count
+        for name in COLUMNS:
+            column: np.ndarray = getattr(self, name)
+            column[:n] = column[:n][order]
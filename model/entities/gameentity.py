@@ -1,13 +1,39 @@
 import math
 import random
+import sys
+from typing import TYPE_CHECKING
 
 import pygame
 from pygame import Surface, Vector2
 
+from model.utils.sprite_rotations import RotationSet
 from model.utils.vectorutils import limit_magnitude, safe_normalize
 
+if TYPE_CHECKING:
+    from model.world.flock_aggregates import AggregateNeighborhood
+    from model.world.neighborhood import NeighborhoodSnapshot
+
 
 class GameEntity:
+    """
+    Something that lives in the world model. Entities use __slots__ instead of a __dict__ since there can be hundreds of thousands of them, so subclasses should declare __slots__ for their own attributes too
+    """
+
+    __slots__ = (
+        "surface",
+        "rotations",
+        "width",
+        "height",
+        "position",
+        "previous_position",
+        "velocity",
+        "acceleration",
+        "max_speed",
+        "max_acceleration",
+        "group_id",
+        "interaction_range",
+        "ticks_since_forces",
+    )
 
     def __init__(
         self,
@@ -22,35 +48,65 @@ class GameEntity:
         interaction_range: int = 1,
     ):
         self.surface: Surface = surface
+        # Pre-rendered rotations of surface, used instead of rotating it every frame when set
+        self.rotations: RotationSet | None = None
         self.width: float = width
         self.height: float = height
-        self.pos_display_adjust: Vector2 = Vector2(self.width / 2, self.height / 2)
 
         # Physics-related variables:
         self.position: Vector2 = start_pos
+        # Position before the last update_position call, for drawing in between simulation steps
+        self.previous_position: Vector2 = Vector2(start_pos)
         self.velocity: Vector2 = start_v
         self.acceleration: Vector2 = Vector2(0.0, 0.0)
         self.max_speed: float = max_speed
         self.max_acceleration: float = max_acceleration
-        self.max_acceleration: float = max_acceleration
         self.group_id: int = group_id
         self.interaction_range: int = interaction_range
+        # Ticks since apply_forces was last called, used by the model's mid range simulation tier to scale forces it applies less often
+        self.ticks_since_forces: int = 0
 
     def apply_forces(self, entities: list["GameEntity"], mouse_pos: Vector2) -> None:
         """
         Called in the model's update loop for each entity in the simulation.
         By default, GameEntities don't get any forces applied to them. If you want to automatically apply forces to a GameObject in the model's update loop you have to extend the class and override this method.
-        :param entities: List of GameObject entities that are within range to interact with this entity when calculated forces on it
+        :param entities: List of GameObject entities in the same group that are within range to interact with this entity when calculated forces on it. Other groups can be queried with SpatialPartitioningModel.get_neighborhood
         :param mouse_pos: The current mouse position for this frame
         """
         pass
 
+    def apply_far_forces(self, mouse_pos: Vector2) -> None:
+        """
+        Called instead of apply_forces for entities far away from the camera (see SimulationTier.FAR). Only forces that don't need neighbors should be applied here.
+        By default nothing is applied
+        """
+        pass
+
+    def apply_forces_from_snapshot(
+        self, snapshot: "NeighborhoodSnapshot", mouse_pos: Vector2
+    ) -> None:
+        """
+        Called instead of apply_forces when the model gathers neighbors once per cell. The snapshot holds the neighboring entities plus flat copies of their position, velocity and group.
+        By default this just calls apply_forces with the snapshot's entities, subclasses can override it to work on the flat copies directly
+        """
+        self.apply_forces(snapshot.entities, mouse_pos)
+
+    def apply_forces_from_aggregates(
+        self, neighborhood: "AggregateNeighborhood", mouse_pos: Vector2
+    ) -> None:
+        """
+        Called instead of apply_forces when the model approximates flocking with cell aggregates (see ApproximationMode).
+        By default this just calls apply_forces with every entity of the neighborhood, subclasses can override it to add up whole cells with AggregateNeighborhood.gather
+        """
+        self.apply_forces(neighborhood.get_entities(), mouse_pos)
+
     def update_position(self, world_w: float, world_h: float, dt: float) -> None:
         """
         Updates entities for a single frame.\n
         All coordinates are assumed to represent the center of entities and have an inverted y-axis\n
         By default, an entity's acceleration is set back to 0 after its position is updated
         """
+        self.previous_position.update(self.position)
         self.velocity += self.acceleration
         limit_magnitude(self.velocity, self.max_speed)
         self.position += self.velocity * dt
@@ -73,24 +129,66 @@ class GameEntity:
         """
         Gets the surface of this entity rotated according to its velocity
         """
+        if self.rotations is not None:
+            return self.rotations.surfaces[
+                self.rotations.get_step(self.velocity.x, self.velocity.y)
+            ]
         return pygame.transform.rotate(
             self.surface, math.degrees(math.atan2(self.velocity.y, self.velocity.x))
         )
 
+    def get_byte_size(self) -> int:
+        """
+        Bytes used by this entity itself: the object, its __dict__ if a subclass has one, and its Vector2s. Surfaces, rotations and flocking parameters are shared with other entities and not counted
+        """
+        size: int = sys.getsizeof(self) + sum(
+            map(
+                sys.getsizeof,
+                (
+                    self.position,
+                    self.previous_position,
+                    self.velocity,
+                    self.acceleration,
+                ),
+            )
+        )
+        attributes: dict | None = getattr(self, "__dict__", None)
+        if attributes is not None:
+            size += sys.getsizeof(attributes)
+        return size
+
+    def get_sprite(self) -> tuple[Surface, tuple[float, float]]:
+        """
+        Same as get_surface, but also returns the offset (half width and height) from the entity's center to the top left corner of the surface
+        """
+        rotations: RotationSet | None = self.rotations
+        if rotations is not None:
+            step: int = rotations.get_step(self.velocity.x, self.velocity.y)
+            return rotations.surfaces[step], rotations.offsets[step]
+        surface: Surface = self.get_surface()
+        return surface, (surface.get_width() / 2, surface.get_height() / 2)
+
 
 class RandomSquareEntity(GameEntity):
     """
     A white square with a random starting position and a random starting velocity of magnitude equal to the specified limit
+    :param rng: Random source of the start position and velocity. By default one is seeded from the random module
     """
 
-    def __init__(self, size, velocity, screen_w, screen_h):
+    __slots__ = ("size",)
+
+    def __init__(
+        self, size, velocity, screen_w, screen_h, rng: random.Random | None = None
+    ):
+        if rng is None:
+            rng = random.Random(random.getrandbits(64))
         self.size = size
         color = (255, 255, 255)
         surface = pygame.Surface((self.size, self.size))
         surface.fill(color)
         starting_velocity = Vector2(
-            random.randint(-int(velocity), int(velocity)),
-            random.randint(-int(velocity), int(velocity)),
+            rng.randint(-int(velocity), int(velocity)),
+            rng.randint(-int(velocity), int(velocity)),
         )
         if starting_velocity.magnitude() != 0.0:
             starting_velocity.clamp_magnitude_ip(velocity, velocity)
@@ -99,8 +197,8 @@ class RandomSquareEntity(GameEntity):
             self.size,
             self.size,
             Vector2(
-                random.randint(int(self.size / 2), screen_w - int(self.size / 2)),
-                random.randint(int(self.size / 2), screen_h - int(self.size / 2)),
+                rng.randint(int(self.size / 2), screen_w - int(self.size / 2)),
+                rng.randint(int(self.size / 2), screen_h - int(self.size / 2)),
             ),
             starting_velocity,
             velocity,
@@ -5,6 +5,7 @@ import pygame
 from pygame import Surface, Vector2
 from pygame.key import ScancodeWrapper
 
+from model.utils.assets import AssetKey, asset_cache
 from model.utils.vectorutils import limit_magnitude
 
 
@@ -32,6 +33,8 @@ class Player(ABC):
         self.camera_h_adjust: float = camera_height / 2
         self.world_boundary: Tuple[float, float] = world_boundary
         self.position: Vector2 = start_pos
+        # Position before the last move_player call, for drawing in between simulation steps
+        self.previous_position: Vector2 = Vector2(start_pos)
         self.facing_direction: int = 1
         self.max_speed: float = max_speed
 
@@ -55,6 +58,7 @@ class Player(ABC):
         if key_presses[pygame.K_DOWN]:
             velocity += Vector2(0, -self.max_speed)
         limit_magnitude(velocity, self.max_speed)
+        self.previous_position.update(self.position)
         self.position += velocity * dt
         # Don't let the camera go outside the world boundary
         if self.position.x - self.camera_w_adjust < 0:
@@ -86,27 +90,37 @@ class Player(ABC):
         pass
 
 
+# Sprites of the turtle facing left and right
+TURTLE_SPRITES: Tuple[AssetKey, AssetKey] = (
+    AssetKey("images/turtle-side-left.png", (128.0, 128.0)),
+    AssetKey("images/turtle-side-right.png", (128.0, 128.0)),
+)
+
+
 class Turtle(Player):
+    """
+    :param placeholder_surface: Skip loading the turtle sprites and use a plain surface instead, so that no display mode is needed
+    """
+
     def __init__(
         self,
         camera_width: float,
         camera_height: float,
         world_boundary: Tuple[float, float],
+        placeholder_surface: bool = False,
     ) -> None:
         hitbox_width: float = 100.0
         hitbox_height: float = 100.0
         surface_width: float = 128.0
         surface_height: float = 128.0
-        self.surface_left: Surface = pygame.image.load("images/turtle-side-left.png")
-        self.surface_left = self.surface_left.convert_alpha()
-        self.surface_left = pygame.transform.scale(
-            self.surface_left, (surface_width, surface_height)
-        )
-        self.surface_right: Surface = pygame.image.load("images/turtle-side-right.png")
-        self.surface_right = self.surface_right.convert_alpha()
-        self.surface_right = pygame.transform.scale(
-            self.surface_right, (surface_width, surface_height)
-        )
+        if placeholder_surface:
+            self.surface_left: Surface = pygame.Surface((surface_width, surface_height))
+            self.surface_left.fill((255, 255, 255))
+            self.surface_right: Surface = self.surface_left
+        else:
+            left, right = TURTLE_SPRITES
+            self.surface_left: Surface = asset_cache.get(*left)
+            self.surface_right: Surface = asset_cache.get(*right)
         turtle_speed: float = 500.0
         super().__init__(
             hitbox_width,
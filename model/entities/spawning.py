@@ -0,0 +1,111 @@
+import random
+from enum import Enum
+from typing import TYPE_CHECKING, Tuple
+
+import numpy as np
+from pygame import Vector2
+
+if TYPE_CHECKING:
+    from model.entities.boid import Boid, BoidFactory
+
+
+class SpawnDistribution(Enum):
+    """
+    Where BoidFactory.create_school places the boids of a school.\n
+    UNIFORM: uniformly over the factory's position ranges.\n
+    GAUSSIAN_CLUSTER: normally distributed around a center, by default the flock's target location.\n
+    RING: uniformly over a ring around a center, for example the player
+    """
+
+    UNIFORM = 0
+    GAUSSIAN_CLUSTER = 1
+    RING = 2
+
+
+class School:
+    """
+    Positions and velocities of a batch of boids from one factory, generated for the whole batch at once by BoidFactory.create_school.
+    The Boid objects are only built by create_boids, so a large school can be added to a model a part at a time (see SpatialPartitioningModel.queue_school)
+    :param positions: (count, 2) array of start positions
+    :param velocities: (count, 2) array of start velocities
+    """
+
+    def __init__(
+        self, factory: "BoidFactory", positions: np.ndarray, velocities: np.ndarray
+    ) -> None:
+        self.factory: "BoidFactory" = factory
+        self.positions: np.ndarray = positions
+        self.velocities: np.ndarray = velocities
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def create_boids(self, start: int = 0, stop: int | None = None) -> list["Boid"]:
+        """
+        Builds the boids [start, stop) of the school
+        """
+        create_boid = self.factory.create_boid
+        return [
+            create_boid(Vector2(position), Vector2(velocity))
+            for position, velocity in zip(
+                self.positions[start:stop].tolist(),
+                self.velocities[start:stop].tolist(),
+            )
+        ]
+
+
+def sample_positions(
+    rng: np.random.Generator,
+    count: int,
+    distribution: SpawnDistribution,
+    x_range: Tuple[float, float],
+    y_range: Tuple[float, float],
+    center: Tuple[float, float],
+    spread: float,
+    radius: float,
+) -> np.ndarray:
+    """
+    Returns a (count, 2) array of positions drawn from the distribution. Positions outside of the x and y ranges are wrapped back into them, the same way the world wraps around its edges when the ranges span the world
+    :param spread: Standard deviation of GAUSSIAN_CLUSTER, width of the RING
+    :param radius: Inner radius of the RING
+    """
+    low: np.ndarray = np.array((x_range[0], y_range[0]))
+    size: np.ndarray = np.array((x_range[1] - x_range[0], y_range[1] - y_range[0]))
+    if distribution == SpawnDistribution.UNIFORM:
+        return low + rng.random((count, 2)) * size
+    if distribution == SpawnDistribution.GAUSSIAN_CLUSTER:
+        positions: np.ndarray = rng.normal(center, spread, (count, 2))
+    else:
+        # Uniform over the ring's area, not its radius, so the inner edge isn't denser
+        outer: float = radius + spread
+        distance: np.ndarray = np.sqrt(
+            radius * radius + rng.random(count) * (outer * outer - radius * radius)
+        )
+        angle: np.ndarray = rng.random(count) * 2 * np.pi
+        positions = np.empty((count, 2))
+        positions[:, 0] = center[0] + distance * np.cos(angle)
+        positions[:, 1] = center[1] + distance * np.sin(angle)
+    offsets: np.ndarray = np.mod(positions - low, size)
+    # The modulo of a tiny negative number rounds up to size itself
+    offsets[offsets >= size] = 0.0
+    return low + offsets
+
+
+def sample_velocities(
+    rng: np.random.Generator, count: int, max_speed: float
+) -> np.ndarray:
+    """
+    Returns a (count, 2) array of velocities with both components uniform in [-max_speed, max_speed], limited to max_speed, like BoidFactory.create_random_boid
+    """
+    velocities: np.ndarray = rng.uniform(-max_speed, max_speed, (count, 2))
+    speed: np.ndarray = np.hypot(velocities[:, 0], velocities[:, 1])
+    too_fast: np.ndarray = speed > max_speed
+    velocities[too_fast] *= (max_speed / speed[too_fast])[:, None]
+    return velocities
+
+
+def create_generator(rng: random.Random) -> np.random.Generator:
+    """
+    Returns a NumPy generator seeded from rng, so that seeding rng also makes vectorized spawning reproducible
+    """
+    return np.random.default_rng(rng.getrandbits(64))
@@ -0,0 +1,221 @@
+import numpy as np
+
+from model.entities.entity_arrays import FlockParameterTable
+
+
+def limit_magnitude_rows(vecs: np.ndarray, limits: np.ndarray) -> None:
+    """
+    Row-wise version of vectorutils.limit_magnitude. Clamps the magnitude of every row of the (n, 2) array to the matching limit in place.\n
+    Rows with a magnitude of 0 are left alone
+    """
+    mag: np.ndarray = np.hypot(vecs[:, 0], vecs[:, 1])
+    scale: np.ndarray = np.ones_like(mag)
+    over: np.ndarray = mag > limits
+    scale[over] = limits[over] / mag[over]
+    vecs *= scale[:, None]
+
+
+def safe_normalize_rows(vecs: np.ndarray) -> None:
+    """
+    Row-wise version of vectorutils.safe_normalize. Normalizes every row of the (n, 2) array in place.\n
+    Rows with a magnitude of 0 are left alone
+    """
+    mag: np.ndarray = np.hypot(vecs[:, 0], vecs[:, 1])
+    mag[mag == 0.0] = 1.0
+    vecs /= mag[:, None]
+
+
+def target_rows(
+    target_dir: np.ndarray,
+    k: np.ndarray | float,
+    velocity: np.ndarray,
+    max_speed: np.ndarray,
+    max_acceleration: np.ndarray,
+) -> np.ndarray:
+    """
+    Row-wise version of GameEntity.target. Returns the acceleration that steers each row's velocity towards its target direction.\n
+    target_dir is used as scratch space and is overwritten
+    """
+    safe_normalize_rows(target_dir)
+    target_dir *= max_speed[:, None]
+    target_dir -= velocity
+    limit_magnitude_rows(target_dir, max_acceleration)
+    target_dir *= np.asarray(k)[..., None] if np.ndim(k) else k
+    return target_dir
+
+
+def find_buckets(
+    bucket_keys: np.ndarray,
+    bucket_start: np.ndarray,
+    bucket_count: np.ndarray,
+    keys: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Looks buckets up by key in the ascending keys of the occupied buckets of a CellIndex. Returns the first row and the number of rows of every bucket, no rows for buckets that aren't occupied
+    """
+    if len(bucket_keys) == 0:
+        empty: np.ndarray = np.zeros(len(keys), dtype=np.int64)
+        return empty, empty
+    i: np.ndarray = np.minimum(np.searchsorted(bucket_keys, keys), len(bucket_keys) - 1)
+    found: np.ndarray = bucket_keys[i] == keys
+    return np.where(found, bucket_start[i], 0), np.where(found, bucket_count[i], 0)
+
+
+def flocking_accelerations(
+    position: np.ndarray,
+    velocity: np.ndarray,
+    max_speed: np.ndarray,
+    max_acceleration: np.ndarray,
+    group_id: np.ndarray,
+    group_slot: np.ndarray,
+    interaction_range: np.ndarray,
+    flock_row: np.ndarray,
+    flocks: FlockParameterTable,
+    cell_row: np.ndarray,
+    cell_col: np.ndarray,
+    bucket_keys: np.ndarray,
+    bucket_start: np.ndarray,
+    bucket_count: np.ndarray,
+    n_groups: int,
+    grid_width: int,
+    grid_height: int,
+    rows: np.ndarray,
+) -> np.ndarray:
+    """
+    Batched version of Boid.apply_forces for the given rows.\n
+    All per-entity arrays must be sorted by (cell, group_slot) so that bucket key k = cell * n_groups + group_slot owns one run of rows. bucket_keys lists the occupied buckets in ascending order,
+    and occupied bucket i owns rows bucket_start[i] to bucket_start[i] + bucket_count[i] (see CellIndex).
+    Because boids only flock with their own group, neighbor candidates are read from the entity's own group bucket in each neighboring cell and foreign groups are never touched.
+    Candidates are generated one cell offset at a time as flat (i, j) index pairs, which keeps the temporary arrays proportional to the number of pairs in a single neighboring cell.
+    :param flocks: The FlockParameterTable that flock_row indexes into
+    :return: A (len(rows), 2) array of accelerations
+    """
+    m: int = len(rows)
+    fr: np.ndarray = flock_row[rows]
+    pos: np.ndarray = position[rows]
+    vel: np.ndarray = velocity[rows]
+    speed: np.ndarray = max_speed[rows]
+    max_acc: np.ndarray = max_acceleration[rows]
+    groups: np.ndarray = group_id[rows]
+    slots: np.ndarray = group_slot[rows]
+    ranges: np.ndarray = interaction_range[rows]
+    cohere_distance: np.ndarray = flocks.cohere_distance[fr]
+    cohere_distance2: np.ndarray = cohere_distance * cohere_distance
+    avoid_distance2: np.ndarray = flocks.avoid_distance[fr] ** 2
+    active: np.ndarray = flocks.flocking[fr] & (groups >= 0)
+
+    sum_avoid: np.ndarray = np.zeros((m, 2))
+    sum_align: np.ndarray = np.zeros((m, 2))
+    sum_cohere: np.ndarray = np.zeros((m, 2))
+    count_n: np.ndarray = np.zeros(m)
+    count_s: np.ndarray = np.zeros(m)
+
+    max_range: int = int(ranges[active].max()) if active.any() else 0
+    r: np.ndarray = cell_row[rows]
+    c: np.ndarray = cell_col[rows]
+    for dr in range(-max_range, max_range + 1):
+        for dc in range(-max_range, max_range + 1):
+            reach: int = max(abs(dr), abs(dc))
+            valid: np.ndarray = active & (ranges >= reach)
+            neighbor_cell: np.ndarray = ((r + dr) % grid_height) * grid_width + (
+                (c + dc) % grid_width
+            )
+            starts, counts = find_buckets(
+                bucket_keys,
+                bucket_start,
+                bucket_count,
+                neighbor_cell * n_groups + slots,
+            )
+            counts = np.where(valid, counts, 0)
+            total: int = int(counts.sum())
+            if total == 0:
+                continue
+            # Expand every entity into one (i, j) pair per same-group candidate in the neighboring cell
+            i_local: np.ndarray = np.repeat(np.arange(m), counts)
+            first_pair: np.ndarray = np.cumsum(counts) - counts
+            j: np.ndarray = np.repeat(starts - first_pair, counts)
+            j += np.arange(total)
+            diff: np.ndarray = pos[i_local] - position[j]
+            # Squared distances are compared against squared radii so no square roots are needed
+            d2: np.ndarray = diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1]
+            positive: np.ndarray = d2 > 0
+            cohere: np.ndarray = positive & (d2 < cohere_distance2[i_local])
+            avoid: np.ndarray = positive & (d2 < avoid_distance2[i_local])
+            ic: np.ndarray = i_local[cohere]
+            jc: np.ndarray = j[cohere]
+            count_n += np.bincount(ic, minlength=m)
+            sum_align[:, 0] += np.bincount(ic, velocity[jc, 0], minlength=m)
+            sum_align[:, 1] += np.bincount(ic, velocity[jc, 1], minlength=m)
+            sum_cohere[:, 0] += np.bincount(ic, position[jc, 0], minlength=m)
+            sum_cohere[:, 1] += np.bincount(ic, position[jc, 1], minlength=m)
+            ia: np.ndarray = i_local[avoid]
+            # (diff / |diff|) / d == diff / d^2
+            away: np.ndarray = diff[avoid] / d2[avoid][:, None]
+            count_s += np.bincount(ia, minlength=m)
+            sum_avoid[:, 0] += np.bincount(ia, away[:, 0], minlength=m)
+            sum_avoid[:, 1] += np.bincount(ia, away[:, 1], minlength=m)
+
+    acceleration: np.ndarray = np.zeros((m, 2))
+    s: np.ndarray = count_s > 0
+    if s.any():
+        acceleration[s] += target_rows(
+            sum_avoid[s], flocks.avoid_k[fr[s]], vel[s], speed[s], max_acc[s]
+        )
+    n: np.ndarray = count_n > 0
+    if n.any():
+        acceleration[n] += target_rows(
+            sum_align[n], flocks.align_k[fr[n]], vel[n], speed[n], max_acc[n]
+        )
+        cohere_dir: np.ndarray = sum_cohere[n] / count_n[n][:, None] - pos[n]
+        acceleration[n] += target_rows(
+            cohere_dir, flocks.cohere_k[fr[n]], vel[n], speed[n], max_acc[n]
+        )
+    acceleration += target_seeking_accelerations(pos, vel, speed, max_acc, fr, flocks)
+    return acceleration
+
+
+def target_seeking_accelerations(
+    position: np.ndarray,
+    velocity: np.ndarray,
+    max_speed: np.ndarray,
+    max_acceleration: np.ndarray,
+    flock_row: np.ndarray,
+    flocks: FlockParameterTable,
+) -> np.ndarray:
+    """
+    Batched version of Boid.flock_to_target_location for rows whose flock has a target. Takes arrays of only the rows to compute and returns a matching (n, 2) array of accelerations, 0 for rows without a target
+    """
+    acceleration: np.ndarray = np.zeros((len(flock_row), 2))
+    t: np.ndarray = flocks.flocking[flock_row] & flocks.has_target[flock_row]
+    if t.any():
+        fr: np.ndarray = flock_row[t]
+        target_diff: np.ndarray = flocks.target_location[fr] - position[t]
+        d_target: np.ndarray = np.hypot(target_diff[:, 0], target_diff[:, 1])
+        k_target: np.ndarray = flocks.target_k[fr]
+        k_target = np.where(
+            d_target > flocks.cohere_distance[fr] * 2, k_target, -k_target
+        )
+        acceleration[t] = target_rows(
+            target_diff, k_target, velocity[t], max_speed[t], max_acceleration[t]
+        )
+    return acceleration
+
+
+def integrate(
+    position: np.ndarray,
+    velocity: np.ndarray,
+    acceleration: np.ndarray,
+    max_speed: np.ndarray,
+    world_w: float,
+    world_h: float,
+    dt: float,
+) -> None:
+    """
+    Row-wise version of GameEntity.update_position. Updates all arrays in place and resets acceleration to 0
+    """
+    velocity += acceleration
+    limit_magnitude_rows(velocity, max_speed)
+    position += velocity * dt
+    position[:, 0] = (position[:, 0] + world_w) % world_w
+    position[:, 1] = (position[:, 1] + world_h) % world_h
+    acceleration *= 0.0
@@ -0,0 +1,105 @@
+import threading
+import time
+from typing import Iterable, NamedTuple, Tuple
+
+import pygame
+from pygame import Surface
+
+
+class AssetKey(NamedTuple):
+    """
+    Identifies one loaded sprite: an image file scaled to a size
+    :param alpha: Keep per-pixel alpha (convert_alpha). Without it the surface is converted to the display format without alpha, which blits faster
+    """
+
+    path: str
+    size: Tuple[float, float]
+    alpha: bool = True
+
+
+class AssetCache:
+    """
+    Loads every sprite once. Image files are decoded once per path and every (path, size, alpha) is scaled and converted once, and the same Surface is returned to everyone asking for it.
+    Sharing surfaces also lets entities of different factories share their pre-rendered rotations, see RotationCache.\n
+    Surfaces are converted to the display's pixel format, so blitting them doesn't convert pixels every frame. That needs a display mode to be set when the asset is loaded,
+    without one the surface is kept in the format of the image file.\n
+    Assets can be loaded up front with preload, or on a background thread with preload_in_background. get is safe to call while a background load is running
+    """
+
+    def __init__(self) -> None:
+        # Decoded image files by path, before scaling
+        self.images: dict[str, Surface] = {}
+        self.surfaces: dict[AssetKey, Surface] = {}
+        # Surface -> path of the image file it was loaded from. Lets snapshots store a reference to the image instead of its pixels
+        self._paths: dict[Surface, str] = {}
+        # Seconds spent loading each asset, including decoding its image file if that happened for it
+        self.load_seconds: dict[AssetKey, float] = {}
+        self.hits: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, path: str, size: Tuple[float, float], alpha: bool = True) -> Surface:
+        """
+        Returns the image at path scaled to size, loading it the first time it is asked for
+        """
+        key: AssetKey = AssetKey(path, size, alpha)
+        with self._lock:
+            surface: Surface | None = self.surfaces.get(key)
+            if surface is not None:
+                self.hits += 1
+                return surface
+            return self._load(key)
+
+    def _load(self, key: AssetKey) -> Surface:
+        start: float = time.perf_counter()
+        image: Surface | None = self.images.get(key.path)
+        if image is None:
+            image = pygame.image.load(key.path)
+            self.images[key.path] = image
+        surface: Surface = pygame.transform.scale(image, key.size)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha() if key.alpha else surface.convert()
+        self.surfaces[key] = surface
+        self._paths[surface] = key.path
+        self.load_seconds[key] = time.perf_counter() - start
+        return surface
+
+    def preload(self, manifest: Iterable[AssetKey]) -> None:
+        """
+        Loads every asset of the manifest that isn't loaded yet
+        """
+        for key in manifest:
+            self.get(*key)
+
+    def preload_in_background(self, manifest: Iterable[AssetKey]) -> threading.Thread:
+        """
+        Starts loading the manifest on a daemon thread and returns the thread. Assets asked for with get before the thread reaches them are loaded right away instead
+        """
+        thread: threading.Thread = threading.Thread(
+            target=self.preload, args=(list(manifest),), daemon=True
+        )
+        thread.start()
+        return thread
+
+    def get_path(self, surface: Surface) -> str | None:
+        """
+        Returns the path of the image file a surface was loaded from, or None if it wasn't loaded by this cache
+        """
+        return self._paths.get(surface)
+
+    def get_report(self) -> dict:
+        return {
+            "images": len(self.images),
+            "surfaces": len(self.surfaces),
+            "hits": self.hits,
+            "load_ms": sum(self.load_seconds.values()) * 1000,
+            "slowest_ms": max(self.load_seconds.values(), default=0.0) * 1000,
+            "image_bytes": sum(map(get_surface_bytes, self.images.values())),
+            "surface_bytes": sum(map(get_surface_bytes, self.surfaces.values())),
+        }
+
+
+def get_surface_bytes(surface: Surface) -> int:
+    return surface.get_height() * surface.get_pitch()
+
+
+asset_cache: AssetCache = AssetCache()
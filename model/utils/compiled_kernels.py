@@ -0,0 +1,372 @@
+# Numba compiled versions of the kernels in array_kernels.py.
+# Numba is optional. When it is not installed NUMBA_AVAILABLE is False, the functions in this module are plain Python and the array model falls back to the NumPy kernels.
+# Compiled functions are cached to disk (in __pycache__ next to this file, or in NUMBA_CACHE_DIR if set), so only the first launch pays for JIT compilation
+import math
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+
+    NUMBA_AVAILABLE: bool = True
+except ImportError:
+    NUMBA_AVAILABLE: bool = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+
+@njit(cache=True)
+def limit_magnitude_xy(x: float, y: float, limit: float) -> tuple[float, float]:
+    """
+    Scalar version of vectorutils.limit_magnitude
+    """
+    mag: float = math.sqrt(x * x + y * y)
+    if mag > limit and mag != 0.0:
+        scale: float = limit / mag
+        return x * scale, y * scale
+    return x, y
+
+
+@njit(cache=True)
+def safe_normalize_xy(x: float, y: float) -> tuple[float, float]:
+    """
+    Scalar version of vectorutils.safe_normalize
+    """
+    mag: float = math.sqrt(x * x + y * y)
+    if mag == 0.0:
+        return x, y
+    return x / mag, y / mag
+
+
+@njit(cache=True)
+def target_xy(
+    x: float,
+    y: float,
+    k: float,
+    vx: float,
+    vy: float,
+    max_speed: float,
+    max_acceleration: float,
+) -> tuple[float, float]:
+    """
+    Scalar version of GameEntity.target. Returns the acceleration instead of adding it
+    """
+    x, y = safe_normalize_xy(x, y)
+    x = x * max_speed - vx
+    y = y * max_speed - vy
+    x, y = limit_magnitude_xy(x, y, max_acceleration)
+    return x * k, y * k
+
+
+@njit(cache=True)
+def flocking_acceleration_row(
+    i: int,
+    position: np.ndarray,
+    velocity: np.ndarray,
+    max_speed: np.ndarray,
+    max_acceleration: np.ndarray,
+    group_id: np.ndarray,
+    group_slot: np.ndarray,
+    interaction_range: np.ndarray,
+    flock_row: np.ndarray,
+    flocking: np.ndarray,
+    cohere_distance: np.ndarray,
+    avoid_distance: np.ndarray,
+    cohere_k: np.ndarray,
+    avoid_k: np.ndarray,
+    align_k: np.ndarray,
+    target_k: np.ndarray,
+    has_target: np.ndarray,
+    target_location: np.ndarray,
+    cell_row: np.ndarray,
+    cell_col: np.ndarray,
+    bucket_keys: np.ndarray,
+    bucket_start: np.ndarray,
+    bucket_count: np.ndarray,
+    n_groups: int,
+    grid_width: int,
+    grid_height: int,
+) -> tuple[float, float]:
+    """
+    Flocking and target seeking acceleration of array row i
+    """
+    fr = flock_row[i]
+    ax = 0.0
+    ay = 0.0
+    px = position[i, 0]
+    py = position[i, 1]
+    vx = velocity[i, 0]
+    vy = velocity[i, 1]
+    speed = max_speed[i]
+    max_acc = max_acceleration[i]
+    if flocking[fr] and group_id[i] >= 0:
+        cohere_d2 = cohere_distance[fr] * cohere_distance[fr]
+        avoid_d2 = avoid_distance[fr] * avoid_distance[fr]
+        avoid_x = 0.0
+        avoid_y = 0.0
+        align_x = 0.0
+        align_y = 0.0
+        cohere_x = 0.0
+        cohere_y = 0.0
+        count_n = 0
+        count_s = 0
+        reach = interaction_range[i]
+        slot = group_slot[i]
+        for dr in range(-reach, reach + 1):
+            r = (cell_row[i] + dr) % grid_height
+            # Bucket keys of adjacent cells in a row are close together, so after one binary search the next cells are found by stepping forward over the few occupied buckets in between
+            b = 0
+            previous_key = -1
+            for dc in range(-reach, reach + 1):
+                c = (cell_col[i] + dc) % grid_width
+                key = (r * grid_width + c) * n_groups + slot
+                # Columns that wrap around the right edge start over at a smaller key
+                if key <= previous_key or previous_key < 0:
+                    b = np.searchsorted(bucket_keys, key)
+                else:
+                    while b < len(bucket_keys) and bucket_keys[b] < key:
+                        b += 1
+                previous_key = key
+                if b == len(bucket_keys) or bucket_keys[b] != key:
+                    continue
+                first = bucket_start[b]
+                for j in range(first, first + bucket_count[b]):
+                    dx = px - position[j, 0]
+                    dy = py - position[j, 1]
+                    d2 = dx * dx + dy * dy
+                    if d2 == 0.0:
+                        continue
+                    if d2 < cohere_d2:
+                        align_x += velocity[j, 0]
+                        align_y += velocity[j, 1]
+                        cohere_x += position[j, 0]
+                        cohere_y += position[j, 1]
+                        count_n += 1
+                    if d2 < avoid_d2:
+                        avoid_x += dx / d2
+                        avoid_y += dy / d2
+                        count_s += 1
+        if count_s > 0:
+            tx, ty = target_xy(avoid_x, avoid_y, avoid_k[fr], vx, vy, speed, max_acc)
+            ax += tx
+            ay += ty
+        if count_n > 0:
+            tx, ty = target_xy(align_x, align_y, align_k[fr], vx, vy, speed, max_acc)
+            ax += tx
+            ay += ty
+            tx, ty = target_xy(
+                cohere_x / count_n - px,
+                cohere_y / count_n - py,
+                cohere_k[fr],
+                vx,
+                vy,
+                speed,
+                max_acc,
+            )
+            ax += tx
+            ay += ty
+    if flocking[fr] and has_target[fr]:
+        dx = target_location[fr, 0] - px
+        dy = target_location[fr, 1] - py
+        k = target_k[fr]
+        if math.sqrt(dx * dx + dy * dy) <= cohere_distance[fr] * 2:
+            k = -k
+        tx, ty = target_xy(dx, dy, k, vx, vy, speed, max_acc)
+        ax += tx
+        ay += ty
+    return ax, ay
+
+
+@njit(cache=True, parallel=True)
+def flocking_accelerations_compiled(
+    position: np.ndarray,
+    velocity: np.ndarray,
+    max_speed: np.ndarray,
+    max_acceleration: np.ndarray,
+    group_id: np.ndarray,
+    group_slot: np.ndarray,
+    interaction_range: np.ndarray,
+    flock_row: np.ndarray,
+    flocking: np.ndarray,
+    cohere_distance: np.ndarray,
+    avoid_distance: np.ndarray,
+    cohere_k: np.ndarray,
+    avoid_k: np.ndarray,
+    align_k: np.ndarray,
+    target_k: np.ndarray,
+    has_target: np.ndarray,
+    target_location: np.ndarray,
+    cell_row: np.ndarray,
+    cell_col: np.ndarray,
+    bucket_keys: np.ndarray,
+    bucket_start: np.ndarray,
+    bucket_count: np.ndarray,
+    n_groups: int,
+    grid_width: int,
+    grid_height: int,
+    rows: np.ndarray,
+    out: np.ndarray,
+) -> None:
+    """
+    Compiled version of array_kernels.flocking_accelerations with the flock table passed as its columns. Writes the accelerations of the given rows into out.\n
+    Entities are independent of each other, so the outer loop runs in parallel across cores
+    """
+    for local in prange(len(rows)):
+        out[local, 0], out[local, 1] = flocking_acceleration_row(
+            rows[local],
+            position,
+            velocity,
+            max_speed,
+            max_acceleration,
+            group_id,
+            group_slot,
+            interaction_range,
+            flock_row,
+            flocking,
+            cohere_distance,
+            avoid_distance,
+            cohere_k,
+            avoid_k,
+            align_k,
+            target_k,
+            has_target,
+            target_location,
+            cell_row,
+            cell_col,
+            bucket_keys,
+            bucket_start,
+            bucket_count,
+            n_groups,
+            grid_width,
+            grid_height,
+        )
+
+
+@njit(cache=True)
+def flocking_accelerations_serial(
+    position: np.ndarray,
+    velocity: np.ndarray,
+    max_speed: np.ndarray,
+    max_acceleration: np.ndarray,
+    group_id: np.ndarray,
+    group_slot: np.ndarray,
+    interaction_range: np.ndarray,
+    flock_row: np.ndarray,
+    flocking: np.ndarray,
+    cohere_distance: np.ndarray,
+    avoid_distance: np.ndarray,
+    cohere_k: np.ndarray,
+    avoid_k: np.ndarray,
+    align_k: np.ndarray,
+    target_k: np.ndarray,
+    has_target: np.ndarray,
+    target_location: np.ndarray,
+    cell_row: np.ndarray,
+    cell_col: np.ndarray,
+    bucket_keys: np.ndarray,
+    bucket_start: np.ndarray,
+    bucket_count: np.ndarray,
+    n_groups: int,
+    grid_width: int,
+    grid_height: int,
+    rows: np.ndarray,
+    out: np.ndarray,
+) -> None:
+    """
+    Single threaded version of flocking_accelerations_compiled, for processes that do their own parallelism
+    """
+    for local in range(len(rows)):
+        out[local, 0], out[local, 1] = flocking_acceleration_row(
+            rows[local],
+            position,
+            velocity,
+            max_speed,
+            max_acceleration,
+            group_id,
+            group_slot,
+            interaction_range,
+            flock_row,
+            flocking,
+            cohere_distance,
+            avoid_distance,
+            cohere_k,
+            avoid_k,
+            align_k,
+            target_k,
+            has_target,
+            target_location,
+            cell_row,
+            cell_col,
+            bucket_keys,
+            bucket_start,
+            bucket_count,
+            n_groups,
+            grid_width,
+            grid_height,
+        )
+
+
+@njit(cache=True)
+def integrate_row(
+    i: int,
+    position: np.ndarray,
+    velocity: np.ndarray,
+    acceleration: np.ndarray,
+    max_speed: np.ndarray,
+    world_w: float,
+    world_h: float,
+    dt: float,
+) -> None:
+    vx, vy = limit_magnitude_xy(
+        velocity[i, 0] + acceleration[i, 0],
+        velocity[i, 1] + acceleration[i, 1],
+        max_speed[i],
+    )
+    velocity[i, 0] = vx
+    velocity[i, 1] = vy
+    position[i, 0] = (position[i, 0] + vx * dt + world_w) % world_w
+    position[i, 1] = (position[i, 1] + vy * dt + world_h) % world_h
+    acceleration[i, 0] = 0.0
+    acceleration[i, 1] = 0.0
+
+
+@njit(cache=True, parallel=True)
+def integrate_compiled(
+    position: np.ndarray,
+    velocity: np.ndarray,
+    acceleration: np.ndarray,
+    max_speed: np.ndarray,
+    world_w: float,
+    world_h: float,
+    dt: float,
+) -> None:
+    """
+    Compiled version of array_kernels.integrate
+    """
+    for i in prange(position.shape[0]):
+        integrate_row(
+            i, position, velocity, acceleration, max_speed, world_w, world_h, dt
+        )
+
+
+@njit(cache=True)
+def integrate_serial(
+    position: np.ndarray,
+    velocity: np.ndarray,
+    acceleration: np.ndarray,
+    max_speed: np.ndarray,
+    world_w: float,
+    world_h: float,
+    dt: float,
+) -> None:
+    """
+    Single threaded version of integrate_compiled
+    """
+    for i in range(position.shape[0]):
+        integrate_row(
+            i, position, velocity, acceleration, max_speed, world_w, world_h, dt
+        )
@@ -0,0 +1,364 @@
+# Compiled kernels of SpatialQueries and CollisionSystem. Every kernel answers a whole batch of queries against the sorted cell keys of the query index.
+# Kernels that return a variable number of hits per query write them into caller owned buffers and return how many hits there were in total.
+# When that is more than the buffers hold, nothing past the capacity is written and the caller has to grow the buffers and run the kernel again.
+# Without Numba these run as plain Python loops, see compiled_kernels
+import math
+
+import numpy as np
+
+from model.utils.compiled_kernels import njit
+
+
+@njit(cache=True)
+def get_row_span(
+    keys: np.ndarray, row: int, left: int, right: int, grid_width: int
+) -> tuple[int, int]:
+    """
+    Returns the [start, stop) index rows of the entities in cells left..right of one grid row. Keys are row * grid_width + column, so the cells of a row are one slice
+    """
+    start: int = np.searchsorted(keys, row * grid_width + left)
+    stop: int = np.searchsorted(keys, row * grid_width + right, side="right")
+    return start, stop
+
+
+@njit(cache=True)
+def in_groups(slot: int, group_mask: np.ndarray) -> bool:
+    return slot < len(group_mask) and group_mask[slot]
+
+
+@njit(cache=True)
+def query_radius_kernel(
+    keys: np.ndarray,
+    positions: np.ndarray,
+    slots: np.ndarray,
+    group_mask: np.ndarray,
+    grid_width: int,
+    grid_height: int,
+    cell_size: float,
+    centers: np.ndarray,
+    radii: np.ndarray,
+    offsets: np.ndarray,
+    out_rows: np.ndarray,
+    out_values: np.ndarray,
+) -> int:
+    """
+    Finds the entities at most radii[q] from centers[q]. The value of every hit is its distance
+    """
+    total: int = 0
+    capacity: int = len(out_rows)
+    for q in range(len(centers)):
+        offsets[q] = total
+        x: float = centers[q, 0]
+        y: float = centers[q, 1]
+        radius: float = radii[q]
+        r2: float = radius * radius
+        left: int = max(int(math.floor((x - radius) / cell_size)), 0)
+        right: int = min(int(math.floor((x + radius) / cell_size)), grid_width - 1)
+        bottom: int = max(int(math.floor((y - radius) / cell_size)), 0)
+        top: int = min(int(math.floor((y + radius) / cell_size)), grid_height - 1)
+        for row in range(bottom, top + 1):
+            start, stop = get_row_span(keys, row, left, right, grid_width)
+            for j in range(start, stop):
+                if not in_groups(slots[j], group_mask):
+                    continue
+                dx: float = positions[j, 0] - x
+                dy: float = positions[j, 1] - y
+                d2: float = dx * dx + dy * dy
+                if d2 <= r2:
+                    if total < capacity:
+                        out_rows[total] = j
+                        out_values[total] = math.sqrt(d2)
+                    total += 1
+    offsets[len(centers)] = total
+    return total
+
+
+@njit(cache=True)
+def query_aabb_kernel(
+    keys: np.ndarray,
+    positions: np.ndarray,
+    slots: np.ndarray,
+    group_mask: np.ndarray,
+    grid_width: int,
+    grid_height: int,
+    cell_size: float,
+    mins: np.ndarray,
+    maxs: np.ndarray,
+    offsets: np.ndarray,
+    out_rows: np.ndarray,
+    out_values: np.ndarray,
+) -> int:
+    """
+    Finds the entities inside the boxes mins[q] to maxs[q], edges included. The value of every hit is 0
+    """
+    total: int = 0
+    capacity: int = len(out_rows)
+    for q in range(len(mins)):
+        offsets[q] = total
+        min_x: float = mins[q, 0]
+        min_y: float = mins[q, 1]
+        max_x: float = maxs[q, 0]
+        max_y: float = maxs[q, 1]
+        left: int = max(int(math.floor(min_x / cell_size)), 0)
+        right: int = min(int(math.floor(max_x / cell_size)), grid_width - 1)
+        bottom: int = max(int(math.floor(min_y / cell_size)), 0)
+        top: int = min(int(math.floor(max_y / cell_size)), grid_height - 1)
+        for row in range(bottom, top + 1):
+            start, stop = get_row_span(keys, row, left, right, grid_width)
+            for j in range(start, stop):
+                px: float = positions[j, 0]
+                py: float = positions[j, 1]
+                if (
+                    min_x <= px <= max_x
+                    and min_y <= py <= max_y
+                    and in_groups(slots[j], group_mask)
+                ):
+                    if total < capacity:
+                        out_rows[total] = j
+                        out_values[total] = 0.0
+                    total += 1
+    offsets[len(mins)] = total
+    return total
+
+
+@njit(cache=True)
+def query_segment_kernel(
+    keys: np.ndarray,
+    positions: np.ndarray,
+    slots: np.ndarray,
+    group_mask: np.ndarray,
+    grid_width: int,
+    grid_height: int,
+    cell_size: float,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    radii: np.ndarray,
+    offsets: np.ndarray,
+    out_rows: np.ndarray,
+    out_values: np.ndarray,
+) -> int:
+    """
+    Finds the entities at most radii[q] from the segment starts[q] to ends[q]. The value of every hit is how far along the segment its closest point is, from 0 at the start to 1 at the end,
+    and each query's hits are sorted by it.\n
+    Only the columns the segment crosses in each grid row are visited, so long diagonal sweeps don't scan their whole bounding box
+    """
+    total: int = 0
+    capacity: int = len(out_rows)
+    for q in range(len(starts)):
+        offsets[q] = total
+        ax: float = starts[q, 0]
+        ay: float = starts[q, 1]
+        dx: float = ends[q, 0] - ax
+        dy: float = ends[q, 1] - ay
+        radius: float = radii[q]
+        r2: float = radius * radius
+        length2: float = dx * dx + dy * dy
+        bottom: int = max(int(math.floor((min(ay, ay + dy) - radius) / cell_size)), 0)
+        top: int = min(
+            int(math.floor((max(ay, ay + dy) + radius) / cell_size)), grid_height - 1
+        )
+        for row in range(bottom, top + 1):
+            # Part of the segment within reach of the row's band of y
+            t_first: float = 0.0
+            t_last: float = 1.0
+            if dy != 0.0:
+                t_a: float = (row * cell_size - radius - ay) / dy
+                t_b: float = ((row + 1) * cell_size + radius - ay) / dy
+                t_first = max(min(t_a, t_b), 0.0)
+                t_last = min(max(t_a, t_b), 1.0)
+                if t_first > t_last:
+                    continue
+            x_first: float = ax + dx * t_first
+            x_last: float = ax + dx * t_last
+            left: int = max(
+                int(math.floor((min(x_first, x_last) - radius) / cell_size)), 0
+            )
+            right: int = min(
+                int(math.floor((max(x_first, x_last) + radius) / cell_size)),
+                grid_width - 1,
+            )
+            start, stop = get_row_span(keys, row, left, right, grid_width)
+            for j in range(start, stop):
+                if not in_groups(slots[j], group_mask):
+                    continue
+                px: float = positions[j, 0] - ax
+                py: float = positions[j, 1] - ay
+                t: float = 0.0
+                if length2 > 0.0:
+                    t = min(max((px * dx + py * dy) / length2, 0.0), 1.0)
+                ex: float = px - dx * t
+                ey: float = py - dy * t
+                if ex * ex + ey * ey <= r2:
+                    if total < capacity:
+                        # Insertion sort by t into the query's hits so far
+                        k: int = total
+                        while k > offsets[q] and out_values[k - 1] > t:
+                            out_rows[k] = out_rows[k - 1]
+                            out_values[k] = out_values[k - 1]
+                            k -= 1
+                        out_rows[k] = j
+                        out_values[k] = t
+                    total += 1
+    offsets[len(starts)] = total
+    return total
+
+
+@njit(cache=True)
+def query_nearest_kernel(
+    keys: np.ndarray,
+    positions: np.ndarray,
+    slots: np.ndarray,
+    group_mask: np.ndarray,
+    grid_width: int,
+    grid_height: int,
+    cell_size: float,
+    centers: np.ndarray,
+    max_distances: np.ndarray,
+    out_rows: np.ndarray,
+    out_distances: np.ndarray,
+) -> None:
+    """
+    Finds the k nearest entities to every center, at most max_distances[q] away, with k the number of columns of out_rows. Hits are sorted by distance, missing ones are -1 with a distance of inf.\n
+    Cells are searched in rings of growing distance around the center's cell, and the search stops once no cell outside of the rings searched can hold anything closer than the k-th hit
+    """
+    k: int = out_rows.shape[1]
+    for q in range(len(centers)):
+        x: float = centers[q, 0]
+        y: float = centers[q, 1]
+        max_d2: float = max_distances[q] * max_distances[q]
+        for i in range(k):
+            out_rows[q, i] = -1
+            out_distances[q, i] = math.inf
+        found: int = 0
+        col: int = min(max(int(math.floor(x / cell_size)), 0), grid_width - 1)
+        row: int = min(max(int(math.floor(y / cell_size)), 0), grid_height - 1)
+        ring: int = 0
+        while True:
+            for r in range(max(row - ring, 0), min(row + ring, grid_height - 1) + 1):
+                edge: bool = r == row - ring or r == row + ring
+                left: int = col - ring
+                right: int = col + ring
+                # Rows inside the ring only have its left and right cells
+                for span in range(1 if edge else 2):
+                    first: int = left if edge or span == 0 else right
+                    last: int = right if edge or span == 1 else left
+                    first = max(first, 0)
+                    last = min(last, grid_width - 1)
+                    if first > last:
+                        continue
+                    start, stop = get_row_span(keys, r, first, last, grid_width)
+                    for j in range(start, stop):
+                        if not in_groups(slots[j], group_mask):
+                            continue
+                        dx: float = positions[j, 0] - x
+                        dy: float = positions[j, 1] - y
+                        d2: float = dx * dx + dy * dy
+                        if d2 > max_d2 or d2 >= out_distances[q, k - 1]:
+                            continue
+                        i = min(found, k - 1)
+                        while i > 0 and out_distances[q, i - 1] > d2:
+                            out_rows[q, i] = out_rows[q, i - 1]
+                            out_distances[q, i] = out_distances[q, i - 1]
+                            i -= 1
+                        out_rows[q, i] = j
+                        out_distances[q, i] = d2
+                        found = min(found + 1, k)
+            # Distance from the center to the nearest cell outside of the rings searched so far
+            reach: float = min(
+                x - (col - ring) * cell_size,
+                (col + ring + 1) * cell_size - x,
+                y - (row - ring) * cell_size,
+                (row + ring + 1) * cell_size - y,
+            )
+            reach2: float = reach * reach if reach > 0.0 else 0.0
+            covered: bool = (
+                row - ring <= 0
+                and col - ring <= 0
+                and row + ring >= grid_height - 1
+                and col + ring >= grid_width - 1
+            )
+            if (
+                covered
+                or reach2 > max_d2
+                or (found == k and reach2 >= out_distances[q, k - 1])
+            ):
+                break
+            ring += 1
+        for i in range(found):
+            out_distances[q, i] = math.sqrt(out_distances[q, i])
+
+
+@njit(cache=True)
+def collide_kernel(
+    keys: np.ndarray,
+    positions: np.ndarray,
+    slots: np.ndarray,
+    grid_width: int,
+    grid_height: int,
+    cell_size: float,
+    centers: np.ndarray,
+    extents: np.ndarray,
+    circles: np.ndarray,
+    layers: np.ndarray,
+    layer_masks: np.ndarray,
+    slot_radii: np.ndarray,
+    max_radius: float,
+    offsets: np.ndarray,
+    out_rows: np.ndarray,
+    out_values: np.ndarray,
+) -> int:
+    """
+    Finds the entities that overlap each collider. Entities are circles with the radius of their group slot. Colliders are boxes with half sizes extents[q],
+    or circles with radius extents[q, 0] where circles[q] is set. Only entities whose group slot is set in the collider's row of layer_masks are tested.
+    The value of every contact is how deep the entity reaches into the collider
+    """
+    total: int = 0
+    capacity: int = len(out_rows)
+    for q in range(len(centers)):
+        offsets[q] = total
+        x: float = centers[q, 0]
+        y: float = centers[q, 1]
+        circle: bool = circles[q]
+        half_w: float = extents[q, 0]
+        half_h: float = extents[q, 0] if circle else extents[q, 1]
+        mask: np.ndarray = layer_masks[layers[q]]
+        left: int = max(int(math.floor((x - half_w - max_radius) / cell_size)), 0)
+        right: int = min(
+            int(math.floor((x + half_w + max_radius) / cell_size)), grid_width - 1
+        )
+        bottom: int = max(int(math.floor((y - half_h - max_radius) / cell_size)), 0)
+        top: int = min(
+            int(math.floor((y + half_h + max_radius) / cell_size)), grid_height - 1
+        )
+        for row in range(bottom, top + 1):
+            start, stop = get_row_span(keys, row, left, right, grid_width)
+            for j in range(start, stop):
+                slot: int = slots[j]
+                if not in_groups(slot, mask):
+                    continue
+                radius: float = slot_radii[slot]
+                dx: float = positions[j, 0] - x
+                dy: float = positions[j, 1] - y
+                depth: float = -1.0
+                if circle:
+                    reach: float = half_w + radius
+                    d2: float = dx * dx + dy * dy
+                    if d2 <= reach * reach:
+                        depth = reach - math.sqrt(d2)
+                else:
+                    # Offset from the closest point of the box
+                    ox: float = dx - min(max(dx, -half_w), half_w)
+                    oy: float = dy - min(max(dy, -half_h), half_h)
+                    d2 = ox * ox + oy * oy
+                    if d2 == 0.0:
+                        # Center inside of the box
+                        depth = radius + min(half_w - abs(dx), half_h - abs(dy))
+                    elif d2 <= radius * radius:
+                        depth = radius - math.sqrt(d2)
+                if depth >= 0.0:
+                    if total < capacity:
+                        out_rows[total] = j
+                        out_values[total] = depth
+                    total += 1
+    offsets[len(centers)] = total
+    return total
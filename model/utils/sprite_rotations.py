@@ -0,0 +1,106 @@
+import math
+from typing import Tuple
+
+import numpy as np
+import pygame
+from pygame import Surface
+
+# Number of pre-rendered angles per sprite unless a factory asks for something else
+DEFAULT_ANGLE_COUNT: int = 64
+
+
+class RotationSet:
+    """
+    A sprite pre-rendered at angle_count evenly spaced angles, so drawing a rotated entity is a list lookup instead of a pygame.transform.rotate call that allocates a new Surface.\n
+    Also keeps the blit offset (half the width and height) of every rotation, so callers don't have to query the surface size every frame
+    """
+
+    def __init__(self, surface: Surface, angle_count: int) -> None:
+        self.source: Surface = surface
+        self.angle_count: int = angle_count
+        self.steps_per_radian: float = angle_count / (2 * math.pi)
+        degrees_per_step: float = 360 / angle_count
+        self.surfaces: list[Surface] = [
+            pygame.transform.rotate(surface, step * degrees_per_step)
+            for step in range(angle_count)
+        ]
+        self.offsets: list[Tuple[float, float]] = [
+            (rotated.get_width() / 2, rotated.get_height() / 2)
+            for rotated in self.surfaces
+        ]
+        # Same as offsets, as an (angle_count, 2) array for looking up many offsets at once
+        self.offset_array: np.ndarray = np.array(self.offsets, dtype=np.float64)
+        self.byte_size: int = sum(get_byte_size(rotated) for rotated in self.surfaces)
+
+    def get_step(self, x: float, y: float) -> int:
+        """
+        Returns the index of the pre-rendered angle closest to the direction (x, y)
+        """
+        return round(math.atan2(y, x) * self.steps_per_radian) % self.angle_count
+
+    def get_steps(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        Vectorized get_step for arrays of directions
+        """
+        return (
+            np.rint(np.arctan2(y, x) * self.steps_per_radian).astype(np.int64)
+            % self.angle_count
+        )
+
+
+class RotationCache:
+    """
+    Shared store of RotationSets, so every factory (and every entity) using the same surface shares one set.\n
+    Total memory is bounded by max_bytes. When a new set doesn't fit, get_rotations returns None and entities fall back to rotating their surface every frame
+    :param max_bytes: Memory budget for all pre-rendered rotations
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.max_bytes: int = max_bytes
+        # (id of the source surface, angle count) -> rotations. Each set keeps its source surface alive, so ids aren't reused while cached
+        self.sets: dict[Tuple[int, int], RotationSet] = {}
+        # Keys of sets that didn't fit, with their source surface so the id isn't reused. They are never rendered again
+        self.rejected_sets: dict[Tuple[int, int], Surface] = {}
+        self.byte_size: int = 0
+        self.rejected: int = 0
+
+    def get_rotations(self, surface: Surface, angle_count: int) -> RotationSet | None:
+        if angle_count <= 0:
+            return None
+        key: Tuple[int, int] = (id(surface), angle_count)
+        rotations: RotationSet | None = self.sets.get(key)
+        if rotations is None:
+            if key in self.rejected_sets:
+                return None
+            # A rotated surface is never smaller than its source, so sets that can't fit are rejected before rendering them
+            if self.byte_size + angle_count * get_byte_size(surface) > self.max_bytes:
+                return self.reject(key, surface)
+            rotations = RotationSet(surface, angle_count)
+            if self.byte_size + rotations.byte_size > self.max_bytes:
+                return self.reject(key, surface)
+            self.sets[key] = rotations
+            self.byte_size += rotations.byte_size
+        return rotations
+
+    def reject(self, key: Tuple[int, int], surface: Surface) -> None:
+        self.rejected_sets[key] = surface
+        self.rejected += 1
+        return None
+
+    def get_report(self) -> dict[str, int]:
+        return {
+            "sets": len(self.sets),
+            "surfaces": sum(
+                len(rotations.surfaces) for rotations in self.sets.values()
+            ),
+            "bytes": self.byte_size,
+            "max_bytes": self.max_bytes,
+            "rejected_sets": self.rejected,
+        }
+
+
+def get_byte_size(surface: Surface) -> int:
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+
+rotation_cache: RotationCache = RotationCache()
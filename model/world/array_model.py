@@ -0,0 +1,513 @@
+from enum import Enum
+from typing import Callable, Tuple
+
+import numpy as np
+from pygame import Vector2
+
+from model.entities.entity_arrays import EntityArrays, FlockParameterTable
+from model.entities.gameentity import GameEntity
+from model.entities.player import Player
+from model.utils.array_kernels import (
+    flocking_accelerations,
+    integrate,
+    target_seeking_accelerations,
+)
+from model.utils.sprite_rotations import RotationSet
+from model.utils.compiled_kernels import (
+    NUMBA_AVAILABLE,
+    flocking_accelerations_compiled,
+    flocking_accelerations_serial,
+    integrate_compiled,
+    integrate_serial,
+)
+from model.world.cell_index import CellIndex
+from model.world.lod import SimulationTier, TierGrid
+from model.world.spatial_partitioning_model import (
+    GridMode,
+    SpatialPartitioningModel,
+)
+
+
+class KernelBackend(Enum):
+    """
+    Which kernels the array model runs.\n
+    AUTO: COMPILED when Numba is installed, otherwise NUMPY.\n
+    NUMPY: batched NumPy operations, see array_kernels.\n
+    COMPILED: Numba JIT compiled loops, see compiled_kernels
+    """
+
+    AUTO = 0
+    NUMPY = 1
+    COMPILED = 2
+
+
+class ArraySpatialPartitioningModel(SpatialPartitioningModel):
+    """
+    Structure-of-arrays backend for the spatial partitioning model.\n
+    Entity physics state lives in contiguous NumPy arrays (see EntityArrays) instead of on each GameEntity, and flocking, target seeking and integration run as batched array operations over cell neighborhoods.
+    The rows are kept sorted by grid cell with a CellIndex, so every cell's entities are one contiguous slice of the arrays.\n
+    GameEntity objects are still kept for drawing. Their position and velocity are only written back when they are returned from get_entities_in_range, so the cost of syncing scales with what is on screen instead of with the world.
+    Only entities that extend Boid have flocking forces applied, matching the object model.
+    :param kernel_backend: Which kernels to run, see KernelBackend
+    """
+
+    def __init__(
+        self,
+        world_width: float,
+        world_height: float,
+        cell_size: float,
+        player: Player,
+        kernel_backend: KernelBackend = KernelBackend.AUTO,
+    ):
+        super().__init__(
+            world_width, world_height, cell_size, player, GridMode.SORTED_INDEX
+        )
+        # self.entities is indexed by entity id and is never reordered, the arrays are
+        self.arrays: EntityArrays = EntityArrays()
+        self.flocks: FlockParameterTable = FlockParameterTable()
+        if kernel_backend == KernelBackend.AUTO:
+            kernel_backend = (
+                KernelBackend.COMPILED if NUMBA_AVAILABLE else KernelBackend.NUMPY
+            )
+        if kernel_backend == KernelBackend.COMPILED and not NUMBA_AVAILABLE:
+            raise ImportError("KernelBackend.COMPILED requires numba to be installed")
+        self.kernel_backend: KernelBackend = kernel_backend
+        # Distinct sprite rotation sets, and which one every entity (by entity id) uses, -1 for none. Lets the view pick sprites for many rows at once
+        self.sprite_sets: list[RotationSet] = []
+        self._sprite_set_ids: dict[int, int] = {}
+        self._entity_sprite_sets: list[int] = []
+        self._entity_sprite_set_array: np.ndarray = np.zeros(0, dtype=np.int64)
+
+    def apply_forces(self, mouse_pos: Vector2) -> None:
+        a: EntityArrays = self.arrays
+        n: int = a.count
+        self.flocks.refresh_targets()
+        self.tick += 1
+        rows: np.ndarray | None = self.apply_tiers()
+        self.count_pairs_tested(rows is not None)
+        # Every acceleration is computed from the same snapshot of positions and velocities
+        if rows is None:
+            a.acceleration[:n] += self.compute_accelerations(np.arange(n))
+        else:
+            a.acceleration[rows] += (
+                self.compute_accelerations(rows) * a.force_scale[rows, None]
+            )
+
+    def apply_tiers(self) -> np.ndarray | None:
+        """
+        Works out the SimulationTier of every row. Far rows get their target seeking acceleration right away, and force_scale is set to the flocking multiplier of every row (0 for rows that don't flock this tick).\n
+        Returns the rows that flock this tick, or None when simulation tiers are off and every row flocks
+        """
+        a: EntityArrays = self.arrays
+        n: int = a.count
+        if self.lod is None:
+            self.tier_counts = [n, 0, 0]
+            return None
+        self.ensure_cell_index()
+        tier_grid: TierGrid = self.lod
+        tier_grid.update(self.get_camera_cells())
+        cell_row: np.ndarray = self.cell_index.cell_row[:n]
+        cell_col: np.ndarray = self.cell_index.cell_col[:n]
+        tiers: np.ndarray = tier_grid.get_tiers(cell_row, cell_col)
+        self.tier_counts = np.bincount(tiers, minlength=3).tolist()
+        flocking: np.ndarray = tier_grid.get_flocking(
+            cell_row, cell_col, tiers, self.tick
+        )
+        ticks: np.ndarray = a.ticks_since_forces[:n]
+        ticks += 1
+        scale: np.ndarray = a.force_scale[:n]
+        scale[:] = 0.0
+        scale[flocking] = np.minimum(ticks[flocking], tier_grid.settings.mid_interval)
+        ticks[flocking] = 0
+        far: np.ndarray = np.flatnonzero(tiers == SimulationTier.FAR.value)
+        ticks[far] = 0
+        if len(far) > 0:
+            a.acceleration[far] += target_seeking_accelerations(
+                a.position[far],
+                a.velocity[far],
+                a.max_speed[far],
+                a.max_acceleration[far],
+                a.flock_row[far],
+                self.flocks,
+            )
+        return np.flatnonzero(flocking)
+
+    def count_pairs_tested(self, tiered: bool = False) -> None:
+        """
+        Sets pairs_tested to the number of pairs the flocking kernel tests this frame when count_statistics is on. The kernels don't count, so this is worked out from the cell index
+        :param tiered: Only count rows with a force_scale, see apply_tiers
+        """
+        if not self.count_statistics:
+            self.pairs_tested = 0
+            return
+        a: EntityArrays = self.arrays
+        n: int = a.count
+        flocking: np.ndarray = self.flocks.flocking[a.flock_row[:n]] & (
+            a.group_id[:n] >= 0
+        )
+        if tiered:
+            flocking &= a.force_scale[:n] > 0
+        self.pairs_tested = self.cell_index.count_bucket_neighbors(
+            np.where(flocking, a.interaction_range[:n], -1), a.group_slot[:n]
+        )
+
+    def move_entities(self, dt: float) -> None:
+        self.save_previous_positions()
+        self.integrate_rows(0, self.arrays.count, dt)
+
+    def save_previous_positions(self) -> None:
+        n: int = self.arrays.count
+        self.arrays.previous_position[:n] = self.arrays.position[:n]
+
+    def migrate_entities(self) -> None:
+        # Entities that moved into new grid cells are handled by re-sorting every row by cell
+        self.rebuild_cell_index()
+        self.cells_migrated = self.cell_index.moved_count
+
+    def compute_accelerations(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Returns the flocking and target seeking accelerations of the given array rows. The cell index must be up to date
+        """
+        return run_flocking_kernel(
+            self.kernel_backend,
+            self.arrays,
+            self.flocks,
+            self.cell_index,
+            rows,
+        )
+
+    def integrate_rows(self, start: int, stop: int, dt: float) -> None:
+        """
+        Applies acceleration to velocity and velocity to position for the array rows in [start, stop), wrapping around the world edges
+        """
+        run_integration_kernel(
+            self.kernel_backend,
+            self.arrays,
+            start,
+            stop,
+            self.world_width,
+            self.world_height,
+            dt,
+        )
+
+    def rebuild_cell_index(self) -> None:
+        """
+        Recomputes every entity's grid cell and reorders the entity arrays so that each cell's entities are contiguous, and within a cell each group's entities are contiguous
+        """
+        a: EntityArrays = self.arrays
+        n: int = a.count
+        order: np.ndarray = self.cell_index.rebuild(
+            (a.position[:n, 1] / self.cell_size).astype(np.int64),
+            (a.position[:n, 0] / self.cell_size).astype(np.int64),
+            a.group_slot[:n],
+            max(len(self.group_slots), 1),
+        )
+        a.permute(order)
+        self._index_dirty = False
+
+    def apply_forces_to_entity(self, entity: GameEntity, mouse_pos: Vector2) -> None:
+        """
+        Runs the flocking kernel over the entity's row alone and adds the result to its acceleration, in the arrays and on the entity
+        """
+        self.ensure_cell_index()
+        rows: np.ndarray = np.array([self.get_entity_row(entity)])
+        self.arrays.acceleration[rows] += self.compute_accelerations(rows)
+        self.sync_entities(rows)
+
+    def get_entity_row(self, entity: GameEntity) -> int:
+        """
+        Returns the array row of an entity. It is looked for in the grid cell of its position, so the entity has to be where the model last synced it (see sync_entities)
+        """
+        start, stop = self.cell_index.get_row_span(
+            int(entity.position.y / self.cell_size),
+            int(entity.position.x / self.cell_size),
+            int(entity.position.x / self.cell_size),
+        )
+        for row, entity_id in enumerate(
+            self.arrays.entity_id[start:stop].tolist(), start
+        ):
+            if self.entities[entity_id] is entity:
+                return row
+        raise ValueError("The entity is not in the model at its position")
+
+    def get_cell_entities(self, r: int, c: int) -> list[GameEntity]:
+        self.ensure_cell_index()
+        return self.sync_entities(np.arange(*self.cell_index.get_row_span(r, c, c)))
+
+    def get_neighborhood(self, r: int, c: int, cell_range: int) -> list[GameEntity]:
+        self.ensure_cell_index()
+        return self.sync_entities(
+            self._spans_to_rows(
+                self.cell_index.get_neighborhood_spans(r, c, cell_range)
+            )
+        )
+
+    def get_group_neighborhood(
+        self, r: int, c: int, cell_range: int, group_id: int
+    ) -> list[GameEntity]:
+        self.ensure_cell_index()
+        slot: int | None = self.group_slots.get(group_id)
+        if slot is None:
+            return []
+        return self.sync_entities(
+            self._spans_to_rows(
+                self.cell_index.get_bucket_neighborhood_spans(r, c, cell_range, slot)
+            )
+        )
+
+    @staticmethod
+    def _spans_to_rows(spans: list[tuple[int, int]]) -> np.ndarray:
+        return np.concatenate([np.arange(start, stop) for start, stop in spans])
+
+    def add_game_entity(self, entity: GameEntity) -> None:
+        group_slot: int = self.group_slots.setdefault(
+            entity.group_id, len(self.group_slots)
+        )
+        self.arrays.append(
+            entity, len(self.entities), self.flocks.get_row(entity), group_slot
+        )
+        self.entities.append(entity)
+        self.entity_count += 1
+        self._index_dirty = True
+        self._entity_sprite_sets.append(self.get_sprite_set_id(entity.rotations))
+
+    def add_game_entities(self, entities: list[GameEntity]) -> None:
+        if not entities:
+            return
+        group_slots: list[int] = []
+        flock_rows: list[int] = []
+        sprite_sets: list[int] = []
+        # A batch usually comes from a few factories, so the rows and ids are looked up once per distinct (type, group, flock, rotations)
+        rows_by_key: dict[Tuple[type, int, int, int], Tuple[int, int, int]] = {}
+        for entity in entities:
+            key: Tuple[type, int, int, int] = (
+                type(entity),
+                entity.group_id,
+                id(getattr(entity, "flocking_parameters", None)),
+                id(entity.rotations),
+            )
+            rows: Tuple[int, int, int] | None = rows_by_key.get(key)
+            if rows is None:
+                rows = (
+                    self.group_slots.setdefault(entity.group_id, len(self.group_slots)),
+                    self.flocks.get_row(entity),
+                    self.get_sprite_set_id(entity.rotations),
+                )
+                rows_by_key[key] = rows
+            group_slots.append(rows[0])
+            flock_rows.append(rows[1])
+            sprite_sets.append(rows[2])
+        self.arrays.append_many(entities, len(self.entities), flock_rows, group_slots)
+        self.entities.extend(entities)
+        self.entity_count += len(entities)
+        self._index_dirty = True
+        self._entity_sprite_sets.extend(sprite_sets)
+
+    def get_sprite_set_id(self, rotations: RotationSet | None) -> int:
+        """
+        Returns the index of the rotations in sprite_sets, adding them the first time they are seen, or -1 for None
+        """
+        if rotations is None:
+            return -1
+        sprite_set: int = self._sprite_set_ids.setdefault(
+            id(rotations), len(self.sprite_sets)
+        )
+        if sprite_set == len(self.sprite_sets):
+            self.sprite_sets.append(rotations)
+        return sprite_set
+
+    def adopt_rows(
+        self,
+        columns: dict[str, np.ndarray],
+        count: int,
+        entities: list[GameEntity],
+        sprite_set_ids: np.ndarray,
+    ) -> None:
+        """
+        Fills an empty model with count rows of entity columns, for example memory-mapped from a snapshot, instead of adding the entities one by one.
+        group_slots and flocks have to be set up to match the group_slot and flock_row columns beforehand
+        :param entities: The GameEntity of every entity id. Can be a list that creates them on demand
+        :param sprite_set_ids: Index into sprite_sets (see get_sprite_set_id) of every entity id
+        """
+        self.arrays.adopt_columns(columns, count)
+        self.entities = entities
+        self.entity_count = count
+        self._entity_sprite_set_array = sprite_set_ids
+        self._entity_sprite_sets = sprite_set_ids.tolist()
+        self._index_dirty = True
+
+    def get_sprite_set_ids(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Returns for every given array row the index into sprite_sets of its entity's rotations, or -1 if it has none
+        """
+        if len(self._entity_sprite_set_array) != len(self._entity_sprite_sets):
+            self._entity_sprite_set_array = np.array(
+                self._entity_sprite_sets, dtype=np.int64
+            )
+        return self._entity_sprite_set_array[self.arrays.entity_id[rows]]
+
+    def get_entity_rows_in_range(
+        self, x_range: Tuple[float, float], y_range: Tuple[float, float]
+    ) -> np.ndarray:
+        """
+        Returns the array rows of all entities in the grid cells within the x, y range specified
+        """
+        self.ensure_cell_index()
+        return self.cell_index.get_slots_in_range(
+            int(x_range[0] / self.cell_size),
+            int(x_range[1] / self.cell_size),
+            int(y_range[0] / self.cell_size),
+            int(y_range[1] / self.cell_size),
+        )
+
+    def get_entities_in_range(
+        self, x_range: Tuple[float, float], y_range: Tuple[float, float]
+    ) -> list[GameEntity]:
+        """
+        Finds the grid cells that are within the x, y range specified and returns all entities in those grid cells.\n
+        The returned entities have their position and velocity synced from the entity arrays
+        """
+        return self.sync_entities(self.get_entity_rows_in_range(x_range, y_range))
+
+    def get_all_entities(self) -> list[GameEntity]:
+        return self.sync_entities()
+
+    def get_entity_state(self) -> np.ndarray:
+        n: int = self.arrays.count
+        return np.hstack((self.arrays.position[:n], self.arrays.velocity[:n]))
+
+    def get_query_source(
+        self,
+    ) -> Tuple[np.ndarray, np.ndarray, Callable[[np.ndarray], list[GameEntity]]]:
+        """
+        Returns views of the position and group slot columns, which are already sorted by cell
+        """
+        self.ensure_cell_index()
+        n: int = self.arrays.count
+        return self.arrays.position[:n], self.arrays.group_slot[:n], self.sync_entities
+
+    def sync_entities(self, rows: np.ndarray | None = None) -> list[GameEntity]:
+        """
+        Writes position, previous position, velocity and acceleration from the entity arrays back into the GameEntity objects for the given rows (default all rows) and returns those entities
+        """
+        a: EntityArrays = self.arrays
+        if rows is None:
+            rows = np.arange(a.count)
+        entities: list[GameEntity] = []
+        for entity_id, pos, previous, vel, acc in zip(
+            a.entity_id[rows].tolist(),
+            a.position[rows].tolist(),
+            a.previous_position[rows].tolist(),
+            a.velocity[rows].tolist(),
+            a.acceleration[rows].tolist(),
+        ):
+            entity: GameEntity = self.entities[entity_id]
+            entity.position.update(pos)
+            entity.previous_position.update(previous)
+            entity.velocity.update(vel)
+            entity.acceleration.update(acc)
+            entities.append(entity)
+        return entities
+
+
+def run_flocking_kernel(
+    kernel_backend: KernelBackend,
+    a: EntityArrays,
+    f: FlockParameterTable,
+    cell_index: CellIndex,
+    rows: np.ndarray,
+    parallel: bool = True,
+) -> np.ndarray:
+    """
+    Runs the flocking kernel selected by kernel_backend (which must not be AUTO) over the given array rows and returns their accelerations
+    :param parallel: Whether the compiled kernel may use multiple threads
+    """
+    n: int = a.count
+    if kernel_backend == KernelBackend.COMPILED:
+        out: np.ndarray = np.empty((len(rows), 2))
+        flocking_kernel = (
+            flocking_accelerations_compiled
+            if parallel
+            else flocking_accelerations_serial
+        )
+        flocking_kernel(
+            a.position[:n],
+            a.velocity[:n],
+            a.max_speed[:n],
+            a.max_acceleration[:n],
+            a.group_id[:n],
+            a.group_slot[:n],
+            a.interaction_range[:n],
+            a.flock_row[:n],
+            f.flocking,
+            f.cohere_distance,
+            f.avoid_distance,
+            f.cohere_k,
+            f.avoid_k,
+            f.align_k,
+            f.target_k,
+            f.has_target,
+            f.target_location,
+            cell_index.cell_row,
+            cell_index.cell_col,
+            cell_index.bucket_keys,
+            cell_index.bucket_start,
+            cell_index.bucket_count,
+            cell_index.buckets_per_cell,
+            cell_index.grid_width,
+            cell_index.grid_height,
+            rows,
+            out,
+        )
+        return out
+    return flocking_accelerations(
+        a.position[:n],
+        a.velocity[:n],
+        a.max_speed[:n],
+        a.max_acceleration[:n],
+        a.group_id[:n],
+        a.group_slot[:n],
+        a.interaction_range[:n],
+        a.flock_row[:n],
+        f,
+        cell_index.cell_row,
+        cell_index.cell_col,
+        cell_index.bucket_keys,
+        cell_index.bucket_start,
+        cell_index.bucket_count,
+        cell_index.buckets_per_cell,
+        cell_index.grid_width,
+        cell_index.grid_height,
+        rows,
+    )
+
+
+def run_integration_kernel(
+    kernel_backend: KernelBackend,
+    a: EntityArrays,
+    start: int,
+    stop: int,
+    world_w: float,
+    world_h: float,
+    dt: float,
+    parallel: bool = True,
+) -> None:
+    """
+    Runs the integration kernel selected by kernel_backend (which must not be AUTO) over the array rows in [start, stop)
+    :param parallel: Whether the compiled kernel may use multiple threads
+    """
+    if kernel_backend != KernelBackend.COMPILED:
+        integrate_kernel = integrate
+    elif parallel:
+        integrate_kernel = integrate_compiled
+    else:
+        integrate_kernel = integrate_serial
+    integrate_kernel(
+        a.position[start:stop],
+        a.velocity[start:stop],
+        a.acceleration[start:stop],
+        a.max_speed[start:stop],
+        world_w,
+        world_h,
+        dt,
+    )
@@ -0,0 +1,53 @@
+import pygame
+from pygame import Surface
+
+MASK_64: int = (1 << 64) - 1
+
+
+class BackgroundPalette:
+    """
+    The background tiles shared by all grid cells. Every cell only stores the index of its tile, so the memory used by backgrounds doesn't grow with the world size.\n
+    A cell's tile index is derived from its row and column, so it is the same no matter when (or how often) the cell is created
+    :param tile_size: Width and height of a tile, the grid cell size
+    :param seed: Changes which cells get which tile
+    """
+
+    # Number of noise shades of the water color
+    TILE_COUNT: int = 26
+
+    def __init__(self, tile_size: float, seed: int = 0) -> None:
+        self.tile_size: float = tile_size
+        self.seed: int = seed
+        self.tiles: list[Surface] = []
+        for noise in range(self.TILE_COUNT):
+            tile: Surface = pygame.Surface((tile_size, tile_size))
+            tile.fill((0, 50 + noise, 115 + noise * 2))
+            self.tiles.append(tile)
+        self.converted: bool = False
+
+    def get_tile_index(self, row: int, col: int) -> int:
+        # Mixes seed, row and column with the splitmix64 finalizer, cheap enough for the temporary cells made on every draw
+        h: int = (
+            self.seed * 0x9E3779B97F4A7C15
+            + row * 0xC2B2AE3D27D4EB4F
+            + col * 0x165667B19E3779F9
+        ) & MASK_64
+        h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+        h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & MASK_64
+        return (h ^ (h >> 31)) % self.TILE_COUNT
+
+    def convert_tiles(self) -> bool:
+        """
+        Converts the tiles to the pixel format of the display, so blitting them doesn't convert pixels every frame. Requires a display mode to be set.\n
+        Returns whether the tiles are converted
+        """
+        if not self.converted and pygame.display.get_surface() is not None:
+            self.tiles = [tile.convert() for tile in self.tiles]
+            self.converted = True
+        return self.converted
+
+    def get_byte_size(self) -> int:
+        return sum(
+            tile.get_width() * tile.get_height() * tile.get_bytesize()
+            for tile in self.tiles
+        )
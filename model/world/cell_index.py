@@ -0,0 +1,248 @@
+import numpy as np
+
+from model.utils.array_kernels import find_buckets
+
+
+class CellIndex:
+    """
+    Flat index from grid cells to entities, rebuilt from scratch every frame instead of being maintained incrementally.\n
+    Entities are sorted by cell key (row * grid_width + col), so every cell's entities are one contiguous run of sorted slots, every neighborhood is a handful of contiguous slices and nothing ever has to be deleted from a list.\n
+    The index is sparse: only occupied cells have an entry. cell_keys holds the key of every occupied cell in ascending order, and occupied cell i owns the sorted slots cell_start[i] to cell_start[i] + cell_count[i].
+    Cells are looked up by binary search over cell_keys, so memory and rebuild cost follow the number of entities and not the size of the world.\n
+    Each cell can optionally be split into buckets_per_cell sub-buckets (for example one per group), in which case bucket key = cell key * buckets_per_cell + sub_key is contiguous as well,
+    with bucket_keys, bucket_start and bucket_count listing the occupied buckets the same way
+    :param grid_width: Number of grid columns
+    :param grid_height: Number of grid rows
+    """
+
+    def __init__(self, grid_width: int, grid_height: int) -> None:
+        self.grid_width: int = grid_width
+        self.grid_height: int = grid_height
+        self.n_cells: int = grid_width * grid_height
+        self.buckets_per_cell: int = 1
+        # Per sorted slot
+        self.order: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.cell_row: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.cell_col: np.ndarray = np.zeros(0, dtype=np.int64)
+        # Per occupied cell and per occupied bucket, sorted by key
+        self.cell_keys: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.cell_start: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.cell_count: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.bucket_keys: np.ndarray = self.cell_keys
+        self.bucket_start: np.ndarray = self.cell_start
+        self.bucket_count: np.ndarray = self.cell_count
+        # Bucket key -> [start, stop) slots of every occupied bucket, for looking buckets up one at a time from Python. Built on first use after a rebuild
+        self._bucket_spans: dict[int, tuple[int, int]] | None = None
+        # How many entities were in a different cell than at the previous rebuild
+        self.moved_count: int = 0
+
+    def rebuild(
+        self,
+        rows: np.ndarray,
+        cols: np.ndarray,
+        sub_keys: np.ndarray | None = None,
+        buckets_per_cell: int = 1,
+    ) -> np.ndarray:
+        """
+        Sorts entities by cell (and sub-bucket) and rebuilds the tables of occupied cells and buckets.\n
+        Rows and columns outside of the grid are clamped to the edge cells.
+        :param rows: Grid row of every entity
+        :param cols: Grid column of every entity
+        :param sub_keys: Optional sub-bucket of every entity in [0, buckets_per_cell)
+        :return: The permutation that sorts the entities, new slot i holds old entity order[i]
+        """
+        rows = np.clip(rows, 0, self.grid_height - 1)
+        cols = np.clip(cols, 0, self.grid_width - 1)
+        # The entities are still in the order of the previous rebuild, so they line up with the old cells
+        if len(rows) == len(self.cell_row):
+            self.moved_count = int(
+                np.count_nonzero((rows != self.cell_row) | (cols != self.cell_col))
+            )
+        else:
+            self.moved_count = len(rows)
+        keys: np.ndarray = rows * self.grid_width + cols
+        if sub_keys is not None:
+            keys = keys * buckets_per_cell + sub_keys
+        self.order = sort_keys(keys, self.n_cells * buckets_per_cell)
+        self.buckets_per_cell = buckets_per_cell
+        self.set_buckets(
+            rows[self.order], cols[self.order], *get_runs(keys[self.order])
+        )
+        return self.order
+
+    def set_buckets(
+        self,
+        cell_row: np.ndarray,
+        cell_col: np.ndarray,
+        bucket_keys: np.ndarray,
+        bucket_start: np.ndarray,
+        bucket_count: np.ndarray,
+    ) -> None:
+        """
+        Sets the cell of every sorted slot and the table of occupied buckets, and works out the table of occupied cells from the buckets.
+        Lets the rows be sorted somewhere else, for example in parts by worker processes
+        """
+        self.cell_row = cell_row
+        self.cell_col = cell_col
+        self.bucket_keys = bucket_keys
+        self.bucket_start = bucket_start
+        self.bucket_count = bucket_count
+        self._bucket_spans = None
+        if self.buckets_per_cell == 1:
+            self.cell_keys = bucket_keys
+            self.cell_start = bucket_start
+            self.cell_count = bucket_count
+        else:
+            # The buckets of a cell are adjacent, so each cell is a run of bucket keys with the same cell key
+            self.cell_keys, first, runs = get_runs(bucket_keys // self.buckets_per_cell)
+            self.cell_start = bucket_start[first]
+            self.cell_count = (
+                np.add.reduceat(bucket_count, first) if len(first) > 0 else runs
+            )
+
+    def get_row_span(self, row: int, left: int, right: int) -> tuple[int, int]:
+        """
+        Returns the [start, stop) slots of every entity in cells left..right of one grid row. Cells in a row are adjacent keys, so this is always a single slice
+        """
+        first: int = int(np.searchsorted(self.cell_keys, row * self.grid_width + left))
+        last: int = int(
+            np.searchsorted(self.cell_keys, row * self.grid_width + right, "right")
+        )
+        if first == last:
+            return 0, 0
+        return int(self.cell_start[first]), int(
+            self.cell_start[last - 1] + self.cell_count[last - 1]
+        )
+
+    def get_neighborhood_spans(
+        self, row: int, col: int, cell_range: int
+    ) -> list[tuple[int, int]]:
+        """
+        Returns [start, stop) slot spans covering the (2 * cell_range + 1)^2 cells around a cell, wrapping around the edges of the grid.\n
+        Each grid row of the neighborhood is one span unless it wraps around the left or right edge
+        """
+        spans: list[tuple[int, int]] = []
+        left: int = col - cell_range
+        right: int = col + cell_range
+        for dr in range(-cell_range, cell_range + 1):
+            r: int = (row + dr + self.grid_height) % self.grid_height
+            if left >= 0 and right < self.grid_width:
+                spans.append(self.get_row_span(r, left, right))
+            else:
+                for c in range(left, right + 1):
+                    c = (c + self.grid_width) % self.grid_width
+                    spans.append(self.get_row_span(r, c, c))
+        return spans
+
+    def get_bucket_neighborhood_spans(
+        self, row: int, col: int, cell_range: int, sub_key: int
+    ) -> list[tuple[int, int]]:
+        """
+        Same as get_neighborhood_spans, but only covers sub-bucket sub_key of every cell, so it returns one span per cell
+        """
+        if self._bucket_spans is None:
+            starts: list[int] = self.bucket_start.tolist()
+            self._bucket_spans = dict(
+                zip(
+                    self.bucket_keys.tolist(),
+                    zip(starts, (self.bucket_start + self.bucket_count).tolist()),
+                )
+            )
+        get_span = self._bucket_spans.get
+        empty: tuple[int, int] = (0, 0)
+        buckets_per_cell: int = self.buckets_per_cell
+        # Bucket key = row part + column part, the column parts are the same for every row of the neighborhood
+        columns: list[int] = [
+            (col + dc) % self.grid_width * buckets_per_cell + sub_key
+            for dc in range(-cell_range, cell_range + 1)
+        ]
+        row_stride: int = self.grid_width * buckets_per_cell
+        spans: list[tuple[int, int]] = []
+        for dr in range(-cell_range, cell_range + 1):
+            row_key: int = (row + dr) % self.grid_height * row_stride
+            for column_key in columns:
+                spans.append(get_span(row_key + column_key, empty))
+        return spans
+
+    def get_slots_in_range(
+        self, left: int, right: int, bottom: int, top: int
+    ) -> np.ndarray:
+        """
+        Returns the sorted slots of all entities in the rectangle of cells given, clamped to the grid
+        """
+        left = max(left, 0)
+        right = min(right, self.grid_width - 1)
+        bottom = max(bottom, 0)
+        top = min(top, self.grid_height - 1)
+        if left > right or bottom > top:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(
+            [
+                np.arange(*self.get_row_span(r, left, right))
+                for r in range(bottom, top + 1)
+            ]
+        )
+
+    def count_bucket_neighbors(
+        self, cell_range: np.ndarray, sub_key: np.ndarray
+    ) -> int:
+        """
+        Counts, summed over all sorted slots, the entities in sub-bucket sub_key of the cell_range neighborhood of each slot's cell. That is how many pairs a kernel that scans those buckets tests
+        :param cell_range: Neighborhood range of every sorted slot. Slots with a negative range are skipped
+        :param sub_key: Sub-bucket of every sorted slot
+        """
+        total: int = 0
+        for r in np.unique(cell_range).tolist():
+            if r < 0:
+                continue
+            in_range: np.ndarray = cell_range == r
+            # Slots of the same bucket see the same neighborhood, so every occupied bucket is only looked at once
+            buckets, slot_counts = np.unique(
+                (self.cell_row[in_range] * self.grid_width + self.cell_col[in_range])
+                * self.buckets_per_cell
+                + sub_key[in_range],
+                return_counts=True,
+            )
+            cells: np.ndarray = buckets // self.buckets_per_cell
+            sub_keys: np.ndarray = buckets % self.buckets_per_cell
+            row: np.ndarray = cells // self.grid_width
+            col: np.ndarray = cells % self.grid_width
+            for dr in range(-r, r + 1):
+                for dc in range(-r, r + 1):
+                    neighbors: np.ndarray = (
+                        ((row + dr) % self.grid_height) * self.grid_width
+                        + (col + dc) % self.grid_width
+                    ) * self.buckets_per_cell + sub_keys
+                    counts: np.ndarray = find_buckets(
+                        self.bucket_keys,
+                        self.bucket_start,
+                        self.bucket_count,
+                        neighbors,
+                    )[1]
+                    total += int((counts * slot_counts).sum())
+        return total
+
+
+def sort_keys(keys: np.ndarray, key_count: int) -> np.ndarray:
+    """
+    Returns the permutation that stably sorts keys in [0, key_count)
+    """
+    # NumPy's stable sort is a linear time radix sort for 16 bit keys, which covers grids up to 65536 buckets.
+    # Larger keys are sorted as they are, and since entities are still in last frame's order the sort mostly finds runs that are already sorted
+    if key_count <= 1 << 16:
+        return np.argsort(keys.astype(np.uint16), kind="stable")
+    return np.argsort(keys, kind="stable")
+
+
+def get_runs(sorted_keys: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the distinct keys of a sorted key array, where each one's run of equal keys starts, and how long the run is
+    """
+    if len(sorted_keys) == 0:
+        empty: np.ndarray = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    starts: np.ndarray = np.flatnonzero(
+        np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+    )
+    counts: np.ndarray = np.diff(np.append(starts, len(sorted_keys)))
+    return sorted_keys[starts].astype(np.int64), starts, counts
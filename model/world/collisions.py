@@ -0,0 +1,190 @@
+from enum import Enum
+from typing import Iterable
+
+import numpy as np
+
+from model.entities.gameentity import GameEntity
+from model.entities.player import Player
+from model.utils.query_kernels import collide_kernel
+from model.world.spatial_queries import QueryResult, SpatialQueries, as_points
+
+# Layer of the player's hitbox
+PLAYER_LAYER: int = 0
+
+
+class ColliderShape(Enum):
+    """
+    Shape of a collider. Entities are always circles, see CollisionSystem.set_group_radius\n
+    BOX: axis aligned box around the collider's center, given by its half width and half height\n
+    CIRCLE: circle around the center, the radius is given as the half width
+    """
+
+    BOX = 0
+    CIRCLE = 1
+
+
+class CollisionSystem:
+    """
+    Tests colliders (the player's hitbox, projectiles) against the entities around them, once per tick after the model has moved everything, see SpatialPartitioningModel.set_collisions.\n
+    The player's hitbox is always collider 0, a box of player.width by player.height on PLAYER_LAYER. More colliders are set with set_colliders and are tested in the same batch.\n
+    Broadphase: a collider only visits the cells of the query index (see SpatialQueries) that its bounds, grown by the largest entity radius, overlap. Narrowphase: box or circle against each candidate's circle.
+    Every collider has a layer, and set_layer_groups picks the groups a layer collides with. Layers without groups set collide with every group.\n
+    Contacts are written to a QueryResult that is reused every tick: the contacts of collider i are contacts.get_rows(i), index rows of SpatialQueries,
+    and the value of a contact is how deep the entity reaches into the collider. Nothing is allocated per contact
+    """
+
+    def __init__(self, queries: SpatialQueries, player: Player) -> None:
+        self.queries: SpatialQueries = queries
+        self.player: Player = player
+        # Batch of colliders, the player's hitbox followed by the ones from set_colliders. Only the first collider_count rows are in use
+        self.collider_count: int = 1
+        self.centers: np.ndarray = np.zeros((64, 2), dtype=np.float64)
+        self.extents: np.ndarray = np.zeros((64, 2), dtype=np.float64)
+        self.circles: np.ndarray = np.zeros(64, dtype=bool)
+        self.layers: np.ndarray = np.zeros(64, dtype=np.int64)
+        # Layer -> group ids it collides with
+        self.layer_groups: dict[int, list[int]] = {}
+        # Group id -> radius of the circle its entities collide with, set with set_group_radius or worked out from the group's entities
+        self.group_radii: dict[int, float] = {}
+        self._default_radii: dict[int, float] = {}
+        # (layer, group slot) -> whether they collide, and the radius of every group slot. Rebuilt when settings or the model's groups change
+        self._layer_masks: np.ndarray = np.ones((1, 0), dtype=bool)
+        self._slot_radii: np.ndarray = np.zeros(0, dtype=np.float64)
+        self._tables_dirty: bool = True
+        self.contacts: QueryResult = QueryResult()
+
+    def set_layer_groups(self, layer: int, group_ids: Iterable[int] | None) -> None:
+        """
+        Sets the groups colliders on the layer collide with, or None for every group
+        """
+        if group_ids is None:
+            self.layer_groups.pop(layer, None)
+        else:
+            self.layer_groups[layer] = list(group_ids)
+        self._tables_dirty = True
+
+    def set_group_radius(self, group_id: int, radius: float) -> None:
+        """
+        Sets the radius of the circle the entities of a group collide with. Groups without one use half the smaller side of the width and height of one of their entities
+        """
+        self.group_radii[group_id] = radius
+        self._tables_dirty = True
+
+    def set_colliders(
+        self,
+        centers: np.ndarray,
+        extents: float | np.ndarray,
+        shape: ColliderShape = ColliderShape.CIRCLE,
+        layers: int | np.ndarray = PLAYER_LAYER + 1,
+    ) -> None:
+        """
+        Replaces the colliders tested besides the player's hitbox, for example with every projectile in flight. They are collider 1 onwards in the contacts
+        :param centers: (collider count, 2) array of collider centers
+        :param extents: For circles the radius, one for all colliders or one per collider.
+        For boxes a (half width, half height) pair for all colliders, a (collider count, 2) array of pairs, or one half size for square boxes. A pair of two values is always read as one (half width, half height), also when there are two colliders
+        :param layers: Layer of every collider, see set_layer_groups. One for all colliders or one per collider
+        """
+        centers = as_points(centers)
+        count: int = len(centers) + 1
+        if count > len(self.centers):
+            capacity: int = max(count, 2 * len(self.centers))
+            self.centers = np.zeros((capacity, 2), dtype=np.float64)
+            self.extents = np.zeros((capacity, 2), dtype=np.float64)
+            self.circles = np.zeros(capacity, dtype=bool)
+            self.layers = np.zeros(capacity, dtype=np.int64)
+        self.collider_count = count
+        extent_array: np.ndarray = np.asarray(extents, dtype=np.float64)
+        if shape == ColliderShape.BOX and extent_array.shape == (2,):
+            extent_array = np.broadcast_to(extent_array, (count - 1, 2))
+        elif extent_array.ndim < 2:
+            # Circle radii and square half sizes are used for both columns
+            extent_array = extent_array.reshape(-1, 1)
+        self.centers[1:count] = centers
+        self.extents[1:count] = extent_array
+        self.circles[1:count] = shape == ColliderShape.CIRCLE
+        self.layers[1:count] = layers
+        if count > 1 and self.layers[1:count].max() >= len(self._layer_masks):
+            self._tables_dirty = True
+
+    def detect(self) -> QueryResult:
+        """
+        Finds the contacts of every collider with the entities where the last model update left them
+        """
+        queries: SpatialQueries = self.queries
+        queries.refresh()
+        if self._tables_dirty or len(self._slot_radii) != len(
+            queries.model.group_slots
+        ):
+            self._build_tables()
+        self.centers[0] = (self.player.position.x, self.player.position.y)
+        self.extents[0] = (self.player.width / 2, self.player.height / 2)
+        self.circles[0] = False
+        self.layers[0] = PLAYER_LAYER
+        count: int = self.collider_count
+        result: QueryResult = self.contacts
+        result.reserve(count, 0)
+        max_radius: float = float(self._slot_radii.max(initial=0.0))
+        while True:
+            total: int = collide_kernel(
+                queries.keys,
+                queries.positions,
+                queries.slots,
+                queries.grid_width,
+                queries.grid_height,
+                queries.cell_size,
+                self.centers[:count],
+                self.extents[:count],
+                self.circles[:count],
+                self.layers[:count],
+                self._layer_masks,
+                self._slot_radii,
+                max_radius,
+                result.offsets,
+                result.hits,
+                result.hit_values,
+            )
+            if total <= len(result.hits):
+                break
+            result.reserve(count, total)
+        result.query_count = count
+        result.hit_count = total
+        return result
+
+    def get_contact_entities(self, collider: int) -> list[GameEntity]:
+        """
+        Returns the entities touching a collider in the last detect call, 0 for the player
+        """
+        return self.queries.get_entities(self.contacts.get_rows(collider))
+
+    def _build_tables(self) -> None:
+        group_slots: dict[int, int] = self.queries.model.group_slots
+        slot_count: int = len(group_slots)
+        top_layer: int = max(
+            [PLAYER_LAYER, *self.layer_groups]
+            + self.layers[1 : self.collider_count].tolist()
+        )
+        self._layer_masks = np.ones((top_layer + 1, slot_count), dtype=bool)
+        for layer, group_ids in self.layer_groups.items():
+            self._layer_masks[layer] = self.queries.get_group_mask(group_ids)
+        radii: np.ndarray = np.zeros(slot_count, dtype=np.float64)
+        for group_id, slot in group_slots.items():
+            radius: float | None = self.group_radii.get(group_id)
+            if radius is None:
+                radius = self._default_radii.get(group_id)
+            if radius is None:
+                radius = self._get_default_radius(slot)
+            if radius is not None:
+                self._default_radii[group_id] = radius
+                radii[slot] = radius
+        self._slot_radii = radii
+        self._tables_dirty = False
+
+    def _get_default_radius(self, slot: int) -> float | None:
+        """
+        Half the smaller side of an entity of the group slot, or None if the group has no entities right now
+        """
+        rows: np.ndarray = np.flatnonzero(self.queries.slots == slot)[:1]
+        if len(rows) == 0:
+            return None
+        entity: GameEntity = self.queries.get_entities(rows)[0]
+        return min(entity.width, entity.height) / 2
@@ -0,0 +1,280 @@
+from enum import Enum
+from typing import Tuple
+
+from pygame import Vector2
+
+from model.entities.gameentity import GameEntity
+from model.world.grid_cell import CellAggregate, GridCell
+
+# (x, y, vx, vy) of the entities of one group bucket
+Columns = Tuple[list[float], list[float], list[float], list[float]]
+
+
+class ApproximationMode(Enum):
+    """
+    How cohesion and alignment sums are gathered from a neighborhood.\n
+    EXACT: neighbor by neighbor.\n
+    CELL_AGGREGATES: cells that lie inside an entity's cohere radius are added as a whole from their CellAggregate. Neighbors are only visited one by one in cells on the edge of the radius and, for avoidance, in cells that overlap the avoid radius.\n
+    MEASURE_ERROR: CELL_AGGREGATES, but the exact forces are computed as well and the difference is recorded in the model's approximation_error. Slower than EXACT, for tuning AggregateSettings.tolerance
+    """
+
+    EXACT = 0
+    CELL_AGGREGATES = 1
+    MEASURE_ERROR = 2
+
+
+class AggregateSettings:
+    """
+    :param mode: See ApproximationMode
+    :param tolerance: How far (as a fraction of the cohere distance) a cell may reach past the cohere radius and still be added as a whole. 0 only aggregates cells that are entirely inside the radius, which matches the exact sums except for rounding
+    :param min_count: Groups with fewer entities than this in a cell don't use aggregates there: their forces in that cell are computed exactly, and as neighbors on the edge of the cohere radius they are visited one by one. Checking a cell costs about as much as visiting a few neighbors
+    :param refresh_interval: Every this many ticks the aggregates are recomputed from scratch, so the rounding errors of incremental updates don't build up
+    """
+
+    def __init__(
+        self,
+        mode: ApproximationMode = ApproximationMode.CELL_AGGREGATES,
+        tolerance: float = 0.0,
+        min_count: int = 8,
+        refresh_interval: int = 600,
+    ) -> None:
+        self.mode: ApproximationMode = mode
+        self.tolerance: float = tolerance
+        self.min_count: int = min_count
+        self.refresh_interval: int = refresh_interval
+
+
+class ApproximationError:
+    """
+    Difference between the approximated and the exact acceleration of the entities of one update, recorded with ApproximationMode.MEASURE_ERROR
+    """
+
+    def __init__(self) -> None:
+        self.entity_count: int = 0
+        self.max_error: float = 0.0
+        self.total_error: float = 0.0
+        # Largest exact acceleration, to put the errors in relation
+        self.max_acceleration: float = 0.0
+
+    def reset(self) -> None:
+        self.entity_count = 0
+        self.max_error = 0.0
+        self.total_error = 0.0
+        self.max_acceleration = 0.0
+
+    def add(self, approximate: Vector2, exact: Vector2) -> None:
+        error: float = approximate.distance_to(exact)
+        self.entity_count += 1
+        self.total_error += error
+        self.max_error = max(self.max_error, error)
+        self.max_acceleration = max(self.max_acceleration, exact.length())
+
+    @property
+    def mean_error(self) -> float:
+        return self.total_error / self.entity_count if self.entity_count else 0.0
+
+
+class AggregateNeighborhood:
+    """
+    The cells of the group neighborhood of one home cell, shared by the residents of the home cell that sum cohesion and alignment from cell aggregates (see ApproximationMode).\n
+    Cells that are inside the cohere radius wherever an entity is in the home cell are summed once per home cell. Only the cells on the edge of the radius are checked for every entity.
+    Neighbors that are visited one by one are read from flat (x, y, vx, vy) columns like those of a NeighborhoodSnapshot. The columns of a cell are copied once per tick and shared by every neighborhood the cell is in.
+    Like NeighborhoodSnapshot, one object is refilled for every cell instead of allocating a new one
+    """
+
+    def __init__(self) -> None:
+        # (row offset, column offset, whether the cell is across a world edge, cell)
+        self.cells: list[Tuple[int, int, bool, GridCell]] = []
+        self.home_cell: GridCell | None = None
+        self.group_id: int = -1
+        self.cell_size: float = 0.0
+        self.settings: AggregateSettings = AggregateSettings()
+        # Cohere and avoid distance the cells are split up for
+        self._split_distances: Tuple[float, float] | None = None
+        self._inner_sum: CellAggregate = CellAggregate()
+        self._home_is_inner: bool = False
+        # Columns of the cells whose neighbors are always visited one by one
+        self._edge_columns: list[Columns] = []
+        # (center x, center y, cell, columns) of the edge cells that are checked per entity
+        self._edge_cells: list[Tuple[float, float, GridCell, Columns]] = []
+        # (center x, center y, columns) of the cells that are summed as a whole but can overlap the avoid radius
+        self._avoid_cells: list[Tuple[float, float, Columns]] = []
+        # id of a group bucket -> its columns, for the current tick
+        self._columns: dict[int, Columns] = {}
+        # Number of neighbors visited one by one since the model last read it
+        self.pairs_tested: int = 0
+
+    def fill(
+        self,
+        cells: list[Tuple[int, int, bool, GridCell]],
+        home_cell: GridCell,
+        group_id: int,
+        settings: AggregateSettings,
+    ) -> None:
+        self.cells[:] = cells
+        self.home_cell = home_cell
+        self.group_id = group_id
+        self.cell_size = home_cell.size
+        self.settings = settings
+        self._split_distances = None
+
+    def clear_columns(self) -> None:
+        """
+        Drops the columns copied so far. Has to be called whenever entities may have moved since the neighborhood was last filled
+        """
+        self._columns.clear()
+
+    def get_columns(self, bucket: dict[GameEntity, None]) -> Columns:
+        """
+        Returns the (x, y, vx, vy) columns of a group bucket, copying them on first use
+        """
+        columns: Columns | None = self._columns.get(id(bucket))
+        if columns is None:
+            columns = ([], [], [], [])
+            xs, ys, vxs, vys = columns
+            for e in bucket:
+                position: Vector2 = e.position
+                velocity: Vector2 = e.velocity
+                xs.append(position.x)
+                ys.append(position.y)
+                vxs.append(velocity.x)
+                vys.append(velocity.y)
+            self._columns[id(bucket)] = columns
+        return columns
+
+    def get_entities(self) -> list[GameEntity]:
+        """
+        Returns every entity of the group in the neighborhood, for entities that don't use aggregates
+        """
+        entities: list[GameEntity] = []
+        for _, _, _, cell in self.cells:
+            entities.extend(cell.get_group_entities(self.group_id))
+        return entities
+
+    def has_whole_cells(self, cohere_distance: float, avoid_distance: float) -> bool:
+        """
+        Whether any cell of the neighborhood can be summed as a whole for some position in the home cell. If none can, the aggregates only add overhead
+        """
+        if self._split_distances != (cohere_distance, avoid_distance):
+            self.split_cells(cohere_distance, avoid_distance)
+        return self._inner_sum.count > 0 or len(self._edge_cells) > 0
+
+    def split_cells(self, cohere_distance: float, avoid_distance: float) -> None:
+        """
+        Sorts the cells by what they can be for any position in the home cell: summed as a whole, on the edge of the cohere radius, or out of reach.
+        Cells across a world edge and cells with fewer than AggregateSettings.min_count entities of the group are always visited neighbor by neighbor
+        """
+        size: float = self.cell_size
+        group_id: int = self.group_id
+        min_count: int = self.settings.min_count
+        cohere_d2: float = cohere_distance * cohere_distance
+        avoid_d2: float = avoid_distance * avoid_distance
+        whole_distance: float = cohere_distance * (1.0 + self.settings.tolerance)
+        whole_d2: float = whole_distance * whole_distance
+        inner_sum: CellAggregate = self._inner_sum
+        inner_sum.reset()
+        self._home_is_inner = False
+        edge_columns: list[Columns] = []
+        edge_cells: list[Tuple[float, float, GridCell, Columns]] = []
+        avoid_cells: list[Tuple[float, float, Columns]] = []
+        for dr, dc, wrapped, cell in self.cells:
+            bucket: dict[GameEntity, None] = cell.get_group_entities(group_id)
+            if wrapped or len(bucket) < min_count:
+                edge_columns.append(self.get_columns(bucket))
+                continue
+            # Smallest and largest distance between a point of the home cell and a point of this cell, per axis
+            near_r: float = max(abs(dr) - 1, 0) * size
+            near_c: float = max(abs(dc) - 1, 0) * size
+            near_d2: float = near_r * near_r + near_c * near_c
+            if near_d2 >= cohere_d2 and near_d2 >= avoid_d2:
+                continue
+            center: Vector2 = cell.center_pos
+            far_r: float = (abs(dr) + 1) * size
+            far_c: float = (abs(dc) + 1) * size
+            if near_d2 >= cohere_d2 or far_r * far_r + far_c * far_c >= whole_d2:
+                edge_cells.append((center.x, center.y, cell, self.get_columns(bucket)))
+                continue
+            aggregate: CellAggregate = cell.get_aggregate(group_id)
+            inner_sum.count += aggregate.count
+            inner_sum.sum_x += aggregate.sum_x
+            inner_sum.sum_y += aggregate.sum_y
+            inner_sum.sum_vx += aggregate.sum_vx
+            inner_sum.sum_vy += aggregate.sum_vy
+            if cell is self.home_cell:
+                self._home_is_inner = True
+            if near_d2 < avoid_d2:
+                avoid_cells.append((center.x, center.y, self.get_columns(bucket)))
+        self._edge_columns = edge_columns
+        self._edge_cells = edge_cells
+        self._avoid_cells = avoid_cells
+        self._split_distances = (cohere_distance, avoid_distance)
+
+    def gather(
+        self, entity: GameEntity, cohere_distance: float, avoid_distance: float
+    ) -> Tuple[CellAggregate, list[Columns], list[Columns]]:
+        """
+        Splits the neighborhood of the entity into the cells that are summed as a whole and the neighbors that have to be checked one by one.\n
+        Returns (the sums of the whole cells without the entity itself,
+        the columns of the remaining cells within reach of the cohere or avoid radius, whose neighbors count for every force,
+        the columns of the whole cells within reach of the avoid radius, whose neighbors only count for avoidance)
+        """
+        if self._split_distances != (cohere_distance, avoid_distance):
+            self.split_cells(cohere_distance, avoid_distance)
+        px: float = entity.position.x
+        py: float = entity.position.y
+        cohere_d2: float = cohere_distance * cohere_distance
+        avoid_d2: float = avoid_distance * avoid_distance
+        whole_distance: float = cohere_distance * (1.0 + self.settings.tolerance)
+        whole_d2: float = whole_distance * whole_distance
+        group_id: int = self.group_id
+        home_cell: GridCell = self.home_cell
+        inner_sum: CellAggregate = self._inner_sum
+        summed: CellAggregate = CellAggregate()
+        summed.count = inner_sum.count
+        summed.sum_x = inner_sum.sum_x
+        summed.sum_y = inner_sum.sum_y
+        summed.sum_vx = inner_sum.sum_vx
+        summed.sum_vy = inner_sum.sum_vy
+        if self._home_is_inner and entity in home_cell.get_group_entities(group_id):
+            summed.remove(entity)
+        visit_columns: list[Columns] = self._edge_columns[:]
+        avoid_columns: list[Columns] = []
+        half: float = self.cell_size / 2
+        for cx, cy, columns in self._avoid_cells:
+            dx: float = px - cx if px > cx else cx - px
+            dy: float = py - cy if py > cy else cy - py
+            near_x: float = dx - half if dx > half else 0.0
+            near_y: float = dy - half if dy > half else 0.0
+            if near_x * near_x + near_y * near_y < avoid_d2:
+                avoid_columns.append(columns)
+        for cx, cy, cell, columns in self._edge_cells:
+            dx = px - cx if px > cx else cx - px
+            dy = py - cy if py > cy else cy - py
+            # Distance to the nearest and the farthest point of the cell
+            near_x = dx - half if dx > half else 0.0
+            near_y = dy - half if dy > half else 0.0
+            near_d2: float = near_x * near_x + near_y * near_y
+            if near_d2 >= cohere_d2:
+                if near_d2 < avoid_d2:
+                    visit_columns.append(columns)
+                continue
+            far_x: float = dx + half
+            far_y: float = dy + half
+            if far_x * far_x + far_y * far_y >= whole_d2:
+                visit_columns.append(columns)
+                continue
+            aggregate: CellAggregate = cell.get_aggregate(group_id)
+            summed.count += aggregate.count
+            summed.sum_x += aggregate.sum_x
+            summed.sum_y += aggregate.sum_y
+            summed.sum_vx += aggregate.sum_vx
+            summed.sum_vy += aggregate.sum_vy
+            if cell is home_cell:
+                summed.remove(entity)
+            if near_d2 < avoid_d2:
+                avoid_columns.append(columns)
+        for columns in visit_columns:
+            self.pairs_tested += len(columns[0])
+        for columns in avoid_columns:
+            self.pairs_tested += len(columns[0])
+        return summed, visit_columns, avoid_columns
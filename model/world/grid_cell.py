@@ -1,25 +1,155 @@
-import pygame
 from pygame import Surface, Vector2
 
 from model.entities.gameentity import GameEntity
+from model.world.background_palette import BackgroundPalette
+
+
+class CellAggregate:
+    """
+    Running sums of the position and velocity of the entities of one group in a grid cell, so a whole cell can stand in for its entities in cohesion and alignment.\n
+    The count is always up to date. The sums are marked stale while nobody keeps them up to date as entities move, see GridCell.get_aggregate
+    """
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.sum_x: float = 0.0
+        self.sum_y: float = 0.0
+        self.sum_vx: float = 0.0
+        self.sum_vy: float = 0.0
+        self.stale: bool = False
+
+    def add(self, entity: GameEntity) -> None:
+        self.count += 1
+        self.sum_x += entity.position.x
+        self.sum_y += entity.position.y
+        self.sum_vx += entity.velocity.x
+        self.sum_vy += entity.velocity.y
+
+    def remove(self, entity: GameEntity) -> None:
+        self.count -= 1
+        self.sum_x -= entity.position.x
+        self.sum_y -= entity.position.y
+        self.sum_vx -= entity.velocity.x
+        self.sum_vy -= entity.velocity.y
+
+    def shift(self, dx: float, dy: float, dvx: float, dvy: float) -> None:
+        """
+        Updates the sums after one entity's position and velocity changed by the given amounts
+        """
+        self.sum_x += dx
+        self.sum_y += dy
+        self.sum_vx += dvx
+        self.sum_vy += dvy
+
+    def reset(self) -> None:
+        self.count = 0
+        self.sum_x = self.sum_y = self.sum_vx = self.sum_vy = 0.0
 
 
 class GridCell:
+    """
+    One square of the spatial partitioning grid. Entities are kept in one bucket per group_id so that flocking neighborhoods can be gathered without visiting foreign groups.\n
+    Each bucket is a dict used as an insertion ordered set, which makes adding and removing an entity O(1) when it migrates between cells.
+    An entity's group_id must not change while it is in a cell.\n
+    Every bucket also has a CellAggregate, kept up to date when entities are added or removed. Changes from moving entities have to be applied by the model.\n
+    The background is a tile of the shared palette, referenced by index.
+    The model frees a cell as soon as its last entity leaves, so a cell only exists while it is occupied (or, for drawing, as a temporary cell, see GridLevel.peek_cell)
+    """
+
     def __init__(
         self,
         size: float,
         row: int,
         col: int,
-        camera_height: float,
-        background_surface: Surface = None,
+        palette: BackgroundPalette,
     ):
         self.size: float = size
-        self.entities: list[GameEntity] = []
-        if background_surface is None:
-            self.background_surface: Surface = pygame.Surface((size, size))
-            self.background_surface.fill((0, 0, 0))
-        else:
-            self.background_surface: Surface = background_surface
+        self.row: int = row
+        self.col: int = col
+        self.entity_count: int = 0
+        self.groups: dict[int, dict[GameEntity, None]] = {}
+        self.aggregates: dict[int, CellAggregate] = {}
+        self.palette: BackgroundPalette = palette
+        self.tile_index: int = palette.get_tile_index(row, col)
         self.center_pos: Vector2 = Vector2(
             col * size + (size / 2), row * size + (size / 2)
         )
+
+    @property
+    def background_surface(self) -> Surface:
+        return self.palette.tiles[self.tile_index]
+
+    def add_entity(self, entity: GameEntity) -> None:
+        bucket: dict[GameEntity, None] | None = self.groups.get(entity.group_id)
+        if bucket is None:
+            bucket = {}
+            self.groups[entity.group_id] = bucket
+            self.aggregates[entity.group_id] = CellAggregate()
+        bucket[entity] = None
+        self.aggregates[entity.group_id].add(entity)
+        self.entity_count += 1
+
+    def add_group_entities(self, group_id: int, entities: list[GameEntity]) -> None:
+        """
+        Adds a batch of entities that all have the given group_id
+        """
+        bucket: dict[GameEntity, None] | None = self.groups.get(group_id)
+        if bucket is None:
+            bucket = {}
+            self.groups[group_id] = bucket
+            self.aggregates[group_id] = CellAggregate()
+        bucket.update(dict.fromkeys(entities))
+        self.entity_count += len(entities)
+        aggregate: CellAggregate = self.aggregates[group_id]
+        for entity in entities:
+            aggregate.add(entity)
+
+    def remove_entity(self, entity: GameEntity) -> None:
+        del self.groups[entity.group_id][entity]
+        self.aggregates[entity.group_id].remove(entity)
+        self.entity_count -= 1
+
+    def is_empty(self) -> bool:
+        return self.entity_count == 0
+
+    def refresh_aggregates(self) -> None:
+        """
+        Recomputes the aggregates from the entities, dropping the rounding errors of incremental updates
+        """
+        for group_id in self.groups:
+            self.refresh_aggregate(group_id)
+
+    def refresh_aggregate(self, group_id: int) -> CellAggregate:
+        aggregate: CellAggregate = self.aggregates[group_id]
+        aggregate.reset()
+        for entity in self.groups[group_id]:
+            aggregate.add(entity)
+        aggregate.stale = False
+        return aggregate
+
+    def get_aggregate(self, group_id: int) -> CellAggregate:
+        """
+        Returns the aggregate of the given group, recomputing its sums first if they are stale
+        """
+        aggregate: CellAggregate = self.aggregates[group_id]
+        if aggregate.stale:
+            return self.refresh_aggregate(group_id)
+        return aggregate
+
+    def get_entities(self) -> list[GameEntity]:
+        """
+        Returns a new list of the entities of every group in this cell
+        """
+        entities: list[GameEntity] = []
+        for bucket in self.groups.values():
+            entities.extend(bucket)
+        return entities
+
+    def get_group_entities(self, group_id: int) -> dict[GameEntity, None]:
+        """
+        Returns the bucket of entities in the given group. The bucket must not be modified by the caller
+        """
+        return self.groups.get(group_id, _EMPTY_BUCKET)
+
+
+_EMPTY_BUCKET: dict[GameEntity, None] = {}
@@ -0,0 +1,72 @@
+from typing import Tuple
+
+from model.world.background_palette import BackgroundPalette
+from model.world.grid_cell import GridCell
+
+
+class GridLevel:
+    """
+    One resolution of the grid. A cell of a level is scale x scale cells of the base grid, with scale a power of two.\n
+    Entities that see further than one base cell live in a coarser level, so that their neighborhood is still about 3x3 cells of that level instead of a wider block of small cells.
+    Cells are kept in a dict keyed by (row, column), so a level only holds the cells that have entities in them: a cell is created when an entity enters it and released when its last entity leaves.
+    Memory and the per-frame cost of visiting cells scale with the occupied part of the world, not its size
+    :param scale: Width of a cell of this level in base grid cells
+    :param cells: Dict to keep the cells in. The base level shares the model's grid_cells
+    """
+
+    def __init__(
+        self,
+        scale: int,
+        base_cell_size: float,
+        base_grid_width: int,
+        base_grid_height: int,
+        palette: BackgroundPalette,
+        cells: dict[Tuple[int, int], GridCell] | None = None,
+    ) -> None:
+        self.scale: int = scale
+        self.cell_size: float = base_cell_size * scale
+        self.grid_width: int = base_grid_width // scale
+        self.grid_height: int = base_grid_height // scale
+        self.palette: BackgroundPalette = palette
+        self.cells: dict[Tuple[int, int], GridCell] = cells if cells is not None else {}
+
+    def get_cell(self, r: int, c: int) -> GridCell:
+        """
+        Returns the cell at row r, column c of this level, creating it if it doesn't exist yet
+        """
+        cell: GridCell | None = self.cells.get((r, c))
+        if cell is None:
+            cell = GridCell(self.cell_size, r, c, self.palette)
+            self.cells[(r, c)] = cell
+        return cell
+
+    def peek_cell(self, r: int, c: int) -> GridCell:
+        """
+        Returns the cell at row r, column c of this level, or a temporary empty cell that isn't added to the level if it doesn't exist. For drawing, which must not allocate cells
+        """
+        cell: GridCell | None = self.cells.get((r, c))
+        if cell is None:
+            cell = GridCell(self.cell_size, r, c, self.palette)
+        return cell
+
+    def release_cell(self, cell: GridCell) -> None:
+        """
+        Removes a cell that has no entities left from the level
+        """
+        del self.cells[(cell.row, cell.col)]
+
+    def get_range(self, interaction_range: int) -> int:
+        """
+        Converts an interaction range in base grid cells to cells of this level, rounding up
+        """
+        return -(-interaction_range // self.scale)
+
+    def get_covering_span(self, first: int, last: int, size: int) -> range:
+        """
+        Converts the base grid rows (or columns) first to last into the rows (or columns) of this level that cover them. The result can run past the grid edges and has to be wrapped by the caller.
+        :param size: Number of rows (or columns) of this level
+        """
+        first_cell: int = first // self.scale
+        last_cell: int = last // self.scale
+        # A span wider than the grid would visit cells twice after wrapping
+        return range(first_cell, min(last_cell, first_cell + size - 1) + 1)
@@ -0,0 +1,96 @@
+from enum import Enum
+from typing import Tuple
+
+import numpy as np
+
+
+class SimulationTier(Enum):
+    """
+    How much work the model spends on the entities of a grid cell, by the cell's distance from the camera.\n
+    FULL: flocking every tick.\n
+    MID: flocking every LodSettings.mid_interval ticks, scaled by the number of ticks since the entity last flocked.\n
+    FAR: no flocking, only target seeking and integration
+    """
+
+    FULL = 0
+    MID = 1
+    FAR = 2
+
+
+class LodSettings:
+    """
+    Distance thresholds of the simulation tiers, in grid cells outside of the cells the camera sees. Distances wrap around the world edges like flocking neighborhoods do
+    :param near_cells: Cells at most this far from the camera's cells are simulated at SimulationTier.FULL
+    :param far_cells: Cells further than this are simulated at SimulationTier.FAR. Cells in between are SimulationTier.MID
+    :param mid_interval: Mid range cells flock once every this many ticks. Cells take turns, so that not all of them flock in the same tick
+    """
+
+    def __init__(self, near_cells: int = 2, far_cells: int = 12, mid_interval: int = 4):
+        self.near_cells: int = near_cells
+        self.far_cells: int = far_cells
+        self.mid_interval: int = mid_interval
+
+
+class TierGrid:
+    """
+    Simulation tiers of grid cells by their distance from the camera's cells.\n
+    Tiers are worked out only for the cells asked for, so the cost follows the number of occupied cells instead of the size of the grid.
+    Also decides which cells flock in a given tick: FULL cells always, MID cells when (tick + row + column) is a multiple of mid_interval
+    """
+
+    def __init__(self, settings: LodSettings, grid_width: int, grid_height: int):
+        self.settings: LodSettings = settings
+        self.grid_width: int = grid_width
+        self.grid_height: int = grid_height
+        # (bottom row, top row, left column, right column) of the cells the camera sees
+        self._camera_cells: Tuple[int, int, int, int] = (0, 0, 0, 0)
+
+    def update(self, camera_cells: Tuple[int, int, int, int]) -> None:
+        """
+        :param camera_cells: (bottom row, top row, left column, right column) of the cells the camera sees
+        """
+        self._camera_cells = camera_cells
+
+    def get_tiers(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """
+        Returns the SimulationTier value of the cell at each row and column
+        """
+        bottom, top, left, right = self._camera_cells
+        distance: np.ndarray = np.maximum(
+            ring_distance(rows, bottom, top, self.grid_height),
+            ring_distance(cols, left, right, self.grid_width),
+        )
+        return np.where(
+            distance <= self.settings.near_cells,
+            SimulationTier.FULL.value,
+            np.where(
+                distance <= self.settings.far_cells,
+                SimulationTier.MID.value,
+                SimulationTier.FAR.value,
+            ),
+        ).astype(np.int8)
+
+    def get_flocking(
+        self, rows: np.ndarray, cols: np.ndarray, tiers: np.ndarray, tick: int
+    ) -> np.ndarray:
+        """
+        Returns whether the cell at each row and column flocks in the given tick
+        :param tiers: The tiers get_tiers returned for the cells
+        """
+        interval: int = self.settings.mid_interval
+        return (tiers == SimulationTier.FULL.value) | (
+            (tiers == SimulationTier.MID.value)
+            & ((rows + cols) % interval == tick % interval)
+        )
+
+
+def ring_distance(index: np.ndarray, first: int, last: int, size: int) -> np.ndarray:
+    """
+    Distance of every index to the range [first, last] on a ring of the given size, 0 inside the range
+    """
+    first %= size
+    last %= size
+    before: np.ndarray = (first - index) % size
+    after: np.ndarray = (index - last) % size
+    inside: np.ndarray = (index - first) % size <= (last - first) % size
+    return np.where(inside, 0, np.minimum(before, after))
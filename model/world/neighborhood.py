@@ -0,0 +1,52 @@
+from pygame import Vector2
+
+from model.entities.gameentity import GameEntity
+
+
+class NeighborhoodSnapshot:
+    """
+    The entities of one cell neighborhood together with a flat copy of their position and velocity, split up by group.\n
+    A snapshot is filled once per cell and then shared by every entity in that cell, so the neighborhood list is only built once and the Vector2 attribute lookups are only paid once per neighbor instead of once per pair.
+    The lists are cleared and refilled in place, so one snapshot object can be reused for every cell of a frame
+    """
+
+    def __init__(self) -> None:
+        self.entities: list[GameEntity] = []
+        # group_id -> (x, y, vx, vy)
+        self.groups: dict[
+            int, tuple[list[float], list[float], list[float], list[float]]
+        ] = {}
+        # Columns of the groups the last fill put entities in. Only those have to be cleared, neighborhoods usually hold one or two of all the groups
+        self._filled: list[
+            tuple[list[float], list[float], list[float], list[float]]
+        ] = []
+
+    def fill(self, entities: list[GameEntity]) -> None:
+        self.entities[:] = entities
+        groups = self.groups
+        filled = self._filled
+        for columns in filled:
+            for column in columns:
+                column.clear()
+        filled.clear()
+        for e in entities:
+            columns = groups.get(e.group_id)
+            if columns is None:
+                columns = ([], [], [], [])
+                groups[e.group_id] = columns
+            if not columns[0]:
+                filled.append(columns)
+            position: Vector2 = e.position
+            velocity: Vector2 = e.velocity
+            columns[0].append(position.x)
+            columns[1].append(position.y)
+            columns[2].append(velocity.x)
+            columns[3].append(velocity.y)
+
+    def get_group(
+        self, group_id: int
+    ) -> tuple[list[float], list[float], list[float], list[float]] | None:
+        """
+        Returns the (x, y, vx, vy) columns of the neighbors in the given group, or None if the group is not in this neighborhood
+        """
+        return self.groups.get(group_id)
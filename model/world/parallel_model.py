@@ -0,0 +1,606 @@
+import multiprocessing
+import os
+import signal
+import weakref
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from pygame import Vector2
+
+from model.entities.entity_arrays import COLUMNS, EntityArrays, FlockParameterTable
+from model.entities.player import Player
+from model.world.array_model import (
+    ArraySpatialPartitioningModel,
+    KernelBackend,
+    run_flocking_kernel,
+    run_integration_kernel,
+)
+from model.world.cell_index import CellIndex, get_runs, sort_keys
+
+# Cell index arrays that the workers need, and whether they have one entry per entity or per occupied bucket
+INDEX_COLUMNS: dict[str, str] = {
+    "cell_row": "entity",
+    "cell_col": "entity",
+    "bucket_keys": "bucket",
+    "bucket_start": "bucket",
+    "bucket_count": "bucket",
+}
+# Per row arrays of the band sort: every band's rows sorted on their own (their keys and the rows they came from), then all rows merged (same again)
+SORT_COLUMNS: tuple[str, ...] = ("band_keys", "band_order", "keys", "order")
+# Fills the shared bucket_keys past the occupied buckets. It sorts after every real key, so the workers can search the whole shared array
+PADDING_KEY: int = np.iinfo(np.int64).max
+
+
+class SharedEntityArrays(EntityArrays):
+    """
+    EntityArrays whose columns live in multiprocessing.shared_memory blocks, so that worker processes can read and write them without copying.\n
+    Every time the arrays grow the blocks are replaced and 'version' is incremented, and workers have to re-attach using get_layout
+    """
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self.blocks: dict[str, SharedMemory] = {}
+        self.version: int = 0
+        super().__init__(capacity)
+
+    def _allocate(self, name: str, shape: tuple[int, ...], dtype) -> np.ndarray:
+        block, array = create_shared_array(shape, dtype)
+        self.blocks[name] = block
+        return array
+
+    def _grow(self, min_capacity: int) -> None:
+        old_blocks: list[SharedMemory] = list(self.blocks.values())
+        super()._grow(min_capacity)
+        # The old columns have been copied and dropped, so their blocks can go
+        for block in old_blocks:
+            block.close()
+            block.unlink()
+        self.version += 1
+
+    def adopt_columns(self, columns: dict[str, np.ndarray], count: int) -> None:
+        # Workers can only attach to shared memory, so the columns are copied in
+        if count > self.capacity:
+            self._grow(count)
+        for name in COLUMNS:
+            getattr(self, name)[:count] = columns[name][:count]
+        self.count = count
+
+    def get_layout(self) -> dict[str, tuple[str, tuple[int, ...], str]]:
+        """
+        Returns column name -> (shared memory name, shape, dtype) for attaching from another process
+        """
+        return {
+            name: (self.blocks[name].name, getattr(self, name).shape, dtype.__name__)
+            for name, (_, dtype) in COLUMNS.items()
+        }
+
+    def release(self) -> None:
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks.clear()
+
+
+def create_shared_array(
+    shape: tuple[int, ...], dtype
+) -> tuple[SharedMemory, np.ndarray]:
+    nbytes: int = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    block: SharedMemory = SharedMemory(create=True, size=nbytes)
+    array: np.ndarray = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    array.fill(0)
+    return block, array
+
+
+def attach_shared_array(
+    layout: tuple[str, tuple[int, ...], str], attached: list[SharedMemory]
+) -> np.ndarray:
+    name, shape, dtype = layout
+    # Worker processes share the resource tracker of the process that created the block, so attaching doesn't register it a second time
+    block: SharedMemory = SharedMemory(name=name)
+    attached.append(block)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def _band_worker(connection: Connection, kernel_backend: KernelBackend) -> None:
+    """
+    Worker process loop. Every command is answered with True once it has been carried out, which is what keeps all workers in lock step.\n
+    Workers run the serial kernels. The parallelism comes from the processes
+    """
+    # Importing the entry script can initialize pygame, and SDL turns SIGTERM into a quit event, which would keep terminate() from stopping the worker
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    attached: list[SharedMemory] = []
+    arrays: EntityArrays = EntityArrays.__new__(EntityArrays)
+    # The columns that the rows are gathered into when they are sorted, after which the two swap
+    back: EntityArrays = EntityArrays.__new__(EntityArrays)
+    cell_index: CellIndex = CellIndex(1, 1)
+    sort_arrays: dict[str, np.ndarray] = {}
+    flocks: FlockParameterTable | None = None
+    while True:
+        try:
+            command, payload = connection.recv()
+        except EOFError:
+            # The main process is gone
+            command, payload = "close", None
+        reply = True
+        if command == "layout":
+            (
+                entity_layout,
+                back_layout,
+                index_layout,
+                sort_layout,
+                grid_size,
+                buckets_per_cell,
+            ) = payload
+            old_blocks: list[SharedMemory] = attached
+            attached = []
+            for name, layout in entity_layout.items():
+                setattr(arrays, name, attach_shared_array(layout, attached))
+            for name, layout in back_layout.items():
+                setattr(back, name, attach_shared_array(layout, attached))
+            cell_index = CellIndex(*grid_size)
+            for name, layout in index_layout.items():
+                setattr(cell_index, name, attach_shared_array(layout, attached))
+            cell_index.buckets_per_cell = buckets_per_cell
+            sort_arrays = {
+                name: attach_shared_array(layout, attached)
+                for name, layout in sort_layout.items()
+            }
+            # Only close the old blocks once nothing points into them any more
+            for block in old_blocks:
+                block.close()
+        elif command == "flocks":
+            flocks = payload
+        elif command == "forces":
+            count, start, stop, tiered = payload
+            arrays.count = count
+            if tiered:
+                # Only the rows of the band that flock this tick, see ArraySpatialPartitioningModel.apply_tiers
+                rows: np.ndarray = start + np.flatnonzero(
+                    arrays.force_scale[start:stop]
+                )
+                arrays.acceleration[rows] += (
+                    run_flocking_kernel(
+                        kernel_backend, arrays, flocks, cell_index, rows, parallel=False
+                    )
+                    * arrays.force_scale[rows, None]
+                )
+            else:
+                arrays.acceleration[start:stop] += run_flocking_kernel(
+                    kernel_backend,
+                    arrays,
+                    flocks,
+                    cell_index,
+                    np.arange(start, stop),
+                    parallel=False,
+                )
+        elif command == "integrate":
+            start, stop, world_w, world_h, dt, cell_size, boundaries = payload
+            arrays.previous_position[start:stop] = arrays.position[start:stop]
+            run_integration_kernel(
+                kernel_backend,
+                arrays,
+                start,
+                stop,
+                world_w,
+                world_h,
+                dt,
+                parallel=False,
+            )
+            reply = _sort_band(
+                arrays, cell_index, sort_arrays, start, stop, cell_size, boundaries
+            )
+        elif command == "gather":
+            count, start, stop = payload
+            reply = _gather_band(arrays, back, cell_index, sort_arrays, start, stop)
+            arrays, back = back, arrays
+            arrays.count = count
+        elif command == "close":
+            for block in attached:
+                block.close()
+            if payload is not None:
+                connection.send(True)
+            return
+        connection.send(reply)
+
+
+def _sort_band(
+    arrays: EntityArrays,
+    cell_index: CellIndex,
+    sort_arrays: dict[str, np.ndarray],
+    start: int,
+    stop: int,
+    cell_size: float,
+    boundaries: list[int],
+) -> tuple[int, list[int]]:
+    """
+    Works out the new cell of every row of a band after integration and sorts the band by bucket key on its own, the same way CellIndex.rebuild sorts all rows.
+    The sorted keys and the rows they came from go to band_keys and band_order.\n
+    Returns how many rows changed cells, and the slots of the sorted band where the rows that now belong to each band start, plus its end
+    :param boundaries: First grid row of every band, followed by the grid height
+    """
+    grid_width: int = cell_index.grid_width
+    buckets_per_cell: int = cell_index.buckets_per_cell
+    rows: np.ndarray = np.clip(
+        (arrays.position[start:stop, 1] / cell_size).astype(np.int64),
+        0,
+        cell_index.grid_height - 1,
+    )
+    cols: np.ndarray = np.clip(
+        (arrays.position[start:stop, 0] / cell_size).astype(np.int64),
+        0,
+        grid_width - 1,
+    )
+    moved_count: int = int(
+        np.count_nonzero(
+            (rows != cell_index.cell_row[start:stop])
+            | (cols != cell_index.cell_col[start:stop])
+        )
+    )
+    keys: np.ndarray = (
+        rows * grid_width + cols
+    ) * buckets_per_cell + arrays.group_slot[start:stop]
+    order: np.ndarray = sort_keys(keys, cell_index.n_cells * buckets_per_cell)
+    sorted_keys: np.ndarray = sort_arrays["band_keys"][start:stop]
+    np.take(keys, order, out=sorted_keys)
+    np.add(order, start, out=sort_arrays["band_order"][start:stop])
+    # Bands own whole grid rows, so the rows that go to each band are one run of the sorted keys
+    splits: np.ndarray = np.searchsorted(
+        sorted_keys,
+        np.array(boundaries, dtype=np.int64) * grid_width * buckets_per_cell,
+    )
+    return moved_count, splits.tolist()
+
+
+def _gather_band(
+    arrays: EntityArrays,
+    back: EntityArrays,
+    cell_index: CellIndex,
+    sort_arrays: dict[str, np.ndarray],
+    start: int,
+    stop: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fills the rows start..stop of back with the rows of arrays that the merged order puts there, and the cell index's cell_row and cell_col with their cells.
+    Returns the keys, start slots and sizes of the occupied buckets in those rows
+    """
+    order: np.ndarray = sort_arrays["order"][start:stop]
+    for name in COLUMNS:
+        np.take(
+            getattr(arrays, name), order, axis=0, out=getattr(back, name)[start:stop]
+        )
+    keys: np.ndarray = sort_arrays["keys"][start:stop]
+    cells: np.ndarray = keys // cell_index.buckets_per_cell
+    np.floor_divide(cells, cell_index.grid_width, out=cell_index.cell_row[start:stop])
+    np.remainder(cells, cell_index.grid_width, out=cell_index.cell_col[start:stop])
+    bucket_keys, bucket_start, bucket_count = get_runs(keys)
+    return bucket_keys, bucket_start + start, bucket_count
+
+
+def _shutdown(
+    workers: list[tuple[multiprocessing.Process, Connection]],
+    blocks: list[dict[str, SharedMemory]],
+) -> None:
+    for process, connection in workers:
+        try:
+            connection.send(("close", True))
+            connection.recv()
+        except (BrokenPipeError, EOFError, OSError):
+            pass
+        process.join(timeout=1.0)
+        if process.is_alive():
+            process.terminate()
+    for block_dict in blocks:
+        for block in block_dict.values():
+            block.close()
+            block.unlink()
+        block_dict.clear()
+
+
+class ParallelArraySpatialPartitioningModel(ArraySpatialPartitioningModel):
+    """
+    Multi-process version of the array model. The grid rows are split into horizontal bands, one per worker process, and every worker updates the entities of its band.\n
+    Entity arrays and the cell index live in shared memory. Because the arrays are sorted by cell in row major order, a band of grid rows is one contiguous range of array rows.
+    A worker reads its halo (the interaction range rows above and below its band, wrapping around the top and bottom of the toroidal grid) straight out of the shared arrays, so nothing has to be copied between workers.
+    Each frame runs in lock step phases: all workers compute forces, then all workers integrate. That way no worker moves entities while another is still reading them as its halo.\n
+    Right after integrating, every worker sorts its own band by the new cells of its rows. Most rows stay within their band's grid rows, so the main process only merges the rows that crossed into another band (see reconcile_bands).
+    Then all workers gather the rows of their part of the merged order into a second set of shared columns, which takes the place of the first. The result is the same stable sort as CellIndex.rebuild, so it doesn't depend on worker timing.
+    Bands are sized by entity count instead of by row count so that the workers stay balanced when entities bunch up.\n
+    Call close() when done with the model to stop the workers and free the shared memory.\n
+    Workers are started with forkserver where available, otherwise spawn. Either way they import the entry script, so it has to be guarded with if __name__ == "__main__"
+    :param worker_count: Number of worker processes. Defaults to the number of CPUs
+    """
+
+    def __init__(
+        self,
+        world_width: float,
+        world_height: float,
+        cell_size: float,
+        player: Player,
+        kernel_backend: KernelBackend = KernelBackend.AUTO,
+        worker_count: int | None = None,
+    ):
+        super().__init__(world_width, world_height, cell_size, player, kernel_backend)
+        self.arrays: SharedEntityArrays = SharedEntityArrays()
+        # The columns the workers gather sorted rows into, swapped with arrays every time they do
+        self._back: SharedEntityArrays = SharedEntityArrays()
+        self.worker_count: int = worker_count or os.cpu_count() or 1
+        # Shared copies of the cell index arrays the workers read
+        self._index_blocks: dict[str, SharedMemory] = {}
+        self._index_arrays: dict[str, np.ndarray] = {}
+        self._sent_layout: tuple | None = None
+        # Bands of the current frame, set by apply_forces and reused by move_entities
+        self._bands: list[tuple[int, int]] = []
+        # What every worker's band sort returned during move_entities, until migrate_entities merges them. See _sort_band
+        self._band_sorts: list[tuple[int, list[int]]] | None = None
+        # Plain fork isn't used: forking a process that already started Numba's thread pool can hang it on exit
+        start_method: str = (
+            "forkserver"
+            if "forkserver" in multiprocessing.get_all_start_methods()
+            else "spawn"
+        )
+        context = multiprocessing.get_context(start_method)
+        self._workers: list[tuple[multiprocessing.Process, Connection]] = []
+        for _ in range(self.worker_count):
+            parent_end, child_end = context.Pipe()
+            process = context.Process(
+                target=_band_worker,
+                args=(child_end, self.kernel_backend),
+                daemon=True,
+            )
+            process.start()
+            child_end.close()
+            self._workers.append((process, parent_end))
+        self._finalizer = weakref.finalize(
+            self,
+            _shutdown,
+            self._workers,
+            [self.arrays.blocks, self._back.blocks, self._index_blocks],
+        )
+
+    def close(self) -> None:
+        """
+        Stops the worker processes and frees the shared memory
+        """
+        self._finalizer()
+
+    def apply_forces(self, mouse_pos: Vector2) -> None:
+        n: int = self.arrays.count
+        self.flocks.refresh_targets()
+        self.tick += 1
+        # Far rows get their acceleration here, the workers skip them
+        tiered: bool = self.apply_tiers() is not None
+        self.count_pairs_tested(tiered)
+        self._broadcast(("flocks", self.flocks))
+        self._bands = self.get_band_rows()
+        # Phase 1: forces. Every worker only writes the acceleration of its own band
+        self._scatter(
+            [("forces", (n, start, stop, tiered)) for start, stop in self._bands]
+        )
+
+    def move_entities(self, dt: float) -> None:
+        # Phase 2: integration and band sorts. Starts only after every worker is done reading positions
+        self._publish_layout()
+        boundaries: list[int] = self.get_band_boundaries()
+        self._band_sorts = self._scatter(
+            [
+                (
+                    "integrate",
+                    (
+                        start,
+                        stop,
+                        self.world_width,
+                        self.world_height,
+                        dt,
+                        self.cell_size,
+                        boundaries,
+                    ),
+                )
+                for start, stop in self._bands
+            ]
+        )
+
+    def migrate_entities(self) -> None:
+        # Reconcile entities that moved across bands (and cells). Entities added since the bands were sorted need a full rebuild
+        if self._band_sorts is None or self._index_dirty:
+            self.rebuild_cell_index()
+        else:
+            self.reconcile_bands()
+        self._band_sorts = None
+        self.cells_migrated = self.cell_index.moved_count
+
+    def get_band_rows(self) -> list[tuple[int, int]]:
+        """
+        Splits the grid rows into one band per worker so that each band holds about the same number of entities, and returns the [start, stop) array rows of every band
+        """
+        n: int = self.arrays.count
+        if n == 0:
+            return [(0, 0)] * self.worker_count
+        # Each band ends at the first grid row boundary at or after its ideal split: the end of the grid row that holds the band's last ideal row
+        ideal: np.ndarray = np.ceil(
+            n * np.arange(1, self.worker_count + 1) / self.worker_count
+        ).astype(np.int64)
+        cell_row: np.ndarray = self.cell_index.cell_row[:n]
+        stops: list[int] = np.searchsorted(
+            cell_row, cell_row[ideal - 1], side="right"
+        ).tolist()
+        stops[-1] = n
+        starts: list[int] = [0] + stops[:-1]
+        return list(zip(starts, stops))
+
+    def get_band_boundaries(self) -> list[int]:
+        """
+        Returns the first grid row of every band, followed by the grid height. Bands own the grid rows from their first to the next band's first, so empty grid rows and the rows of empty bands belong to the band before them
+        """
+        n: int = self.arrays.count
+        cell_row: np.ndarray = self.cell_index.cell_row
+        return (
+            [0]
+            + [
+                int(cell_row[start]) if start < n else self.grid_height
+                for start, _ in self._bands[1:]
+            ]
+            + [self.grid_height]
+        )
+
+    def reconcile_bands(self) -> None:
+        """
+        Sorts the rows by cell from the band sorts of move_entities and rebuilds the cell index.\n
+        A band's rows that stayed in its grid rows are already in order, so only the rows that crossed into another band are merged in, by binary search.
+        The merge gives the same order as the stable sort of CellIndex.rebuild: a row that comes from an earlier band goes before the rows of its bucket that were already there, a row from a later band after them.
+        The workers then gather every column in the merged order into the back columns, and the two swap
+        """
+        n: int = self.arrays.count
+        self._publish_layout()
+        band_keys: np.ndarray = self._index_arrays["band_keys"]
+        band_order: np.ndarray = self._index_arrays["band_order"]
+        keys: np.ndarray = self._index_arrays["keys"]
+        order: np.ndarray = self._index_arrays["order"]
+        splits: list[list[int]] = [band_splits for _, band_splits in self._band_sorts]
+        targets: list[tuple[int, int]] = []
+        stop: int = 0
+        for band, (band_start, _) in enumerate(self._bands):
+            kept: slice = slice(
+                band_start + splits[band][band], band_start + splits[band][band + 1]
+            )
+            # Every other band's rows that now belong to this band, in band order
+            arriving: list[tuple[slice, bool]] = [
+                (
+                    slice(
+                        other_start + splits[other][band],
+                        other_start + splits[other][band + 1],
+                    ),
+                    other < band,
+                )
+                for other, (other_start, _) in enumerate(self._bands)
+                if other != band and splits[other][band + 1] > splits[other][band]
+            ]
+            start: int = stop
+            stop = start + kept.stop - kept.start
+            stop += sum(rows.stop - rows.start for rows, _ in arriving)
+            if not arriving:
+                keys[start:stop] = band_keys[kept]
+                order[start:stop] = band_order[kept]
+            else:
+                new_keys: np.ndarray = np.concatenate(
+                    [band_keys[rows] for rows, _ in arriving]
+                )
+                by_key: np.ndarray = np.argsort(new_keys, kind="stable")
+                new_keys = new_keys[by_key]
+                new_rows: np.ndarray = np.concatenate(
+                    [band_order[rows] for rows, _ in arriving]
+                )[by_key]
+                earlier: np.ndarray = np.repeat(
+                    [is_earlier for _, is_earlier in arriving],
+                    [rows.stop - rows.start for rows, _ in arriving],
+                )[by_key]
+                kept_keys: np.ndarray = band_keys[kept]
+                at: np.ndarray = np.where(
+                    earlier,
+                    np.searchsorted(kept_keys, new_keys, "left"),
+                    np.searchsorted(kept_keys, new_keys, "right"),
+                )
+                keys[start:stop] = np.insert(kept_keys, at, new_keys)
+                order[start:stop] = np.insert(band_order[kept], at, new_rows)
+            targets.append((start, stop))
+        buckets: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = self._scatter(
+            [("gather", (n, start, stop)) for start, stop in targets]
+        )
+        self.arrays, self._back = self._back, self.arrays
+        self.arrays.count = n
+        index: CellIndex = self.cell_index
+        index.moved_count = sum(moved_count for moved_count, _ in self._band_sorts)
+        index.order = order[:n]
+        index.set_buckets(
+            self._index_arrays["cell_row"][:n],
+            self._index_arrays["cell_col"][:n],
+            *(np.concatenate(tables) for tables in zip(*buckets)),
+        )
+        # The workers wrote cell_row and cell_col themselves
+        self._publish_cell_index(entity_columns=False)
+
+    def rebuild_cell_index(self) -> None:
+        super().rebuild_cell_index()
+        self._publish_cell_index()
+
+    def _publish_cell_index(self, entity_columns: bool = True) -> None:
+        """
+        Copies the cell index into shared memory, replacing the blocks when they are too small, and sends the workers the new layout when anything moved
+        :param entity_columns: Whether to copy the arrays with one entry per entity as well as the bucket tables
+        """
+        self._publish_layout()
+        for name, kind in INDEX_COLUMNS.items():
+            if kind == "entity" and not entity_columns:
+                continue
+            source: np.ndarray = getattr(self.cell_index, name)
+            shared: np.ndarray = self._index_arrays[name]
+            shared[: len(source)] = source
+            shared[len(source) :] = PADDING_KEY if name == "bucket_keys" else 0
+
+    def _publish_layout(self) -> None:
+        """
+        Makes sure that the back columns and every shared cell index and sort array are big enough, replacing the blocks of those that aren't, and sends the workers the new layout when anything moved
+        """
+        if self._back.capacity < self.arrays.capacity:
+            self._back._grow(self.arrays.capacity)
+        sizes: dict[str, int] = {
+            "entity": max(self.arrays.capacity, self._back.capacity),
+            "bucket": len(self.cell_index.bucket_count),
+        }
+        kinds: dict[str, str] = dict(INDEX_COLUMNS)
+        kinds.update((name, "entity") for name in SORT_COLUMNS)
+        for name, kind in kinds.items():
+            shared: np.ndarray | None = self._index_arrays.get(name)
+            if shared is None or len(shared) < sizes[kind]:
+                old: SharedMemory | None = self._index_blocks.get(name)
+                # Occupied buckets come and go, so their arrays get room to grow before they are replaced
+                block, shared = create_shared_array(
+                    (sizes[kind] if kind == "entity" else 2 * sizes[kind] + 64,),
+                    np.int64,
+                )
+                self._index_blocks[name] = block
+                self._index_arrays[name] = shared
+                if old is not None:
+                    old.close()
+                    old.unlink()
+        # Which of the two sets of columns is in front changes every frame, the workers keep track of that themselves
+        layout = (
+            tuple(
+                sorted(
+                    block.name
+                    for arrays in (self.arrays, self._back)
+                    for block in arrays.blocks.values()
+                )
+            ),
+            tuple(block.name for block in self._index_blocks.values()),
+            self.cell_index.buckets_per_cell,
+        )
+        if layout != self._sent_layout:
+            shared_layouts: dict[str, tuple[str, tuple[int, ...], str]] = {
+                name: (block.name, self._index_arrays[name].shape, "int64")
+                for name, block in self._index_blocks.items()
+            }
+            self._broadcast(
+                (
+                    "layout",
+                    (
+                        self.arrays.get_layout(),
+                        self._back.get_layout(),
+                        {name: shared_layouts[name] for name in INDEX_COLUMNS},
+                        {name: shared_layouts[name] for name in SORT_COLUMNS},
+                        (self.grid_width, self.grid_height),
+                        self.cell_index.buckets_per_cell,
+                    ),
+                )
+            )
+            self._sent_layout = layout
+
+    def _broadcast(self, message: tuple) -> None:
+        self._scatter([message] * len(self._workers))
+
+    def _scatter(self, messages: list[tuple]) -> list:
+        """
+        Sends one message to each worker, waits until all of them are done and returns their replies
+        """
+        for (_, connection), message in zip(self._workers, messages):
+            connection.send(message)
+        return [connection.recv() for _, connection in self._workers]
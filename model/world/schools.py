@@ -0,0 +1,119 @@
+from pygame import Vector2
+
+from model.entities.boid import FISH_IMAGES, FishFactory, FishTypes, FlockingParameters
+from model.utils.assets import AssetKey
+from model.world.spatial_partitioning_model import SpatialPartitioningModel
+
+# Sprites used by add_default_schools, for preloading (see AssetCache.preload)
+SCHOOL_SPRITES: list[AssetKey] = [
+    AssetKey(FISH_IMAGES[FishTypes.RED], (32.0, 32.0)),
+    AssetKey(FISH_IMAGES[FishTypes.GREEN], (48.0, 48.0)),
+    AssetKey(FISH_IMAGES[FishTypes.YELLOW], (32.0, 32.0)),
+]
+
+
+def get_red_school_with_random_target(
+    model: SpatialPartitioningModel, school_id: int, placeholder_surface: bool = False
+) -> FishFactory:
+    return FishFactory(
+        FishTypes.RED,
+        FlockingParameters(
+            128.0,
+            48.0,
+            1.0,
+            1.8,
+            1.0,
+            school_id,
+            Vector2(
+                model.rng.randint(
+                    int(model.cell_size), int(model.world_width - model.cell_size)
+                ),
+                model.rng.randint(
+                    int(model.cell_size), int(model.world_height - model.cell_size)
+                ),
+            ),
+            1.0,
+        ),
+        32.0,
+        32.0,
+        200.0,
+        1.0,
+        (0.0, model.world_width),
+        (0.0, model.world_height),
+        1,
+        placeholder_surface,
+        rng=model.rng,
+    )
+
+
+def add_default_schools(
+    model: SpatialPartitioningModel,
+    placeholder_surfaces: bool = False,
+    red_school_count: int = 10,
+    red_count: int = 50,
+    green_count: int = 300,
+    yellow_count: int = 300,
+) -> None:
+    """
+    Fills the model with the fish schools of the game: a number of red schools that each swim towards their own random target, one large green school and one fast yellow school.
+    Targets, positions and velocities are drawn from the model's rng
+    :param placeholder_surfaces: Use plain surfaces instead of the fish sprites, so that no display is needed
+    :param red_school_count: Number of red schools
+    :param red_count: Number of fish in every red school
+    :param green_count: Number of fish in the green school
+    :param yellow_count: Number of fish in the yellow school
+    """
+    for x in range(red_school_count):
+        school: FishFactory = get_red_school_with_random_target(
+            model, x, placeholder_surfaces
+        )
+        model.add_game_entities(school.create_school(red_count).create_boids())
+
+    green_school_1 = FishFactory(
+        FishTypes.GREEN,
+        FlockingParameters(
+            256.0,
+            96.0,
+            1.0,
+            1.8,
+            1.0,
+            red_school_count + 1,
+            None,
+            1.0,
+        ),
+        48.0,
+        48.0,
+        150.0,
+        1.0,
+        (0.0, model.world_width),
+        (0.0, model.world_height),
+        2,
+        placeholder_surfaces,
+        rng=model.rng,
+    )
+
+    yellow_school_1 = FishFactory(
+        FishTypes.YELLOW,
+        FlockingParameters(
+            128.0,
+            48.0,
+            1.0,
+            1.8,
+            1.0,
+            red_school_count + 2,
+            None,
+            1.0,
+        ),
+        32.0,
+        32.0,
+        300.0,
+        1.5,
+        (0.0, model.world_width),
+        (0.0, model.world_height),
+        1,
+        placeholder_surfaces,
+        rng=model.rng,
+    )
+
+    model.add_game_entities(green_school_1.create_school(green_count).create_boids())
+    model.add_game_entities(yellow_school_1.create_school(yellow_count).create_boids())
@@ -0,0 +1,487 @@
+import json
+import os
+import struct
+from typing import Iterator, Tuple
+
+import numpy as np
+import pygame
+from pygame import Surface, Vector2
+
+from model.entities.boid import Boid, FlockingParameters
+from model.entities.entity_arrays import COLUMNS, EntityArrays, FlockParameterTable
+from model.entities.gameentity import GameEntity
+from model.utils.sprite_rotations import RotationSet, rotation_cache
+from model.utils.assets import asset_cache
+from model.world.array_model import ArraySpatialPartitioningModel
+from model.world.spatial_partitioning_model import SpatialPartitioningModel
+
+SNAPSHOT_MAGIC: bytes = b"BOIDSNAP"
+# Incremented whenever the layout changes. Files of a newer version than this can't be read
+SNAPSHOT_VERSION: int = 1
+# Magic, version and length of the JSON header that follows
+_PREFIX: struct.Struct = struct.Struct("<8sIQ")
+# Every column starts at a multiple of this many bytes, so memory-mapped columns are aligned
+ALIGNMENT: int = 64
+# SnapshotEntityList creates entities in aligned chunks of this many ids
+ENTITY_CHUNK: int = 256
+# Columns that create_entities reads
+_ENTITY_COLUMNS: Tuple[str, ...] = (
+    "position",
+    "previous_position",
+    "velocity",
+    "acceleration",
+    "max_speed",
+    "max_acceleration",
+    "group_id",
+    "interaction_range",
+    "flock_row",
+    "ticks_since_forces",
+    "sprite",
+)
+
+
+class SpriteTable:
+    """
+    Distinct sprites (surface, size and number of pre-rendered angles) of the entities written to a snapshot, so that every entity only stores an index
+    """
+
+    def __init__(self) -> None:
+        self.surfaces: list[Surface] = []
+        self._surface_ids: dict[int, int] = {}
+        # (surface index, width, height, angle count)
+        self.sprites: list[Tuple[int, float, float, int]] = []
+        self._sprite_ids: dict[Tuple[int, float, float, int], int] = {}
+
+    def add(
+        self,
+        surface: Surface,
+        width: float,
+        height: float,
+        rotations: RotationSet | None,
+    ) -> int:
+        """
+        Returns the index of the sprite, adding it the first time it is seen
+        """
+        surface_index: int = self._surface_ids.setdefault(
+            id(surface), len(self.surfaces)
+        )
+        if surface_index == len(self.surfaces):
+            self.surfaces.append(surface)
+        sprite: Tuple[int, float, float, int] = (
+            surface_index,
+            width,
+            height,
+            rotations.angle_count if rotations is not None else 0,
+        )
+        sprite_index: int = self._sprite_ids.setdefault(sprite, len(self.sprites))
+        if sprite_index == len(self.sprites):
+            self.sprites.append(sprite)
+        return sprite_index
+
+    def add_entity(self, entity: GameEntity) -> int:
+        return self.add(entity.surface, entity.width, entity.height, entity.rotations)
+
+
+class WorldSnapshot:
+    """
+    An open snapshot file, see save_snapshot. Only the header is read up front. Columns are memory-mapped when they are asked for, and surfaces are loaded the first time an entity needs them
+    :param placeholder_surfaces: Use plain surfaces instead of the stored images, so that no display is needed
+    """
+
+    def __init__(self, path: str, placeholder_surfaces: bool = False) -> None:
+        with open(path, "rb") as file:
+            prefix: bytes = file.read(_PREFIX.size)
+            if len(prefix) < _PREFIX.size:
+                raise ValueError(path + " is not a world snapshot")
+            magic, version, header_length = _PREFIX.unpack(prefix)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(path + " is not a world snapshot")
+            if version > SNAPSHOT_VERSION:
+                raise ValueError(
+                    "{} is snapshot version {}, only versions up to {} can be read".format(
+                        path, version, SNAPSHOT_VERSION
+                    )
+                )
+            self.header: dict = json.loads(file.read(header_length))
+        self.path: str = path
+        self.version: int = version
+        self.data_start: int = _align(_PREFIX.size + header_length)
+        self.count: int = self.header["count"]
+        self.placeholder_surfaces: bool = placeholder_surfaces
+        # Row 0 is reserved for entities that don't flock, like in FlockParameterTable
+        self.flocks: list[FlockingParameters | None] = [None] + [
+            FlockingParameters(
+                flock["cohere_distance"],
+                flock["avoid_distance"],
+                flock["cohere_k"],
+                flock["avoid_k"],
+                flock["align_k"],
+                flock["flock_id"],
+                (
+                    Vector2(flock["target_location"])
+                    if flock["target_location"] is not None
+                    else None
+                ),
+                flock["target_k"],
+            )
+            for flock in self.header["flocks"]
+        ]
+        # Read only columns, mapped once and kept for creating entities
+        self._columns: dict[str, np.ndarray] = {}
+        self._surfaces: list[Surface] | None = None
+        self._sprites: list[Tuple[Surface, float, float, RotationSet | None]] | None = (
+            None
+        )
+
+    def get_column(self, name: str, mode: str = "r") -> np.ndarray:
+        """
+        Memory-maps a column of the file
+        :param mode: np.memmap mode. "r" is read only, "c" can be written to without changing the file (copy on write)
+        """
+        column: dict = self.header["columns"][name]
+        shape: Tuple[int, ...] = tuple(column["shape"])
+        if 0 in shape:
+            return np.zeros(shape, dtype=column["dtype"])
+        return np.memmap(
+            self.path,
+            dtype=column["dtype"],
+            mode=mode,
+            offset=self.data_start + column["offset"],
+            shape=shape,
+        )
+
+    def get_surfaces(self) -> list[Surface]:
+        if self._surfaces is None:
+            self._surfaces = [
+                self._load_surface(i, surface)
+                for i, surface in enumerate(self.header["surfaces"])
+            ]
+        return self._surfaces
+
+    def _load_surface(self, index: int, source: dict) -> Surface:
+        size: Tuple[int, int] = tuple(source["size"])
+        if self.placeholder_surfaces:
+            surface: Surface = pygame.Surface(size)
+            surface.fill((255, 255, 255))
+            return surface
+        if source["path"] is not None:
+            return asset_cache.get(source["path"], size)
+        surface = pygame.image.frombytes(
+            self.get_column("surface_" + str(index)).tobytes(), size, "RGBA"
+        )
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha()
+        return surface
+
+    def get_sprites(self) -> list[Tuple[Surface, float, float, RotationSet | None]]:
+        """
+        Returns (surface, width, height, rotations) of every sprite in the snapshot
+        """
+        if self._sprites is None:
+            surfaces: list[Surface] = self.get_surfaces()
+            self._sprites = [
+                (
+                    surfaces[surface_index],
+                    width,
+                    height,
+                    rotation_cache.get_rotations(surfaces[surface_index], angle_count),
+                )
+                for surface_index, width, height, angle_count in self.header["sprites"]
+            ]
+        return self._sprites
+
+    def create_entities(self, start: int, stop: int) -> list[GameEntity]:
+        """
+        Creates the GameEntity objects of rows [start, stop). Entities with flocking parameters become Boids, all others plain GameEntities
+        """
+        sprites: list[Tuple[Surface, float, float, RotationSet | None]] = (
+            self.get_sprites()
+        )
+        for name in _ENTITY_COLUMNS:
+            if name not in self._columns:
+                self._columns[name] = self.get_column(name)
+        columns: dict[str, list] = {
+            name: self._columns[name][start:stop].tolist() for name in _ENTITY_COLUMNS
+        }
+        entities: list[GameEntity] = []
+        for i in range(stop - start):
+            surface, width, height, rotations = sprites[columns["sprite"][i]]
+            flock_row: int = columns["flock_row"][i]
+            entity: GameEntity
+            if flock_row > 0:
+                entity = Boid(
+                    self.flocks[flock_row],
+                    surface,
+                    width,
+                    height,
+                    Vector2(columns["position"][i]),
+                    Vector2(columns["velocity"][i]),
+                    columns["max_speed"][i],
+                    columns["max_acceleration"][i],
+                    columns["interaction_range"][i],
+                    rotations,
+                )
+            else:
+                entity = GameEntity(
+                    surface,
+                    width,
+                    height,
+                    Vector2(columns["position"][i]),
+                    Vector2(columns["velocity"][i]),
+                    columns["max_speed"][i],
+                    columns["max_acceleration"][i],
+                    columns["group_id"][i],
+                    columns["interaction_range"][i],
+                )
+                entity.rotations = rotations
+            entity.previous_position.update(columns["previous_position"][i])
+            entity.acceleration.update(columns["acceleration"][i])
+            entity.ticks_since_forces = columns["ticks_since_forces"][i]
+            entities.append(entity)
+        return entities
+
+
+class SnapshotEntityList:
+    """
+    Entity list of an array model loaded from a snapshot, indexed by entity id. The GameEntity objects are only created from the snapshot when they are first looked up, so a large world opens without building every object up front
+    """
+
+    def __init__(self, snapshot: WorldSnapshot) -> None:
+        self.snapshot: WorldSnapshot = snapshot
+        self._entities: list[GameEntity | None] = [None] * snapshot.count
+        # Which of the snapshot's rows have been created
+        self._created: np.ndarray = np.zeros(snapshot.count, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+    def __getitem__(self, entity_id: int) -> GameEntity:
+        entity: GameEntity | None = self._entities[entity_id]
+        if entity is None:
+            # Entity ids follow the saved cell order, so entities close in id are usually looked up together, for example by the camera
+            start: int = entity_id - entity_id % ENTITY_CHUNK
+            stop: int = min(start + ENTITY_CHUNK, self.snapshot.count)
+            for i, created in enumerate(self.snapshot.create_entities(start, stop)):
+                if self._entities[start + i] is None:
+                    self._entities[start + i] = created
+            self._created[start:stop] = True
+            entity = self._entities[entity_id]
+        return entity
+
+    def __iter__(self) -> Iterator[GameEntity]:
+        for entity_id in range(len(self._entities)):
+            yield self[entity_id]
+
+    def append(self, entity: GameEntity) -> None:
+        self._entities.append(entity)
+
+    def extend(self, entities: list[GameEntity]) -> None:
+        self._entities.extend(entities)
+
+    def get_sprites(self, entity_ids: np.ndarray, table: SpriteTable) -> np.ndarray:
+        """
+        Returns the index into table of the sprite of every given entity, adding the sprites to the table. Entities that haven't been created are looked up in the snapshot without creating them
+        """
+        loaded: np.ndarray = entity_ids < self.snapshot.count
+        sprite_ids: np.ndarray = np.empty(len(entity_ids), dtype=np.int64)
+        snapshot_sprites: np.ndarray = np.array(
+            [table.add(*sprite) for sprite in self.snapshot.get_sprites()],
+            dtype=np.int64,
+        )
+        sprite_ids[loaded] = snapshot_sprites[
+            self.snapshot.get_column("sprite")[entity_ids[loaded]]
+        ]
+        created: np.ndarray = ~loaded
+        created[loaded] = self._created[entity_ids[loaded]]
+        for i in np.flatnonzero(created).tolist():
+            sprite_ids[i] = table.add_entity(self._entities[entity_ids[i]])
+        return sprite_ids
+
+
+def save_snapshot(model: SpatialPartitioningModel, path: str) -> None:
+    """
+    Writes the state of the model to a snapshot file: the entity columns (see EntityArrays), flocking parameters, sprites, group slots, the player and the grid.\n
+    The file is a fixed prefix (magic, format version and header length), a JSON header, and then every column as raw little endian data aligned to ALIGNMENT bytes, so load_snapshot can memory-map them.
+    Sprites loaded from image files through the asset cache are stored as a reference to the file, other surfaces with their pixels.
+    Entities are stored as Boids or plain GameEntities. State that subclasses add isn't saved.\n
+    The file is written next to path and then moved over it, so a snapshot that is still open (memory-mapped) stays valid
+    """
+    table: SpriteTable = SpriteTable()
+    columns: dict[str, np.ndarray]
+    flocks: list[FlockingParameters | None]
+    if isinstance(model, ArraySpatialPartitioningModel):
+        model.ensure_cell_index()
+        a: EntityArrays = model.arrays
+        n: int = a.count
+        columns = {name: getattr(a, name)[:n] for name in COLUMNS}
+        entity_ids: np.ndarray = columns["entity_id"]
+        # Entity ids are renumbered to the row, which keeps the rows sorted by cell and the entity list in row order
+        columns["entity_id"] = np.arange(n, dtype=np.int64)
+        if isinstance(model.entities, SnapshotEntityList):
+            columns["sprite"] = model.entities.get_sprites(entity_ids, table)
+        else:
+            columns["sprite"] = np.array(
+                [table.add_entity(model.entities[i]) for i in entity_ids.tolist()],
+                dtype=np.int64,
+            )
+        flocks = model.flocks.parameters
+    else:
+        entities: list[GameEntity] = model.get_all_entities()
+        a = EntityArrays(max(len(entities), 1))
+        flock_table: FlockParameterTable = FlockParameterTable()
+        for entity_id, entity in enumerate(entities):
+            a.append(
+                entity,
+                entity_id,
+                flock_table.get_row(entity),
+                model.group_slots[entity.group_id],
+            )
+        n = a.count
+        columns = {name: getattr(a, name)[:n] for name in COLUMNS}
+        columns["sprite"] = np.array(
+            [table.add_entity(entity) for entity in entities], dtype=np.int64
+        )
+        flocks = flock_table.parameters
+    surfaces: list[dict] = []
+    for i, surface in enumerate(table.surfaces):
+        surface_path: str | None = asset_cache.get_path(surface)
+        surfaces.append({"path": surface_path, "size": list(surface.get_size())})
+        if surface_path is None:
+            width, height = surface.get_size()
+            columns["surface_" + str(i)] = np.frombuffer(
+                pygame.image.tobytes(surface, "RGBA"), dtype=np.uint8
+            ).reshape(height, width, 4)
+
+    offset: int = 0
+    column_layout: dict[str, dict] = {}
+    for name, column in columns.items():
+        column = np.ascontiguousarray(column, dtype=column.dtype.newbyteorder("<"))
+        columns[name] = column
+        column_layout[name] = {
+            "dtype": column.dtype.str,
+            "shape": list(column.shape),
+            "offset": offset,
+        }
+        offset = _align(offset + column.nbytes)
+    player = model.player
+    header: dict = {
+        "world_width": model.world_width,
+        "world_height": model.world_height,
+        "cell_size": model.cell_size,
+        "grid_width": model.grid_width,
+        "grid_height": model.grid_height,
+        "tick": model.tick,
+        "count": n,
+        "player": {
+            "position": [player.position.x, player.position.y],
+            "previous_position": [
+                player.previous_position.x,
+                player.previous_position.y,
+            ],
+            "facing_direction": player.facing_direction,
+        },
+        # group id -> group slot, the group_slot column refers to these
+        "group_slots": [
+            [group_id, slot] for group_id, slot in model.group_slots.items()
+        ],
+        "flocks": [
+            {
+                "cohere_distance": parameters.cohere_distance,
+                "avoid_distance": parameters.avoid_distance,
+                "cohere_k": parameters.cohere_k,
+                "avoid_k": parameters.avoid_k,
+                "align_k": parameters.align_k,
+                "flock_id": parameters.flock_id,
+                "target_location": (
+                    [parameters.target_location.x, parameters.target_location.y]
+                    if parameters.target_location is not None
+                    else None
+                ),
+                "target_k": parameters.target_k,
+            }
+            for parameters in flocks[1:]
+        ],
+        "surfaces": surfaces,
+        "sprites": [list(sprite) for sprite in table.sprites],
+        "columns": column_layout,
+    }
+    header_bytes: bytes = json.dumps(header).encode()
+    data_start: int = _align(_PREFIX.size + len(header_bytes))
+    temporary_path: str = path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        for name, column in columns.items():
+            file.seek(data_start + column_layout[name]["offset"])
+            file.write(column.data)
+        # Pad the last column so that the file ends on an aligned size as well
+        file.truncate(data_start + offset)
+    os.replace(temporary_path, path)
+
+
+def load_snapshot(
+    model: SpatialPartitioningModel,
+    source: str | WorldSnapshot,
+    placeholder_surfaces: bool = False,
+) -> WorldSnapshot:
+    """
+    Fills an empty model with the world of a snapshot file written by save_snapshot, and restores the player and the tick. The model must have the same world size and cell size as the saved one.\n
+    The array model adopts the memory-mapped columns directly (copy on write, the file isn't changed) and only creates GameEntity objects as they are looked up, so even very large worlds open almost instantly.
+    The object model needs every GameEntity, so it creates and adds all of them.\n
+    Returns the open snapshot
+    :param source: Path of the file, or a snapshot that is already open
+    :param placeholder_surfaces: Use plain surfaces instead of the stored sprites, so that no display is needed. Ignored when source is an open snapshot
+    """
+    snapshot: WorldSnapshot = (
+        source
+        if isinstance(source, WorldSnapshot)
+        else WorldSnapshot(source, placeholder_surfaces)
+    )
+    header: dict = snapshot.header
+    if (
+        header["world_width"] != model.world_width
+        or header["world_height"] != model.world_height
+        or header["cell_size"] != model.cell_size
+    ):
+        raise ValueError(
+            "The snapshot is of a {} x {} world with cell size {}, the model is {} x {} with cell size {}".format(
+                header["world_width"],
+                header["world_height"],
+                header["cell_size"],
+                model.world_width,
+                model.world_height,
+                model.cell_size,
+            )
+        )
+    if model.entity_count > 0:
+        raise ValueError("Snapshots can only be loaded into an empty model")
+    if isinstance(model, ArraySpatialPartitioningModel):
+        model.group_slots = {group_id: slot for group_id, slot in header["group_slots"]}
+        for parameters in snapshot.flocks[1:]:
+            model.flocks.get_parameters_row(parameters)
+        sprite_set_ids: np.ndarray = np.array(
+            [
+                model.get_sprite_set_id(rotations)
+                for _, _, _, rotations in snapshot.get_sprites()
+            ],
+            dtype=np.int64,
+        )
+        model.adopt_rows(
+            {name: snapshot.get_column(name, "c") for name in COLUMNS},
+            snapshot.count,
+            SnapshotEntityList(snapshot),
+            sprite_set_ids[snapshot.get_column("sprite")],
+        )
+    else:
+        for entity in snapshot.create_entities(0, snapshot.count):
+            model.add_game_entity(entity)
+    player: dict = header["player"]
+    model.player.position.update(player["position"])
+    model.player.previous_position.update(player["previous_position"])
+    model.player.facing_direction = player["facing_direction"]
+    model.tick = header["tick"]
+    return snapshot
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
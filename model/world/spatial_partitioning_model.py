@@ -1,20 +1,71 @@
+import itertools
+import math
 import random
-from typing import Tuple
+from collections import deque
+from enum import Enum
+from typing import Callable, Tuple
 
-import pygame
-from pygame import Vector2, Surface
+import numpy as np
+from pygame import Vector2
 from pygame.key import ScancodeWrapper
 
+from model.entities.boid import FlockingParameters
 from model.entities.gameentity import GameEntity
 from model.entities.player import Player
-from model.world.grid_cell import GridCell
+from model.entities.spawning import School
+from model.world.background_palette import BackgroundPalette
+from model.world.collisions import CollisionSystem
+from model.world.cell_index import CellIndex
+from model.world.flock_aggregates import (
+    AggregateNeighborhood,
+    AggregateSettings,
+    ApproximationError,
+    ApproximationMode,
+)
+from model.world.grid_cell import CellAggregate, GridCell
+from model.world.grid_level import GridLevel
+from model.world.lod import LodSettings, SimulationTier, TierGrid
+from model.world.neighborhood import NeighborhoodSnapshot
+from model.world.spatial_queries import SpatialQueries
+
+# Fewest residents of a group in a cell for CELL_BLOCKED to copy their neighborhood into a NeighborhoodSnapshot. Fewer residents loop over the neighbor list directly
+SNAPSHOT_MIN_RESIDENTS: int = 8
+
+
+class GridMode(Enum):
+    """
+    How the model tracks which entities are in which grid cell.\n
+    CELL_LISTS: every GridCell keeps a list of its entities, and entities that change cells are moved between lists.\n
+    SORTED_INDEX: entities are kept in one flat list that is sorted by cell every frame (see CellIndex). Neighborhoods are contiguous slices of that list
+    """
+
+    CELL_LISTS = 0
+    SORTED_INDEX = 1
+
+
+class UpdateMode(Enum):
+    """
+    How the model gathers neighbors when applying forces.\n
+    PER_ENTITY: every entity gathers its own neighborhood.\n
+    CELL_BLOCKED: each cell's neighborhood is gathered once per group, and then forces are computed for all of the cell's residents in that group against it.
+    Groups with at least SNAPSHOT_MIN_RESIDENTS residents in the cell copy the neighborhood into a NeighborhoodSnapshot first. This pays off for dense schools, where most cells hold many entities of one group
+    """
+
+    PER_ENTITY = 0
+    CELL_BLOCKED = 1
 
 
 class SpatialPartitioningModel:
     """
     Implementation of spatial partitioning. The 'world' is divided into a grid of cells. The size of a cell determines how far entities in the simulation can 'see'.\n
     When applying forces to entities, calculations are only performed on neighbors within the entity's cell and the 8 cells surrounding it instead of every entity that exists.\n
-    The world width and height must be evenly divisible by cell_size, or array out of bounds issues will occur\n
+    World sizes that aren't a multiple of cell_size are rounded up to whole cells, the last row and column of cells then reach past the world edge.\n
+    With GridMode.CELL_LISTS the grid is sparse: only cells that hold entities exist, hashed by (row, column) in each GridLevel, and a cell is freed as soon as its last entity leaves.
+    Memory and per-frame cost follow the occupied area, so worlds can be huge and mostly empty. The CellIndex of GridMode.SORTED_INDEX and the array backends is sparse too, it only has entries for occupied cells\n
+    With GridMode.CELL_LISTS, groups whose interaction range is more than one cell are kept in a coarser GridLevel with cells of a power of two times cell_size, so that every entity gathers neighbors from about 3x3 cells.
+    All entities of a group live in the same level, chosen when the group's first entity is added\n
+    :param grid_mode: How entities are bucketed into grid cells, see GridMode
+    :param update_mode: How neighborhoods are gathered when applying forces, see UpdateMode
     """
 
     def __init__(
@@ -23,88 +74,918 @@ class SpatialPartitioningModel:
         world_height: float,
         cell_size: float,
         player: Player,
+        grid_mode: GridMode = GridMode.CELL_LISTS,
+        update_mode: UpdateMode = UpdateMode.PER_ENTITY,
     ):
         self.world_width: float = world_width
         self.world_height: float = world_height
         self.cell_size: float = cell_size
-        self.grid_width: int = int(self.world_width / self.cell_size)
-        self.grid_height: int = int(self.world_height / self.cell_size)
+        self.grid_width: int = math.ceil(self.world_width / self.cell_size)
+        self.grid_height: int = math.ceil(self.world_height / self.cell_size)
         self.player: Player = player
-        self.grid_space: list[list[GridCell]] = self.initialize_grid_space()
-
-    def initialize_grid_space(self) -> list[list[GridCell]]:
-        grid_space: list[list[GridCell]] = []
-        for row in range(self.grid_height):
-            grid_space.append([])
-            for col in range(self.grid_width):
-                background: Surface = pygame.Surface((self.cell_size, self.cell_size))
-                noise: int = random.randint(0, 25)
-                background.fill((0, 50 + noise, 115 + noise * 2))
-                grid_space[row].append(
-                    GridCell(
-                        self.cell_size, row, col, self.player.camera_height, background
+        self.background_palette: BackgroundPalette = BackgroundPalette(cell_size)
+        # (row, column) -> grid cell of every occupied cell. Cells are created when an entity enters them and freed when they empty, see migrate_entities
+        self.grid_cells: dict[Tuple[int, int], GridCell] = {}
+        # Grid levels by scale, the base level holds grid_cells. Only used with GridMode.CELL_LISTS
+        self.base_level: GridLevel = GridLevel(
+            1,
+            cell_size,
+            self.grid_width,
+            self.grid_height,
+            self.background_palette,
+            self.grid_cells,
+        )
+        self.levels: dict[int, GridLevel] = {1: self.base_level}
+        self.group_levels: dict[int, GridLevel] = {}
+        self.grid_mode: GridMode = grid_mode
+        # Only used with GridMode.SORTED_INDEX. Entities are kept sorted by cell
+        self.entities: list[GameEntity] = []
+        self.entity_count: int = 0
+        # Counters of the last update_model call, for profiling. Models that have to do extra work to count only do so when count_statistics is set
+        self.count_statistics: bool = False
+        self.pairs_tested: int = 0
+        self.cells_migrated: int = 0
+        # (level, old cell, new row, new column, entity) of entities that moved to another cell this frame, with GridMode.CELL_LISTS
+        self._pending_migrations: list[
+            Tuple[GridLevel, GridCell, int, int, GameEntity]
+        ] = []
+        # Only used with GridMode.SORTED_INDEX
+        self.cell_index: CellIndex = CellIndex(self.grid_width, self.grid_height)
+        self._index_dirty: bool = False
+        # Dense renumbering of group ids, used to split each cell of the cell index into one bucket per group
+        self.group_slots: dict[int, int] = {}
+        self.update_mode: UpdateMode = update_mode
+        self._snapshot: NeighborhoodSnapshot = NeighborhoodSnapshot()
+        # Distance based simulation tiers, off unless set_lod is called
+        self.lod: TierGrid | None = None
+        self.tick: int = 0
+        # Entities per SimulationTier in the last update_model call
+        self.tier_counts: list[int] = [0, 0, 0]
+        # Cell aggregate approximation of flocking, off unless set_flocking_approximation is called
+        self.approximation: AggregateSettings | None = None
+        self._aggregate_neighborhood: AggregateNeighborhood = AggregateNeighborhood()
+        # group_id -> whether a whole cell of the group's level can ever be inside the group's cohere radius, see can_sum_cells
+        self._summable_groups: dict[int, bool] = {}
+        # Recorded by the last update_model call with ApproximationMode.MEASURE_ERROR
+        self.approximation_error: ApproximationError = ApproximationError()
+        # (school, number of its boids already added) of schools waiting to be added, see queue_school
+        self._spawn_queue: deque[Tuple[School, int]] = deque()
+        self.spawns_per_tick: int = 1000
+        # Random source for populating the world (see add_default_schools), seeded by set_seed so that runs can be replayed
+        self.seed: int | None = None
+        self.rng: random.Random = random.Random()
+        # Radius, k-nearest, segment and box queries over the entities, for gameplay
+        self.queries: SpatialQueries = SpatialQueries(self)
+        # Collision pass at the end of every update, off unless set_collisions is called
+        self.collisions: CollisionSystem | None = None
+
+    def set_lod(self, settings: LodSettings | None) -> None:
+        """
+        Turns simulation tiers on with the given thresholds, or off with None. See SimulationTier
+        """
+        self.lod = (
+            TierGrid(settings, self.grid_width, self.grid_height)
+            if settings is not None
+            else None
+        )
+
+    def set_seed(self, seed: int) -> None:
+        """
+        Reseeds the model's rng. Worlds populated from it afterwards are the same for the same seed
+        """
+        self.seed = seed
+        self.rng.seed(seed)
+
+    def set_collisions(self, enabled: bool) -> None:
+        """
+        Turns the collision pass on or off. Colliders, group masks and the contacts of the last update are on the model's CollisionSystem
+        """
+        self.collisions = (
+            CollisionSystem(self.queries, self.player) if enabled else None
+        )
+
+    def set_flocking_approximation(self, settings: AggregateSettings | None) -> None:
+        """
+        Turns the cell aggregate approximation of cohesion and alignment on with the given settings, or off with None. See ApproximationMode.\n
+        Only supported with GridMode.CELL_LISTS
+        """
+        if settings is not None and settings.mode == ApproximationMode.EXACT:
+            settings = None
+        if settings is not None and self.grid_mode != GridMode.CELL_LISTS:
+            raise ValueError("Cell aggregates are only kept with GridMode.CELL_LISTS")
+        self.approximation = settings
+        self._summable_groups.clear()
+        if settings is not None:
+            self.refresh_aggregates()
+
+    def refresh_aggregates(self) -> None:
+        for level in self.levels.values():
+            for cell in level.cells.values():
+                cell.refresh_aggregates()
+
+    def get_grid_cell(self, r: int, c: int) -> GridCell:
+        """
+        Returns the base grid cell at row r, column c, creating it if it doesn't exist yet
+        """
+        return self.base_level.get_cell(r, c)
+
+    def get_entity_level(self, entity: GameEntity) -> GridLevel:
+        """
+        Returns the grid level the entity's group lives in, picking one from the entity's interaction range if the group doesn't have one yet
+        """
+        level: GridLevel | None = self.group_levels.get(entity.group_id)
+        if level is None:
+            level = self.get_level_for_range(entity.interaction_range)
+            self.group_levels[entity.group_id] = level
+        return level
+
+    def get_level_for_range(self, interaction_range: int) -> GridLevel:
+        """
+        Returns the coarsest level needed so that interaction_range base cells are at most one cell of the level.
+        Levels have to divide the grid evenly and be at least 3 cells wide, so a coarser level than possible is never used
+        """
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            return self.base_level
+        scale: int = 1
+        while scale < interaction_range:
+            next_scale: int = scale * 2
+            if (
+                self.grid_width % next_scale != 0
+                or self.grid_height % next_scale != 0
+                or self.grid_width // next_scale < 3
+                or self.grid_height // next_scale < 3
+            ):
+                break
+            scale = next_scale
+        level: GridLevel | None = self.levels.get(scale)
+        if level is None:
+            level = GridLevel(
+                scale,
+                self.cell_size,
+                self.grid_width,
+                self.grid_height,
+                self.background_palette,
+            )
+            self.levels[scale] = level
+        return level
+
+    def get_cells_with_residents(
+        self,
+    ) -> list[Tuple[GridLevel, int, int, list[GameEntity]]]:
+        """
+        Returns (level, row, column, entities) of every grid cell that holds entities, with row and column in the cells of the level
+        """
+        cells: list[Tuple[GridLevel, int, int, list[GameEntity]]] = []
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            self.ensure_cell_index()
+            index: CellIndex = self.cell_index
+            entities: list[GameEntity] = self.entities
+            base_level: GridLevel = self.base_level
+            grid_width: int = self.grid_width
+            # Every occupied cell of the index is one slice of the sorted entity list
+            for key, start, count in zip(
+                index.cell_keys.tolist(),
+                index.cell_start.tolist(),
+                index.cell_count.tolist(),
+            ):
+                cells.append(
+                    (
+                        base_level,
+                        key // grid_width,
+                        key % grid_width,
+                        entities[start : start + count],
                     )
                 )
-        return grid_space
+            return cells
+        for level in self.levels.values():
+            for (row, col), cell in level.cells.items():
+                residents = cell.get_entities()
+                if residents:
+                    cells.append((level, row, col, residents))
+        return cells
 
     def update_model(
         self, dt: float, mouse_pos: Vector2, key_presses: ScancodeWrapper
     ) -> None:
-        # Apply forces to all entities
-        for row in range(self.grid_height):
-            for col in range(self.grid_width):
-                for entity in self.grid_space[row][col].entities:
+        for _, phase in self.get_update_phases(dt, mouse_pos, key_presses):
+            phase()
+
+    def get_update_phases(
+        self, dt: float, mouse_pos: Vector2, key_presses: ScancodeWrapper
+    ) -> list[Tuple[str, Callable[[], None]]]:
+        """
+        Returns the steps of one update_model call as (name, function) pairs, in the order they have to run. Running every function in order is exactly one update_model call, which lets callers time each phase on its own
+        """
+        return [
+            ("spawn", self.spawn_queued_entities),
+            ("index", self.ensure_cell_index),
+            ("forces", lambda: self.apply_forces(mouse_pos)),
+            # Moving must be done after all forces have been applied and entity velocities are updated for this frame
+            ("move", lambda: self.move_entities(dt)),
+            ("migrate", self.migrate_entities),
+            ("player", lambda: self.player.move_player(key_presses, dt)),
+            ("collide", self.detect_collisions),
+        ]
+
+    def detect_collisions(self) -> None:
+        """
+        Finds the contacts of the player's hitbox and other colliders with the entities, if collisions are on
+        """
+        if self.collisions is not None:
+            self.collisions.detect()
+
+    def apply_forces(self, mouse_pos: Vector2) -> None:
+        """
+        Applies forces to all entities
+        """
+        self.pairs_tested = 0
+        self.tick += 1
+        if self.approximation is not None:
+            self.approximation_error.reset()
+            self._aggregate_neighborhood.clear_columns()
+            if self.tick % self.approximation.refresh_interval == 0:
+                self.refresh_aggregates()
+        if self.lod is not None:
+            self.apply_forces_with_tiers(mouse_pos)
+            return
+        self.tier_counts = [self.entity_count, 0, 0]
+        if (
+            self.update_mode == UpdateMode.CELL_BLOCKED
+            or self.approximation is not None
+        ):
+            self.apply_forces_cell_blocked(mouse_pos)
+        else:
+            if self.grid_mode == GridMode.SORTED_INDEX:
+                self.ensure_cell_index()
+                for entity in self.entities:
                     self.apply_forces_to_entity(entity, mouse_pos)
-        # Move entities:
-        # This must be done after all forces have been applied and entity velocities are updated for this frame
-        update_cells: list[Tuple[int, int, GameEntity]] = []
-        for row in range(self.grid_height):
-            for col in range(self.grid_width):
-                for i in range(len(self.grid_space[row][col].entities) - 1, -1, -1):
-                    e = self.grid_space[row][col].entities[i]
+                return
+            for level in self.levels.values():
+                for cell in level.cells.values():
+                    for entity in cell.get_entities():
+                        self.apply_forces_to_entity(entity, mouse_pos)
+
+    def move_entities(self, dt: float) -> None:
+        """
+        Updates the position of all entities. Entities that end up in a different grid cell are only moved there by migrate_entities
+        """
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            for entity in self.entities:
+                entity.update_position(self.world_width, self.world_height, dt)
+            return
+        pending: list[Tuple[GridLevel, GridCell, int, int, GameEntity]] = (
+            self._pending_migrations
+        )
+        for level in self.levels.values():
+            cell_size: float = level.cell_size
+            for (row, col), cell in level.cells.items():
+                if self.approximation is not None:
+                    self.move_cell_entities_with_aggregates(level, row, col, cell, dt)
+                    continue
+                for e in cell.get_entities():
                     e.update_position(self.world_width, self.world_height, dt)
-                    # Check if we are in a new grid cell. If we are, move the entity to the other grid cell's list
-                    new_r = int(e.position.y / self.cell_size)
-                    new_c = int(e.position.x / self.cell_size)
+                    # Check if we are in a new grid cell. If we are, the entity has to move to the other grid cell
+                    new_r = int(e.position.y / cell_size)
+                    new_c = int(e.position.x / cell_size)
                     if new_r != row or new_c != col:
-                        del self.grid_space[row][col].entities[i]
-                        # Track which entities moved grid cells
-                        update_cells.append((new_r, new_c, e))
-        # Update grid cells with entities that moved into new cells:
+                        pending.append((level, cell, new_r, new_c, e))
+
+    def move_cell_entities_with_aggregates(
+        self, level: GridLevel, row: int, col: int, cell: GridCell, dt: float
+    ) -> None:
+        """
+        Same as one cell of move_entities, but also applies the change of every entity's position and velocity to the cell's aggregates.\n
+        Aggregates that can't be summed as a whole (fewer than AggregateSettings.min_count entities, or a group that can never have a whole cell in its cohere radius) are only marked stale, see GridCell.get_aggregate
+        """
+        cell_size: float = level.cell_size
+        min_count: int = self.approximation.min_count
+        for group_id, bucket in cell.groups.items():
+            aggregate: CellAggregate = cell.aggregates[group_id]
+            if (
+                aggregate.stale
+                or aggregate.count < min_count
+                or not self.can_sum_cells(group_id, level, bucket)
+            ):
+                aggregate.stale = True
+                for e in bucket:
+                    e.update_position(self.world_width, self.world_height, dt)
+                    new_r = int(e.position.y / cell_size)
+                    new_c = int(e.position.x / cell_size)
+                    if new_r != row or new_c != col:
+                        self._pending_migrations.append((level, cell, new_r, new_c, e))
+                continue
+            for e in bucket:
+                position: Vector2 = e.position
+                velocity: Vector2 = e.velocity
+                old_x: float = position.x
+                old_y: float = position.y
+                old_vx: float = velocity.x
+                old_vy: float = velocity.y
+                e.update_position(self.world_width, self.world_height, dt)
+                aggregate.shift(
+                    e.position.x - old_x,
+                    e.position.y - old_y,
+                    e.velocity.x - old_vx,
+                    e.velocity.y - old_vy,
+                )
+                new_r = int(e.position.y / cell_size)
+                new_c = int(e.position.x / cell_size)
+                if new_r != row or new_c != col:
+                    self._pending_migrations.append((level, cell, new_r, new_c, e))
+
+    def can_sum_cells(
+        self, group_id: int, level: GridLevel, bucket: dict[GameEntity, None]
+    ) -> bool:
+        """
+        Whether a whole cell of the level can ever be inside the cohere radius (widened by AggregateSettings.tolerance) of the group's entities.
+        The farthest point of a cell is at least half its diagonal away from any point in it, so groups with a smaller radius never use their aggregates
+        :param bucket: Entities of the group, to read the group's flocking parameters from
+        """
+        summable: bool | None = self._summable_groups.get(group_id)
+        if summable is None:
+            parameters: FlockingParameters | None = getattr(
+                next(iter(bucket)), "flocking_parameters", None
+            )
+            summable = parameters is not None and parameters.cohere_distance * (
+                1.0 + self.approximation.tolerance
+            ) > level.cell_size * math.sqrt(0.5)
+            self._summable_groups[group_id] = summable
+        return summable
+
+    def migrate_entities(self) -> None:
+        """
+        Moves entities that changed grid cells during move_entities into their new cells, and frees the cells they leave empty
+        """
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            # Nothing is moved between lists, the index is rebuilt once everything has moved
+            self.rebuild_cell_index()
+            self.cells_migrated = self.cell_index.moved_count
+            return
+        self.cells_migrated = len(self._pending_migrations)
         # This must be done after all entities have moved otherwise we run the risk of processing an entity's position update twice
-        for cell_entity in update_cells:
-            self.grid_space[cell_entity[0]][cell_entity[1]].entities.append(
-                cell_entity[2]
+        for level, old_cell, new_r, new_c, e in self._pending_migrations:
+            old_cell.remove_entity(e)
+            if old_cell.is_empty():
+                level.release_cell(old_cell)
+            level.get_cell(new_r, new_c).add_entity(e)
+        self._pending_migrations.clear()
+
+    def apply_forces_cell_blocked(self, mouse_pos: Vector2) -> None:
+        """
+        Applies forces cell by cell. The neighborhood of a cell is gathered once per group and interaction range used by its residents and shared by all of them
+        """
+        for level, row, col, residents in self.get_cells_with_residents():
+            self.apply_forces_to_residents(level, row, col, residents, mouse_pos)
+
+    def apply_forces_to_residents(
+        self,
+        level: GridLevel,
+        row: int,
+        col: int,
+        residents: list[GameEntity],
+        mouse_pos: Vector2,
+    ) -> None:
+        """
+        Applies forces to the entities of one cell of a level with shared neighborhoods, see UpdateMode.CELL_BLOCKED.
+        With the cell aggregate approximation, groups with at least AggregateSettings.min_count entities in the cell are approximated instead
+        """
+        home_cell: GridCell | None = (
+            level.cells.get((row, col)) if self.approximation is not None else None
+        )
+        # Residents by (group, interaction range), the residents of each key share one neighborhood
+        members_by_key: dict[Tuple[int, int], list[GameEntity]] = {}
+        for entity in residents:
+            key: Tuple[int, int] = (entity.group_id, entity.interaction_range)
+            members: list[GameEntity] | None = members_by_key.get(key)
+            if members is None:
+                members_by_key[key] = [entity]
+            else:
+                members.append(entity)
+        for (group_id, cell_range), members in members_by_key.items():
+            if (
+                home_cell is not None
+                and home_cell.aggregates[group_id].count >= self.approximation.min_count
+            ):
+                self.apply_forces_with_aggregates(
+                    level, row, col, members, group_id, cell_range, mouse_pos
+                )
+                continue
+            self.apply_forces_from_neighbors(
+                members,
+                self.get_group_neighborhood(
+                    row, col, level.get_range(cell_range), group_id, level
+                ),
+                mouse_pos,
+            )
+
+    def apply_forces_from_neighbors(
+        self,
+        members: list[GameEntity],
+        neighbors: list[GameEntity],
+        mouse_pos: Vector2,
+    ) -> None:
+        """
+        Applies forces to residents of one cell that share a group and an interaction range, from their shared list of neighbors
+        """
+        self.pairs_tested += len(neighbors) * len(members)
+        # Copying the neighborhood into a snapshot only pays off when several residents read it
+        if len(members) < SNAPSHOT_MIN_RESIDENTS:
+            for entity in members:
+                entity.apply_forces(neighbors, mouse_pos)
+            return
+        snapshot: NeighborhoodSnapshot = self._snapshot
+        snapshot.fill(neighbors)
+        for entity in members:
+            entity.apply_forces_from_snapshot(snapshot, mouse_pos)
+
+    def apply_forces_with_tiers(self, mouse_pos: Vector2) -> None:
+        """
+        Applies forces cell by cell according to each base grid cell's SimulationTier.
+        Mid range entities that skipped ticks get the forces of one tick multiplied by the number of ticks since they last got forces (at most mid_interval), so their flocking keeps the same strength over time
+        """
+        tier_grid: TierGrid = self.lod
+        tier_grid.update(self.get_camera_cells())
+        mid_interval: int = tier_grid.settings.mid_interval
+        far: int = SimulationTier.FAR.value
+        tier_counts: list[int] = [0, 0, 0]
+        cells: list[Tuple[GridLevel, int, int, list[GameEntity]]] = (
+            self.get_cells_with_residents()
+        )
+        # Tiers are only worked out for the occupied base grid cells, and for the base grid cell of every resident of a coarser level cell, all in one call
+        rows: list[int] = []
+        cols: list[int] = []
+        cell_size: float = self.cell_size
+        for level, row, col, residents in cells:
+            if level.scale == 1:
+                rows.append(row)
+                cols.append(col)
+            else:
+                for entity in residents:
+                    rows.append(int(entity.position.y / cell_size))
+                    cols.append(int(entity.position.x / cell_size))
+        tiers, flocking_cells = self.get_cell_tiers(rows, cols)
+        first: int = 0
+        for level, row, col, residents in cells:
+            if level.scale == 1:
+                groups: list[Tuple[int, bool, list[GameEntity]]] = [
+                    (tiers[first], flocking_cells[first], residents)
+                ]
+                first += 1
+            else:
+                last: int = first + len(residents)
+                groups = self.split_residents_by_tier(
+                    residents, tiers[first:last], flocking_cells[first:last]
+                )
+                first = last
+            for tier, flocks, members in groups:
+                tier_counts[tier] += len(members)
+                if tier == far:
+                    for entity in members:
+                        entity.apply_far_forces(mouse_pos)
+                        entity.ticks_since_forces = 0
+                    continue
+                if not flocks:
+                    for entity in members:
+                        entity.ticks_since_forces += 1
+                    continue
+                if (
+                    self.update_mode == UpdateMode.CELL_BLOCKED
+                    or self.approximation is not None
+                ):
+                    self.apply_forces_to_residents(level, row, col, members, mouse_pos)
+                else:
+                    for entity in members:
+                        self.apply_forces_to_entity(entity, mouse_pos)
+                for entity in members:
+                    ticks: int = entity.ticks_since_forces + 1
+                    entity.ticks_since_forces = 0
+                    if ticks > 1:
+                        entity.acceleration *= min(ticks, mid_interval)
+        self.tier_counts = tier_counts
+
+    def get_cell_tiers(
+        self, rows: list[int], cols: list[int]
+    ) -> Tuple[list[int], list[bool]]:
+        """
+        Returns the SimulationTier value of each of the given base grid cells and whether it flocks this tick
+        """
+        row_array: np.ndarray = np.array(rows, dtype=np.int64)
+        col_array: np.ndarray = np.array(cols, dtype=np.int64)
+        tiers: np.ndarray = self.lod.get_tiers(row_array, col_array)
+        return (
+            tiers.tolist(),
+            self.lod.get_flocking(row_array, col_array, tiers, self.tick).tolist(),
+        )
+
+    def split_residents_by_tier(
+        self, residents: list[GameEntity], tiers: list[int], flocking_cells: list[bool]
+    ) -> list[Tuple[int, bool, list[GameEntity]]]:
+        """
+        Splits the residents of a coarser level cell by the tier of the base grid cell each one is in, so the tiers don't depend on the grid level.\n
+        Returns (tier, whether the base cells flock this tick, entities) for every combination that has entities
+        :param tiers: SimulationTier value of the base grid cell of every resident
+        :param flocking_cells: Whether the base grid cell of every resident flocks this tick
+        """
+        groups: dict[Tuple[int, bool], list[GameEntity]] = {}
+        for entity, tier, flocks in zip(residents, tiers, flocking_cells):
+            key: Tuple[int, bool] = (tier, flocks)
+            members: list[GameEntity] | None = groups.get(key)
+            if members is None:
+                members = []
+                groups[key] = members
+            members.append(entity)
+        return [(tier, flocks, members) for (tier, flocks), members in groups.items()]
+
+    def get_occupied_cells(self) -> list[Tuple[int, int]]:
+        """
+        Returns (row, column) of every base grid cell that holds entities. With GridMode.CELL_LISTS groups in coarser grid levels aren't included
+        """
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            self.ensure_cell_index()
+            occupied: np.ndarray = self.cell_index.cell_keys
+            return list(
+                zip(
+                    (occupied // self.grid_width).tolist(),
+                    (occupied % self.grid_width).tolist(),
+                )
             )
-        # Move player
-        self.player.move_player(key_presses, dt)
+        return list(self.grid_cells)
+
+    def ensure_cell_index(self) -> None:
+        """
+        Rebuilds the cell index if entities were added since it was last built. Does nothing with GridMode.CELL_LISTS
+        """
+        if self.grid_mode == GridMode.SORTED_INDEX and self._index_dirty:
+            self.rebuild_cell_index()
+
+    def rebuild_cell_index(self) -> None:
+        """
+        Recomputes the cell of every entity and reorders the entity list by cell
+        """
+        n: int = len(self.entities)
+        ys: np.ndarray = np.fromiter(
+            (e.position.y for e in self.entities), dtype=np.float64, count=n
+        )
+        xs: np.ndarray = np.fromiter(
+            (e.position.x for e in self.entities), dtype=np.float64, count=n
+        )
+        slots: np.ndarray = np.fromiter(
+            (self.group_slots[e.group_id] for e in self.entities),
+            dtype=np.int64,
+            count=n,
+        )
+        order: np.ndarray = self.cell_index.rebuild(
+            (ys / self.cell_size).astype(np.int64),
+            (xs / self.cell_size).astype(np.int64),
+            slots,
+            max(len(self.group_slots), 1),
+        )
+        entities: list[GameEntity] = self.entities
+        self.entities = [entities[i] for i in order.tolist()]
+        self._index_dirty = False
 
     def apply_forces_to_entity(self, entity: GameEntity, mouse_pos: Vector2) -> None:
         """
-        Finds this entity's relevant neighbors and applies forces using only the list of relevant neighbors
+        Finds this entity's relevant neighbors and applies forces using only the list of relevant neighbors.\n
+        Relevant neighbors are the entities of the same group in the 'interaction_range' grid squares surrounding the entity's grid square
+        """
+        level: GridLevel = self.get_entity_level(entity)
+        if self.approximation is not None:
+            # Entities may have moved since the last apply_forces
+            self._aggregate_neighborhood.clear_columns()
+            self.apply_forces_to_residents(
+                level,
+                int(entity.position.y / level.cell_size),
+                int(entity.position.x / level.cell_size),
+                [entity],
+                mouse_pos,
+            )
+            return
+        neighbors: list[GameEntity] = self.get_group_neighborhood(
+            int(entity.position.y / level.cell_size),
+            int(entity.position.x / level.cell_size),
+            level.get_range(entity.interaction_range),
+            entity.group_id,
+            level,
+        )
+        self.pairs_tested += len(neighbors)
+        entity.apply_forces(neighbors, mouse_pos)
+
+    def apply_forces_with_aggregates(
+        self,
+        level: GridLevel,
+        row: int,
+        col: int,
+        residents: list[GameEntity],
+        group_id: int,
+        cell_range: int,
+        mouse_pos: Vector2,
+    ) -> None:
+        """
+        Applies forces to residents of the cell at row, column of the level that are all in the given group and have the given interaction range, from the cells of their group neighborhood. See ApproximationMode.\n
+        Neighborhoods where no cell can be summed as a whole fall back to apply_forces_from_neighbors.
+        With ApproximationMode.MEASURE_ERROR the exact forces are computed first and compared to the approximation, which is the one that is applied
+        """
+        neighborhood: AggregateNeighborhood = self._aggregate_neighborhood
+        neighborhood.fill(
+            self.get_group_neighborhood_cells(
+                row, col, level.get_range(cell_range), group_id, level
+            ),
+            level.cells[(row, col)],
+            group_id,
+            self.approximation,
+        )
+        parameters: FlockingParameters | None = getattr(
+            residents[0], "flocking_parameters", None
+        )
+        if parameters is None or not neighborhood.has_whole_cells(
+            parameters.cohere_distance, parameters.avoid_distance
+        ):
+            self.apply_forces_from_neighbors(
+                residents, neighborhood.get_entities(), mouse_pos
+            )
+            return
+        measure: bool = self.approximation.mode == ApproximationMode.MEASURE_ERROR
+        exact_neighbors: list[GameEntity] = (
+            neighborhood.get_entities() if measure else []
+        )
+        for entity in residents:
+            if measure:
+                before: Vector2 = Vector2(entity.acceleration)
+                entity.apply_forces(exact_neighbors, mouse_pos)
+                exact: Vector2 = entity.acceleration - before
+                entity.acceleration.update(before)
+            entity.apply_forces_from_aggregates(neighborhood, mouse_pos)
+            if measure:
+                self.approximation_error.add(entity.acceleration - before, exact)
+        self.pairs_tested += neighborhood.pairs_tested
+        neighborhood.pairs_tested = 0
+
+    def get_group_neighborhood_cells(
+        self, r: int, c: int, cell_range: int, group_id: int, level: GridLevel
+    ) -> list[Tuple[int, int, bool, GridCell]]:
+        """
+        Returns (row offset, column offset, whether the cell is across a world edge, cell) of the cells in the 'cell_range' grid squares of the level surrounding row r, column c that hold entities of the given group.
+        The grid wraps around at the edges
+        """
+        cells: list[Tuple[int, int, bool, GridCell]] = []
+        grid_cells: dict[Tuple[int, int], GridCell] = level.cells
+        grid_width: int = level.grid_width
+        grid_height: int = level.grid_height
+        for dr in range(-cell_range, cell_range + 1):
+            wrapped_r: bool = not 0 <= r + dr < grid_height
+            grid_r: int = (r + dr + grid_height) % grid_height
+            for dc in range(-cell_range, cell_range + 1):
+                cell: GridCell | None = grid_cells.get(
+                    (grid_r, (c + dc + grid_width) % grid_width)
+                )
+                if cell is not None and cell.get_group_entities(group_id):
+                    cells.append(
+                        (dr, dc, wrapped_r or not 0 <= c + dc < grid_width, cell)
+                    )
+        return cells
+
+    def get_cell_entities(self, r: int, c: int) -> list[GameEntity]:
+        """
+        Returns the entities of every group in the base grid square at row r, column c
+        """
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            self.ensure_cell_index()
+            start, stop = self.cell_index.get_row_span(r, c, c)
+            return self.entities[start:stop]
+        entities: list[GameEntity] = []
+        for level in self.levels.values():
+            cell: GridCell | None = level.cells.get(
+                (r // level.scale, c // level.scale)
+            )
+            if cell is None:
+                continue
+            if level.scale == 1:
+                entities.extend(cell.get_entities())
+                continue
+            # A coarser cell covers several base cells
+            for entity in cell.get_entities():
+                if (
+                    int(entity.position.y / self.cell_size) == r
+                    and int(entity.position.x / self.cell_size) == c
+                ):
+                    entities.append(entity)
+        return entities
+
+    def get_neighborhood(self, r: int, c: int, cell_range: int) -> list[GameEntity]:
+        """
+        Returns the entities of every group in the 'cell_range' grid squares surrounding the base grid square at row r, column c. The grid wraps around at the edges.\n
+        This is the cross-group query, for interactions between different groups (predators, collisions with the player).
+        Entities in coarser grid levels are returned if their level cell overlaps the area, so some can be a little further away
+        """
+        neighbors: list[GameEntity] = []
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            self.ensure_cell_index()
+            for start, stop in self.cell_index.get_neighborhood_spans(r, c, cell_range):
+                neighbors += self.entities[start:stop]
+            return neighbors
+        for level in self.levels.values():
+            cells: dict[Tuple[int, int], GridCell] = level.cells
+            columns: range = level.get_covering_span(
+                c - cell_range, c + cell_range, level.grid_width
+            )
+            for level_r in level.get_covering_span(
+                r - cell_range, r + cell_range, level.grid_height
+            ):
+                grid_r: int = level_r % level.grid_height
+                for level_c in columns:
+                    cell: GridCell | None = cells.get(
+                        (grid_r, level_c % level.grid_width)
+                    )
+                    if cell is not None:
+                        neighbors.extend(cell.get_entities())
+        return neighbors
+
+    def get_group_neighborhood(
+        self,
+        r: int,
+        c: int,
+        cell_range: int,
+        group_id: int,
+        level: GridLevel | None = None,
+    ) -> list[GameEntity]:
+        """
+        Same as get_neighborhood, but only returns entities in the given group. Foreign groups are skipped per cell bucket instead of per entity
+        :param level: Grid level that the group lives in, with r, c and cell_range in cells of that level. Defaults to the base grid. Ignored with GridMode.SORTED_INDEX
         """
-        # Relevant neighbors are any entities in the 'cell_range' grid squares surrounding the current entity's grid square
-        cell_range: int = entity.interaction_range
         neighbors: list[GameEntity] = []
-        r: int = int(entity.position.y / self.cell_size)
-        c: int = int(entity.position.x / self.cell_size)
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            self.ensure_cell_index()
+            slot: int | None = self.group_slots.get(group_id)
+            if slot is None:
+                return neighbors
+            for start, stop in self.cell_index.get_bucket_neighborhood_spans(
+                r, c, cell_range, slot
+            ):
+                neighbors += self.entities[start:stop]
+            return neighbors
+        if level is None:
+            level = self.base_level
+        grid_cells: dict[Tuple[int, int], GridCell] = level.cells
+        grid_width: int = level.grid_width
+        grid_height: int = level.grid_height
         for dr in range(-cell_range, cell_range + 1):
+            grid_r: int = (r + dr + grid_height) % grid_height
             for dc in range(-cell_range, cell_range + 1):
-                grid_r: int = r + dr
-                grid_r = (grid_r + self.grid_height) % self.grid_height
-                grid_c: int = c + dc
-                grid_c = (grid_c + self.grid_width) % self.grid_width
-                neighbors.extend(self.grid_space[grid_r][grid_c].entities)
-        entity.apply_forces(neighbors, mouse_pos)
+                cell: GridCell | None = grid_cells.get(
+                    (grid_r, (c + dc + grid_width) % grid_width)
+                )
+                if cell is not None:
+                    neighbors.extend(cell.get_group_entities(group_id))
+        return neighbors
 
     def add_game_entity(self, entity: GameEntity) -> None:
-        self.grid_space[int(entity.position.y / self.cell_size)][
-            int(entity.position.x / self.cell_size)
-        ].entities.append(entity)
+        self.group_slots.setdefault(entity.group_id, len(self.group_slots))
+        self.entity_count += 1
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            self.entities.append(entity)
+            self._index_dirty = True
+            return
+        level: GridLevel = self.get_entity_level(entity)
+        level.get_cell(
+            int(entity.position.y / level.cell_size),
+            int(entity.position.x / level.cell_size),
+        ).add_entity(entity)
+
+    def add_game_entities(self, entities: list[GameEntity]) -> None:
+        """
+        Adds a batch of entities. Same as calling add_game_entity for each of them, but the grid cells of the whole batch are worked out at once and every cell is filled in one go
+        """
+        self.entity_count += len(entities)
+        groups: dict[int, list[GameEntity]] = {}
+        for entity in entities:
+            group: list[GameEntity] | None = groups.get(entity.group_id)
+            if group is None:
+                groups[entity.group_id] = [entity]
+                self.group_slots.setdefault(entity.group_id, len(self.group_slots))
+            else:
+                group.append(entity)
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            self.entities.extend(entities)
+            self._index_dirty = True
+            return
+        for group_id, group in groups.items():
+            level: GridLevel = self.get_entity_level(group[0])
+            count: int = len(group)
+            rows: np.ndarray = (
+                np.fromiter((e.position.y for e in group), np.float64, count)
+                / level.cell_size
+            ).astype(np.int64)
+            cols: np.ndarray = (
+                np.fromiter((e.position.x for e in group), np.float64, count)
+                / level.cell_size
+            ).astype(np.int64)
+            # Sort the group by cell, then hand every cell its slice
+            keys: np.ndarray = rows * level.grid_width + cols
+            order: np.ndarray = np.argsort(keys, kind="stable")
+            sorted_keys: np.ndarray = keys[order]
+            starts: np.ndarray = np.flatnonzero(
+                np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+            )
+            ordered: list[GameEntity] = [group[i] for i in order.tolist()]
+            stops: list[int] = starts[1:].tolist() + [count]
+            for start, stop in zip(starts.tolist(), stops):
+                first: int = order[start]
+                level.get_cell(int(rows[first]), int(cols[first])).add_group_entities(
+                    group_id, ordered[start:stop]
+                )
+
+    def queue_school(self, school: School) -> None:
+        """
+        Adds the boids of a school over the next model updates, at most spawns_per_tick of them per update, so that spawning a large wave doesn't stall a frame
+        """
+        self._spawn_queue.append((school, 0))
+
+    def spawn_queued_entities(self) -> None:
+        """
+        Builds and adds up to spawns_per_tick boids from the queued schools
+        """
+        budget: int = self.spawns_per_tick
+        while self._spawn_queue and budget > 0:
+            school, start = self._spawn_queue[0]
+            stop: int = min(start + budget, len(school))
+            self.add_game_entities(school.create_boids(start, stop))
+            budget -= stop - start
+            if stop == len(school):
+                self._spawn_queue.popleft()
+            else:
+                self._spawn_queue[0] = (school, stop)
+
+    def get_all_entities(self) -> list[GameEntity]:
+        """
+        Returns every entity in the model
+        """
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            return self.entities[:]
+        entities: list[GameEntity] = []
+        for level in self.levels.values():
+            for cell in level.cells.values():
+                entities.extend(cell.get_entities())
+        return entities
+
+    def get_entity_state(self) -> np.ndarray:
+        """
+        Returns an (entity count, 4) array of the position x, y and velocity x, y of every entity, in no particular order
+        """
+        return np.array(
+            [
+                (e.position.x, e.position.y, e.velocity.x, e.velocity.y)
+                for e in self.get_all_entities()
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 4)
+
+    def get_query_source(
+        self,
+    ) -> Tuple[np.ndarray, np.ndarray, Callable[[np.ndarray], list[GameEntity]]]:
+        """
+        Returns the position (n, 2) and group slot (n,) of every entity, and a function that returns the entities of given rows of them. SpatialQueries builds its index from these.\n
+        Group slots are taken per cell bucket instead of per entity
+        """
+        entities: list[GameEntity]
+        slots: np.ndarray
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            self.ensure_cell_index()
+            entities = self.entities
+            # Entities are sorted by bucket, and bucket key k belongs to group slot k % buckets_per_cell
+            index: CellIndex = self.cell_index
+            slots = np.repeat(
+                index.bucket_keys % index.buckets_per_cell, index.bucket_count
+            )
+        else:
+            entities = []
+            bucket_slots: list[int] = []
+            bucket_sizes: list[int] = []
+            for level in self.levels.values():
+                for cell in level.cells.values():
+                    for group_id, bucket in cell.groups.items():
+                        entities.extend(bucket)
+                        bucket_slots.append(self.group_slots[group_id])
+                        bucket_sizes.append(len(bucket))
+            slots = np.repeat(np.array(bucket_slots, dtype=np.int64), bucket_sizes)
+        n: int = len(entities)
+        positions: np.ndarray = np.fromiter(
+            itertools.chain.from_iterable(e.position for e in entities),
+            dtype=np.float64,
+            count=2 * n,
+        ).reshape(n, 2)
+        return (
+            positions,
+            slots,
+            lambda rows: [entities[i] for i in rows.tolist()],
+        )
 
     def get_grid_cells_in_range(
         self, x_range: Tuple[float, float], y_range: Tuple[float, float]
     ) -> list[GridCell]:
+        """
+        Returns the base grid cells within the x, y range specified, for drawing their backgrounds. Cells without entities are returned as temporary cells that the model doesn't keep
+        """
         left: int = int(x_range[0] / self.cell_size)
         right: int = int(x_range[1] / self.cell_size)
         bottom: int = int(y_range[0] / self.cell_size)
@@ -112,11 +993,16 @@ class SpatialPartitioningModel:
         cells: list[GridCell] = []
         for r in range(bottom, top + 1):
             for c in range(left, right + 1):
-                cells.append(self.grid_space[r][c])
+                cells.append(self.base_level.peek_cell(r, c))
         return cells
 
-    def get_grid_cells_in_camera_range(self) -> list[GridCell]:
-        return self.get_grid_cells_in_range(
+    def get_camera_range(
+        self,
+    ) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        """
+        Returns the x and y range of the world that the player's camera sees
+        """
+        return (
             (
                 self.player.position.x - self.player.camera_w_adjust,
                 self.player.position.x + self.player.camera_w_adjust,
@@ -127,6 +1013,21 @@ class SpatialPartitioningModel:
             ),
         )
 
+    def get_camera_cells(self) -> Tuple[int, int, int, int]:
+        """
+        Returns (bottom row, top row, left column, right column) of the grid cells in camera range, the cells get_grid_cells_in_camera_range returns
+        """
+        x_range, y_range = self.get_camera_range()
+        return (
+            int(y_range[0] / self.cell_size),
+            int(y_range[1] / self.cell_size),
+            int(x_range[0] / self.cell_size),
+            int(x_range[1] / self.cell_size),
+        )
+
+    def get_grid_cells_in_camera_range(self) -> list[GridCell]:
+        return self.get_grid_cells_in_range(*self.get_camera_range())
+
     def get_entities_in_range(
         self, x_range: Tuple[float, float], y_range: Tuple[float, float]
     ) -> list[GameEntity]:
@@ -138,19 +1039,19 @@ class SpatialPartitioningModel:
         bottom: int = int(y_range[0] / self.cell_size)
         top: int = int(y_range[1] / self.cell_size)
         entities: list[GameEntity] = []
-        for r in range(bottom, top + 1):
-            for c in range(left, right + 1):
-                entities.extend(self.grid_space[r][c].entities)
+        if self.grid_mode == GridMode.SORTED_INDEX:
+            self.ensure_cell_index()
+            for r in range(bottom, top + 1):
+                start, stop = self.cell_index.get_row_span(r, left, right)
+                entities += self.entities[start:stop]
+            return entities
+        for level in self.levels.values():
+            for r in range(bottom // level.scale, top // level.scale + 1):
+                for c in range(left // level.scale, right // level.scale + 1):
+                    cell: GridCell | None = level.cells.get((r, c))
+                    if cell is not None:
+                        entities.extend(cell.get_entities())
         return entities
 
     def get_entities_in_camera_range(self):
-        return self.get_entities_in_range(
-            (
-                self.player.position.x - self.player.camera_w_adjust,
-                self.player.position.x + self.player.camera_w_adjust,
-            ),
-            (
-                self.player.position.y - self.player.camera_h_adjust,
-                self.player.position.y + self.player.camera_h_adjust,
-            ),
-        )
+        return self.get_entities_in_range(*self.get_camera_range())
@@ -0,0 +1,355 @@
+import math
+from typing import TYPE_CHECKING, Callable, Iterable, Tuple
+
+import numpy as np
+
+from model.entities.gameentity import GameEntity
+from model.utils.query_kernels import (
+    query_aabb_kernel,
+    query_nearest_kernel,
+    query_radius_kernel,
+    query_segment_kernel,
+)
+
+if TYPE_CHECKING:
+    from model.world.spatial_partitioning_model import SpatialPartitioningModel
+
+
+class QueryResult:
+    """
+    Hits of a batch of queries in compressed rows: the hits of query q are rows[offsets[q]:offsets[q + 1]], with one value per hit (see the query for what it means).
+    Rows are rows of the query index, see SpatialQueries.get_entities and SpatialQueries.positions.\n
+    The buffers only grow, so once a result has held the largest batch of a game, querying into it again doesn't allocate
+    """
+
+    def __init__(self, query_capacity: int = 64, hit_capacity: int = 1024) -> None:
+        self.offsets: np.ndarray = np.zeros(query_capacity + 1, dtype=np.int64)
+        self.hits: np.ndarray = np.zeros(hit_capacity, dtype=np.int64)
+        self.hit_values: np.ndarray = np.zeros(hit_capacity, dtype=np.float64)
+        self.query_count: int = 0
+        self.hit_count: int = 0
+
+    def reserve(self, query_count: int, hit_count: int) -> None:
+        """
+        Grows the buffers to hold at least the given number of queries and hits, doubling so that repeated growth is amortized
+        """
+        if query_count + 1 > len(self.offsets):
+            self.offsets = np.zeros(
+                max(query_count + 1, 2 * len(self.offsets)), dtype=np.int64
+            )
+        if hit_count > len(self.hits):
+            capacity: int = max(hit_count, 2 * len(self.hits))
+            self.hits = np.zeros(capacity, dtype=np.int64)
+            self.hit_values = np.zeros(capacity, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return self.query_count
+
+    @property
+    def rows(self) -> np.ndarray:
+        """
+        Hits of every query, one after the other
+        """
+        return self.hits[: self.hit_count]
+
+    @property
+    def values(self) -> np.ndarray:
+        return self.hit_values[: self.hit_count]
+
+    def get_rows(self, query: int) -> np.ndarray:
+        return self.hits[self.offsets[query] : self.offsets[query + 1]]
+
+    def get_values(self, query: int) -> np.ndarray:
+        return self.hit_values[self.offsets[query] : self.offsets[query + 1]]
+
+    def get_counts(self) -> np.ndarray:
+        """
+        Returns the number of hits of every query
+        """
+        return np.diff(self.offsets[: self.query_count + 1])
+
+
+class NearestResult:
+    """
+    Hits of a batch of k-nearest queries: rows[q] are the index rows of the k entities nearest to center q sorted by distance, and distances[q] their distances.
+    Queries that found fewer than k entities are padded with -1 and inf.\n
+    Like QueryResult, the buffers only grow and are reused
+    """
+
+    def __init__(self, query_capacity: int = 64, k: int = 1) -> None:
+        self.hits: np.ndarray = np.zeros((query_capacity, k), dtype=np.int64)
+        self.hit_distances: np.ndarray = np.zeros((query_capacity, k), dtype=np.float64)
+        self.query_count: int = 0
+        self.k: int = k
+
+    def reserve(self, query_count: int, k: int) -> None:
+        capacity, buffer_k = self.hits.shape
+        if query_count > capacity or k > buffer_k:
+            shape: Tuple[int, int] = (max(query_count, 2 * capacity), max(k, buffer_k))
+            self.hits = np.zeros(shape, dtype=np.int64)
+            self.hit_distances = np.zeros(shape, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return self.query_count
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self.hits[: self.query_count, : self.k]
+
+    @property
+    def distances(self) -> np.ndarray:
+        return self.hit_distances[: self.query_count, : self.k]
+
+
+class SpatialQueries:
+    """
+    Exact spatial queries over the entities of a model: radius, k-nearest, segment sweeps and boxes, each filtered by group and answered for a whole batch of queries in one call.\n
+    Queries run against a query index: the position and group of every entity sorted by grid cell key (row * grid_width + column), so the entities of a run of cells in a grid row are one slice found by binary search.
+    The index only has entries for entities, so like the sparse grid its size follows the entity count and not the size of the world.
+    Its cells are the model's grid cells unless set_cell_size picks smaller ones, which cuts the candidates small queries test in crowded areas but costs a sort when the index is built
+    It is rebuilt from the model (see SpatialPartitioningModel.get_query_source) when the model has updated or added entities since the last query. Entities are where they were after the last model update\n
+    Results are written into QueryResult and NearestResult buffers. Every query has a buffer of its own that is reused by the next call, or callers can pass their own to keep results around.
+    Group masks are boolean arrays by group slot (see get_group_mask), build them once and reuse them.\n
+    Cells are not wrapped around the world edges, entities across an edge are far away in world coordinates
+    """
+
+    def __init__(self, model: "SpatialPartitioningModel") -> None:
+        self.model: "SpatialPartitioningModel" = model
+        self.cell_size: float = model.cell_size
+        self.grid_width: int = model.grid_width
+        self.grid_height: int = model.grid_height
+        # Index, sorted by cell key
+        self.keys: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.positions: np.ndarray = np.zeros((0, 2), dtype=np.float64)
+        self.slots: np.ndarray = np.zeros(0, dtype=np.int64)
+        # Index row -> row of the model's query source
+        self.order: np.ndarray = np.zeros(0, dtype=np.int64)
+        self._get_source_entities: Callable[[np.ndarray], list[GameEntity]] = (
+            lambda rows: []
+        )
+        # (tick, entity count) of the model when the index was built
+        self._built_at: Tuple[int, int] | None = None
+        self._all_groups: np.ndarray = np.ones(0, dtype=bool)
+        self._radius_result: QueryResult = QueryResult()
+        self._segment_result: QueryResult = QueryResult()
+        self._aabb_result: QueryResult = QueryResult()
+        self._nearest_result: NearestResult = NearestResult()
+
+    def set_cell_size(self, cell_size: float) -> None:
+        """
+        Sets the size of the cells of the query index, independent of the model's grid
+        """
+        self.cell_size = cell_size
+        self.grid_width = math.ceil(self.model.world_width / cell_size)
+        self.grid_height = math.ceil(self.model.world_height / cell_size)
+        self._built_at = None
+
+    def refresh(self) -> None:
+        """
+        Rebuilds the index if the model changed since it was built
+        """
+        state: Tuple[int, int] = (self.model.tick, self.model.entity_count)
+        if state != self._built_at:
+            self.rebuild()
+            self._built_at = state
+
+    def rebuild(self) -> None:
+        model: "SpatialPartitioningModel" = self.model
+        positions, slots, get_entities = model.get_query_source()
+        rows: np.ndarray = np.clip(
+            (positions[:, 1] / self.cell_size).astype(np.int64),
+            0,
+            self.grid_height - 1,
+        )
+        cols: np.ndarray = np.clip(
+            (positions[:, 0] / self.cell_size).astype(np.int64),
+            0,
+            self.grid_width - 1,
+        )
+        keys: np.ndarray = rows * self.grid_width + cols
+        if len(keys) > 1 and np.any(keys[1:] < keys[:-1]):
+            # NumPy's stable sort is a linear time radix sort for 16 bit keys, see CellIndex
+            self.order = np.argsort(
+                (
+                    keys.astype(np.uint16)
+                    if self.grid_width * self.grid_height <= 1 << 16
+                    else keys
+                ),
+                kind="stable",
+            )
+            self.keys = keys[self.order]
+            self.positions = positions[self.order]
+            self.slots = slots[self.order]
+        else:
+            # The array backends already keep their rows sorted by cell
+            self.order = np.arange(len(keys))
+            self.keys = keys
+            self.positions = np.ascontiguousarray(positions, dtype=np.float64)
+            self.slots = slots
+        self._get_source_entities = get_entities
+        if len(self._all_groups) != len(model.group_slots):
+            self._all_groups = np.ones(len(model.group_slots), dtype=bool)
+
+    def get_group_mask(self, group_ids: Iterable[int]) -> np.ndarray:
+        """
+        Returns the mask that limits queries to the given groups. Groups the model doesn't know yet are ignored
+        """
+        mask: np.ndarray = np.zeros(len(self.model.group_slots), dtype=bool)
+        for group_id in group_ids:
+            slot: int | None = self.model.group_slots.get(group_id)
+            if slot is not None:
+                mask[slot] = True
+        return mask
+
+    def get_entities(self, rows: np.ndarray) -> list[GameEntity]:
+        """
+        Returns the GameEntity of every given index row. With the array backends their position and velocity are synced from the arrays first
+        """
+        return self._get_source_entities(self.order[rows])
+
+    def query_radius(
+        self,
+        centers: np.ndarray,
+        radius: float | np.ndarray,
+        group_mask: np.ndarray | None = None,
+        out: QueryResult | None = None,
+    ) -> QueryResult:
+        """
+        Finds the entities at most radius from each center. Hit values are distances
+        :param centers: (query count, 2) array of points, or a single point
+        :param radius: One radius for all queries or one per query. Must be finite
+        """
+        centers = as_points(centers)
+        return self._run_batch(
+            query_radius_kernel,
+            out if out is not None else self._radius_result,
+            group_mask,
+            centers,
+            as_values(radius, len(centers)),
+        )
+
+    def query_aabb(
+        self,
+        mins: np.ndarray,
+        maxs: np.ndarray,
+        group_mask: np.ndarray | None = None,
+        out: QueryResult | None = None,
+    ) -> QueryResult:
+        """
+        Finds the entities inside each axis aligned box, edges included. Hit values are 0
+        :param mins: (query count, 2) array of the smallest x, y of every box, or a single point
+        :param maxs: (query count, 2) array of the largest x, y of every box, or a single point
+        """
+        return self._run_batch(
+            query_aabb_kernel,
+            out if out is not None else self._aabb_result,
+            group_mask,
+            as_points(mins),
+            as_points(maxs),
+        )
+
+    def query_segment(
+        self,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        radius: float | np.ndarray = 0.0,
+        group_mask: np.ndarray | None = None,
+        out: QueryResult | None = None,
+    ) -> QueryResult:
+        """
+        Sweeps a circle of the given radius along each segment and finds the entities it touches, for rays and moving projectiles.
+        Hit values are how far along the segment each hit is, from 0 to 1, and the hits of each query are sorted by it, so the first hit is what the sweep reaches first
+        :param starts: (query count, 2) array of segment starts, or a single point
+        :param ends: (query count, 2) array of segment ends, or a single point
+        :param radius: One radius for all queries or one per query
+        """
+        starts = as_points(starts)
+        return self._run_batch(
+            query_segment_kernel,
+            out if out is not None else self._segment_result,
+            group_mask,
+            starts,
+            as_points(ends),
+            as_values(radius, len(starts)),
+        )
+
+    def query_nearest(
+        self,
+        centers: np.ndarray,
+        k: int = 1,
+        max_distance: float | np.ndarray = math.inf,
+        group_mask: np.ndarray | None = None,
+        out: NearestResult | None = None,
+    ) -> NearestResult:
+        """
+        Finds the k entities nearest to each center that are at most max_distance away
+        :param centers: (query count, 2) array of points, or a single point
+        :param max_distance: One limit for all queries or one per query
+        """
+        self.refresh()
+        centers = as_points(centers)
+        result: NearestResult = out if out is not None else self._nearest_result
+        result.reserve(len(centers), k)
+        result.query_count = len(centers)
+        result.k = k
+        query_nearest_kernel(
+            *self._get_index_arguments(group_mask),
+            centers,
+            as_values(max_distance, len(centers)),
+            result.hits[: len(centers), :k],
+            result.hit_distances[: len(centers), :k],
+        )
+        return result
+
+    def _get_index_arguments(self, group_mask: np.ndarray | None) -> tuple:
+        return (
+            self.keys,
+            self.positions,
+            self.slots,
+            group_mask if group_mask is not None else self._all_groups,
+            self.grid_width,
+            self.grid_height,
+            self.cell_size,
+        )
+
+    def _run_batch(
+        self,
+        kernel: Callable[..., int],
+        result: QueryResult,
+        group_mask: np.ndarray | None,
+        *queries: np.ndarray,
+    ) -> QueryResult:
+        """
+        Runs one of the variable length kernels, growing the result's buffers and running it again if the hits didn't fit
+        """
+        self.refresh()
+        query_count: int = len(queries[0])
+        result.reserve(query_count, 0)
+        while True:
+            total: int = kernel(
+                *self._get_index_arguments(group_mask),
+                *queries,
+                result.offsets,
+                result.hits,
+                result.hit_values,
+            )
+            if total <= len(result.hits):
+                break
+            result.reserve(query_count, total)
+        result.query_count = query_count
+        result.hit_count = total
+        return result
+
+
+def as_points(points: np.ndarray | Iterable[float]) -> np.ndarray:
+    """
+    Returns the points as a contiguous (n, 2) float array, without copying them if they already are one
+    """
+    return np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def as_values(values: float | np.ndarray, count: int) -> np.ndarray:
+    """
+    Returns one value per query from a single value or an array of them
+    """
+    return np.broadcast_to(np.asarray(values, dtype=np.float64), (count,))
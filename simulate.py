@@ -0,0 +1,73 @@
+import argparse
+
+from controller.controller import ControllerOptions, ModelBackend
+from controller.headless import HeadlessSimulation
+from controller.replay import Recording
+from model.world.schools import add_default_schools
+
+world_width = 6400.0
+world_height = 6400.0
+cell_size = 128.0
+background_color = (0, 0, 0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs the simulation from main.py without a display, as fast as possible"
+    )
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--dt", type=float, default=1 / 60)
+    parser.add_argument(
+        "--backend",
+        choices=[backend.name.lower() for backend in ModelBackend],
+        default=ModelBackend.OBJECT.name.lower(),
+    )
+    parser.add_argument(
+        "--snapshot",
+        default=None,
+        help="Start from a world snapshot instead of the default schools",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--replay",
+        default=None,
+        help="Run the frames of a recording (see main.py --record) instead of --frames frames without input, and check that every frame matches",
+    )
+    args = parser.parse_args()
+
+    recording: Recording | None = (
+        Recording(args.replay) if args.replay is not None else None
+    )
+
+    simulation = HeadlessSimulation(
+        ControllerOptions(
+            world_width,
+            world_height,
+            cell_size,
+            background_color,
+            ModelBackend[args.backend.upper()],
+            snapshot_path=args.snapshot,
+            seed=recording.seed if recording is not None else args.seed,
+        ),
+        args.dt,
+    )
+    if args.snapshot is None:
+        add_default_schools(simulation.model, placeholder_surfaces=True)
+    frames: int = len(recording) if recording is not None else args.frames
+    elapsed: float = (
+        simulation.replay(recording)
+        if recording is not None
+        else simulation.run(args.frames)
+    )
+    print(
+        "Simulated",
+        frames,
+        "frames of",
+        simulation.model.entity_count,
+        "entities in",
+        round(elapsed, 3),
+        "s:",
+        round(elapsed / frames * 1000, 3),
+        "ms per frame",
+    )
+    if recording is not None:
+        print(recording.get_report())
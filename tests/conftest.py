@@ -0,0 +1,150 @@
+import os
+from typing import Iterator
+
+# Entities are created with placeholder surfaces, nothing needs a real display
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pytest
+from pygame import Vector2
+
+from controller.controller import ControllerOptions, ModelBackend
+from controller.headless import HeadlessSimulation, ScriptedKeys
+from model.entities.gameentity import GameEntity
+from model.world.array_model import KernelBackend
+from model.world.parallel_model import ParallelArraySpatialPartitioningModel
+from model.world.schools import add_default_schools
+from model.world.spatial_partitioning_model import (
+    GridMode,
+    SpatialPartitioningModel,
+    UpdateMode,
+)
+
+# Not a multiple of the cell size, so the last grid row and column reach past the world edge
+WORLD_WIDTH: float = 1000.0
+WORLD_HEIGHT: float = 700.0
+CELL_SIZE: float = 128.0
+SEED: int = 7
+DT: float = 1 / 60
+# Frames the model fixture has run
+WARM_UP_FRAMES: int = 5
+
+# Backend name -> ControllerOptions keyword arguments. "array" runs the compiled kernels when numba is installed
+BACKENDS: dict[str, dict] = {
+    "cell-lists": {},
+    "sorted-index": {"grid_mode": GridMode.SORTED_INDEX},
+    "cell-blocked": {"update_mode": UpdateMode.CELL_BLOCKED},
+    "array": {"model_backend": ModelBackend.ARRAY},
+    "array-numpy": {
+        "model_backend": ModelBackend.ARRAY,
+        "kernel_backend": KernelBackend.NUMPY,
+    },
+    "parallel": {"model_backend": ModelBackend.PARALLEL, "worker_count": 2},
+}
+
+
+@pytest.fixture(params=list(BACKENDS))
+def backend(request: pytest.FixtureRequest) -> str:
+    """
+    Name of the backend the model fixture uses, see BACKENDS
+    """
+    return request.param
+
+
+@pytest.fixture
+def model(backend: str) -> Iterator[SpatialPartitioningModel]:
+    """
+    A small world of every backend, filled with the game's schools and run for a few frames so that entities have spread out and wrapped around the edges
+    """
+    simulation: HeadlessSimulation = create_world(backend)
+    simulation.run(WARM_UP_FRAMES)
+    yield simulation.model
+    close_model(simulation.model)
+
+
+def create_simulation(backend: str) -> HeadlessSimulation:
+    """
+    An empty world of the given backend, whose camera sees all of it
+    """
+    return HeadlessSimulation(
+        ControllerOptions(
+            WORLD_WIDTH,
+            WORLD_HEIGHT,
+            CELL_SIZE,
+            (0, 0, 0),
+            seed=SEED,
+            **BACKENDS[backend],
+        ),
+        dt=DT,
+        camera_size=(WORLD_WIDTH, WORLD_HEIGHT),
+    )
+
+
+def create_world(backend: str) -> HeadlessSimulation:
+    """
+    The world of the model fixture before it has run any frames. It is the same for every backend
+    """
+    simulation: HeadlessSimulation = create_simulation(backend)
+    add_default_schools(
+        simulation.model,
+        True,
+        red_school_count=3,
+        red_count=40,
+        green_count=120,
+        yellow_count=120,
+    )
+    return simulation
+
+
+def close_model(model: SpatialPartitioningModel) -> None:
+    """
+    Stops the workers of a parallel model. Other models don't hold on to anything
+    """
+    if isinstance(model, ParallelArraySpatialPartitioningModel):
+        model.close()
+
+
+def run_frames(model: SpatialPartitioningModel, frames: int) -> None:
+    """
+    Advances the model like HeadlessSimulation.run does, without any input
+    """
+    for _ in range(frames):
+        model.update_model(DT, Vector2(0.0, 0.0), ScriptedKeys())
+
+
+def get_world_state(
+    model: SpatialPartitioningModel,
+) -> tuple[list[GameEntity], np.ndarray, np.ndarray]:
+    """
+    Returns every entity of the model, their positions and their group ids, for brute force checks
+    """
+    entities: list[GameEntity] = model.get_all_entities()
+    positions: np.ndarray = np.array([(e.position.x, e.position.y) for e in entities])
+    groups: np.ndarray = np.array([e.group_id for e in entities])
+    return entities, positions, groups
+
+
+def get_query_points(count: int, seed: int) -> np.ndarray:
+    """
+    Random points over the world and a margin around it, plus the world's corners, so queries reach past every edge
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    corners: np.ndarray = np.array(
+        [
+            (0.0, 0.0),
+            (WORLD_WIDTH, 0.0),
+            (0.0, WORLD_HEIGHT),
+            (WORLD_WIDTH, WORLD_HEIGHT),
+            (WORLD_WIDTH - 1.0, WORLD_HEIGHT - 1.0),
+        ]
+    )
+    return np.vstack(
+        (
+            corners,
+            rng.uniform(
+                (-150.0, -150.0),
+                (WORLD_WIDTH + 150.0, WORLD_HEIGHT + 150.0),
+                (count - len(corners), 2),
+            ),
+        )
+    )
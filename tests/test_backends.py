@@ -0,0 +1,118 @@
+import numpy as np
+import pygame
+import pytest
+from pygame import Vector2
+from pygame.key import ScancodeWrapper
+
+from controller.headless import HeadlessSimulation
+from controller.replay import InputRecorder, Recording, compute_checksum
+from model.world.flock_aggregates import AggregateSettings, ApproximationMode
+from model.world.lod import LodSettings
+from model.world.snapshot import load_snapshot, save_snapshot
+from model.world.spatial_partitioning_model import GridMode, SpatialPartitioningModel
+from tests.conftest import (
+    DT,
+    SEED,
+    WARM_UP_FRAMES,
+    close_model,
+    create_simulation,
+    create_world,
+    run_frames,
+)
+
+FRAMES: int = 30
+# Backends add up the same forces in different orders, so they only agree to rounding. After FRAMES frames they differ by about 1e-12
+TOLERANCE: float = 1e-10
+KEY_COUNT: int = 512
+
+
+def get_state(model: SpatialPartitioningModel) -> np.ndarray:
+    """
+    Position and velocity of every entity, sorted by position so that models that keep their entities in different orders can be compared
+    """
+    state: np.ndarray = model.get_entity_state()
+    return state[np.lexsort(state.T[::-1])]
+
+
+@pytest.fixture(scope="module")
+def reference_state() -> np.ndarray:
+    """
+    State of the model fixture's world after FRAMES more frames with the default backend
+    """
+    simulation: HeadlessSimulation = create_world("cell-lists")
+    simulation.run(WARM_UP_FRAMES + FRAMES)
+    return get_state(simulation.model)
+
+
+@pytest.mark.parametrize("settings", ["exact", "all-full-lod", "aggregates"])
+def test_backends_match_object_model(
+    model: SpatialPartitioningModel, reference_state: np.ndarray, settings: str
+) -> None:
+    if settings == "all-full-lod":
+        # The camera sees the whole world, so every cell is simulated at the full tier
+        model.set_lod(LodSettings())
+    elif settings == "aggregates":
+        if model.grid_mode != GridMode.CELL_LISTS:
+            pytest.skip("Cell aggregates are only kept with GridMode.CELL_LISTS")
+        # With no tolerance only cells that are wholly inside the cohere radius are summed, which changes nothing but the order of the sums
+        model.set_flocking_approximation(
+            AggregateSettings(ApproximationMode.CELL_AGGREGATES)
+        )
+    run_frames(model, FRAMES)
+    if settings == "all-full-lod":
+        assert model.tier_counts == [model.entity_count, 0, 0]
+    np.testing.assert_allclose(
+        get_state(model), reference_state, rtol=0.0, atol=TOLERANCE
+    )
+
+
+def test_snapshot_resumes_the_run(
+    model: SpatialPartitioningModel, backend: str, tmp_path
+) -> None:
+    path: str = str(tmp_path / "world.snapshot")
+    save_snapshot(model, path)
+    resumed: SpatialPartitioningModel = create_simulation(backend).model
+    load_snapshot(resumed, path, True)
+    assert resumed.tick == model.tick
+    try:
+        run_frames(model, FRAMES)
+        run_frames(resumed, FRAMES)
+        np.testing.assert_allclose(
+            get_state(resumed), get_state(model), rtol=0.0, atol=TOLERANCE
+        )
+    finally:
+        close_model(resumed)
+
+
+def test_replay_matches_recording(
+    model: SpatialPartitioningModel, backend: str, tmp_path
+) -> None:
+    # Looking keys up in a key state goes through SDL's keymap, which needs the video subsystem
+    pygame.display.init()
+    path: str = str(tmp_path / "run.replay")
+    recorder: InputRecorder = InputRecorder(path, SEED)
+    for frame in range(FRAMES):
+        pressed: list[bool] = [False] * KEY_COUNT
+        pressed[pygame.KSCAN_RIGHT] = frame < FRAMES // 2
+        pressed[pygame.KSCAN_DOWN] = frame >= FRAMES // 3
+        keys: ScancodeWrapper = ScancodeWrapper(pressed)
+        mouse_pos: tuple[int, int] = (10 * frame, 300)
+        # Some frames catch up on two simulation steps
+        steps: int = 1 + frame % 3 // 2
+        for _ in range(steps):
+            model.update_model(DT, Vector2(mouse_pos), keys)
+        recorder.record_frame(
+            DT * steps, steps, DT, mouse_pos, keys, compute_checksum(model)
+        )
+    recorder.close()
+
+    recording: Recording = Recording(path)
+    assert recording.seed == SEED
+    simulation: HeadlessSimulation = create_world(backend)
+    try:
+        simulation.run(WARM_UP_FRAMES)
+        simulation.replay(recording)
+    finally:
+        close_model(simulation.model)
+    assert recording.mismatched_frames == []
+    assert simulation.model.player.position == model.player.position
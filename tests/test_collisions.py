@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from model.world.collisions import PLAYER_LAYER, CollisionSystem, ColliderShape
+from model.world.spatial_partitioning_model import SpatialPartitioningModel
+from model.world.spatial_queries import QueryResult
+from tests.conftest import get_query_points, get_world_state
+
+COLLIDER_COUNT: int = 120
+CENTERS: np.ndarray = np.array([(100.0, 100.0), (400.0, 300.0), (900.0, 650.0)])
+
+
+def get_depths(
+    positions: np.ndarray,
+    radii: np.ndarray,
+    center: np.ndarray,
+    extent: np.ndarray,
+    circle: bool,
+) -> np.ndarray:
+    """
+    Brute force depth of every entity circle in a collider, negative where they don't touch
+    """
+    offset: np.ndarray = positions - center
+    if circle:
+        return extent[0] + radii - np.hypot(*offset.T)
+    outside: np.ndarray = offset - np.clip(offset, -extent, extent)
+    distances: np.ndarray = np.hypot(*outside.T)
+    inside: np.ndarray = distances == 0.0
+    return np.where(
+        inside,
+        radii + np.min(extent - np.abs(offset), axis=1),
+        radii - distances,
+    )
+
+
+@pytest.mark.parametrize("shape", [ColliderShape.CIRCLE, ColliderShape.BOX])
+def test_contacts_match_brute_force(
+    model: SpatialPartitioningModel, shape: ColliderShape
+) -> None:
+    model.set_collisions(True)
+    collisions: CollisionSystem = model.collisions
+    entities, positions, groups = get_world_state(model)
+    group_ids: list[int] = sorted(set(groups.tolist()))
+    # Half of the groups get a radius, the others collide with half the smaller side of their entities
+    radii: np.ndarray = np.array([min(e.width, e.height) / 2 for e in entities])
+    for i, group_id in enumerate(group_ids[::2]):
+        collisions.set_group_radius(group_id, 10.0 + 5.0 * i)
+        radii[groups == group_id] = 10.0 + 5.0 * i
+    collisions.set_layer_groups(PLAYER_LAYER, group_ids[:2])
+    collisions.set_layer_groups(1, group_ids[1:])
+    rng: np.random.Generator = np.random.default_rng(11)
+    centers: np.ndarray = get_query_points(COLLIDER_COUNT, 10)
+    extents: np.ndarray = rng.uniform(5.0, 120.0, (COLLIDER_COUNT, 2))
+    layers: np.ndarray = rng.integers(1, 3, COLLIDER_COUNT)
+    collisions.set_colliders(
+        centers, extents if shape == ColliderShape.BOX else extents[:, 0], shape, layers
+    )
+    contacts: QueryResult = collisions.detect()
+    assert len(contacts) == COLLIDER_COUNT + 1
+    assert contacts.hit_count > 0
+
+    ids: dict[int, int] = {id(entity): i for i, entity in enumerate(entities)}
+    player = model.player
+    colliders: list[tuple[np.ndarray, np.ndarray, bool, np.ndarray]] = [
+        (
+            np.array([player.position.x, player.position.y]),
+            np.array([player.width / 2, player.height / 2]),
+            False,
+            np.isin(groups, group_ids[:2]),
+        )
+    ]
+    for q in range(COLLIDER_COUNT):
+        colliders.append(
+            (
+                centers[q],
+                extents[q] if shape == ColliderShape.BOX else extents[q, :1],
+                shape == ColliderShape.CIRCLE,
+                np.isin(groups, group_ids[1:]) if layers[q] == 1 else True,
+            )
+        )
+    for q, (center, extent, circle, allowed) in enumerate(colliders):
+        depths: np.ndarray = get_depths(positions, radii, center, extent, circle)
+        hits: list[int] = [
+            ids[id(entity)] for entity in collisions.get_contact_entities(q)
+        ]
+        assert sorted(hits) == np.flatnonzero((depths >= 0.0) & allowed).tolist()
+        np.testing.assert_allclose(contacts.get_values(q), depths[hits])
+
+
+@pytest.mark.parametrize("collider_count", [2, 3])
+def test_box_extent_pair_applies_to_every_collider(
+    model: SpatialPartitioningModel, collider_count: int
+) -> None:
+    model.set_collisions(True)
+    collisions: CollisionSystem = model.collisions
+    collisions.set_colliders(CENTERS[:collider_count], (10.0, 40.0), ColliderShape.BOX)
+    np.testing.assert_array_equal(
+        collisions.extents[1 : collider_count + 1], [(10.0, 40.0)] * collider_count
+    )
+
+
+def test_circle_radii_are_per_collider(model: SpatialPartitioningModel) -> None:
+    model.set_collisions(True)
+    collisions: CollisionSystem = model.collisions
+    collisions.set_colliders(CENTERS[:2], np.array([10.0, 40.0]))
+    np.testing.assert_array_equal(collisions.extents[1:3], [(10.0, 10.0), (40.0, 40.0)])
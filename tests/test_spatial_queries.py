@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+
+from model.entities.gameentity import GameEntity
+from model.world.spatial_partitioning_model import SpatialPartitioningModel
+from model.world.spatial_queries import NearestResult, QueryResult, SpatialQueries
+from tests.conftest import WORLD_HEIGHT, WORLD_WIDTH, get_query_points, get_world_state
+
+QUERY_COUNT: int = 200
+
+
+def get_hit_ids(
+    queries: SpatialQueries, rows: np.ndarray, ids: dict[int, int]
+) -> list[int]:
+    """
+    Returns the positions in get_world_state's entity list of the entities at the given index rows
+    """
+    return [ids[id(entity)] for entity in queries.get_entities(rows)]
+
+
+def get_ids(entities: list[GameEntity]) -> dict[int, int]:
+    return {id(entity): i for i, entity in enumerate(entities)}
+
+
+@pytest.mark.parametrize("index_cell_size", [None, 40.0])
+def test_radius_matches_brute_force(
+    model: SpatialPartitioningModel, index_cell_size: float | None
+) -> None:
+    if index_cell_size is not None:
+        model.queries.set_cell_size(index_cell_size)
+    entities, positions, groups = get_world_state(model)
+    ids: dict[int, int] = get_ids(entities)
+    centers: np.ndarray = get_query_points(QUERY_COUNT, 1)
+    radii: np.ndarray = np.random.default_rng(2).uniform(0.0, 300.0, QUERY_COUNT)
+    group_ids: list[int] = sorted(set(groups.tolist()))[:2]
+    allowed: np.ndarray = np.isin(groups, group_ids)
+    result: QueryResult = model.queries.query_radius(
+        centers, radii, model.queries.get_group_mask(group_ids)
+    )
+    assert len(result) == QUERY_COUNT
+    for q in range(QUERY_COUNT):
+        distances: np.ndarray = np.hypot(*(positions - centers[q]).T)
+        expected: list[int] = np.flatnonzero((distances <= radii[q]) & allowed).tolist()
+        hits: list[int] = get_hit_ids(model.queries, result.get_rows(q), ids)
+        assert sorted(hits) == expected
+        np.testing.assert_allclose(result.get_values(q), distances[hits])
+
+
+def test_nearest_matches_brute_force(model: SpatialPartitioningModel) -> None:
+    entities, positions, _ = get_world_state(model)
+    ids: dict[int, int] = get_ids(entities)
+    centers: np.ndarray = get_query_points(QUERY_COUNT, 3)
+    k: int = 6
+    max_distance: float = 250.0
+    result: NearestResult = model.queries.query_nearest(centers, k, max_distance)
+    assert result.rows.shape == (QUERY_COUNT, k)
+    for q in range(QUERY_COUNT):
+        distances: np.ndarray = np.hypot(*(positions - centers[q]).T)
+        expected: np.ndarray = np.sort(distances)[:k]
+        expected[expected > max_distance] = np.inf
+        np.testing.assert_allclose(result.distances[q], expected)
+        found: np.ndarray = result.rows[q][result.rows[q] >= 0]
+        assert len(found) == np.count_nonzero(np.isfinite(expected))
+        np.testing.assert_allclose(
+            distances[get_hit_ids(model.queries, found, ids)],
+            result.distances[q][: len(found)],
+        )
+
+
+def test_nearest_pads_when_k_exceeds_entity_count(
+    model: SpatialPartitioningModel,
+) -> None:
+    entities, positions, _ = get_world_state(model)
+    centers: np.ndarray = get_query_points(10, 4)
+    k: int = len(entities) + 5
+    result: NearestResult = model.queries.query_nearest(centers, k)
+    assert result.rows.shape == (10, k)
+    for q in range(10):
+        expected: np.ndarray = np.sort(np.hypot(*(positions - centers[q]).T))
+        np.testing.assert_allclose(result.distances[q][: len(entities)], expected)
+        assert np.all(result.rows[q][len(entities) :] == -1)
+        assert np.all(np.isinf(result.distances[q][len(entities) :]))
+        assert sorted(result.rows[q][: len(entities)].tolist()) == list(
+            range(len(entities))
+        )
+
+
+def test_segment_matches_brute_force(model: SpatialPartitioningModel) -> None:
+    entities, positions, _ = get_world_state(model)
+    ids: dict[int, int] = get_ids(entities)
+    rng: np.random.Generator = np.random.default_rng(5)
+    starts: np.ndarray = get_query_points(QUERY_COUNT, 6)
+    ends: np.ndarray = starts + rng.uniform(-800.0, 800.0, (QUERY_COUNT, 2))
+    radius: float = 20.0
+    result: QueryResult = model.queries.query_segment(starts, ends, radius)
+    for q in range(QUERY_COUNT):
+        direction: np.ndarray = ends[q] - starts[q]
+        t: np.ndarray = np.clip(
+            (positions - starts[q]) @ direction / (direction @ direction), 0.0, 1.0
+        )
+        distances: np.ndarray = np.hypot(
+            *(positions - starts[q] - np.outer(t, direction)).T
+        )
+        hits: list[int] = get_hit_ids(model.queries, result.get_rows(q), ids)
+        assert sorted(hits) == np.flatnonzero(distances <= radius).tolist()
+        values: np.ndarray = result.get_values(q)
+        assert np.all(np.diff(values) >= 0.0)
+        np.testing.assert_allclose(values, t[hits], atol=1e-9)
+
+
+def test_aabb_matches_brute_force(model: SpatialPartitioningModel) -> None:
+    entities, positions, _ = get_world_state(model)
+    ids: dict[int, int] = get_ids(entities)
+    mins: np.ndarray = get_query_points(QUERY_COUNT, 7)
+    maxs: np.ndarray = mins + np.random.default_rng(8).uniform(
+        0.0, 400.0, (QUERY_COUNT, 2)
+    )
+    result: QueryResult = model.queries.query_aabb(mins, maxs)
+    for q in range(QUERY_COUNT):
+        inside: np.ndarray = np.all((positions >= mins[q]) & (positions <= maxs[q]), 1)
+        hits: list[int] = get_hit_ids(model.queries, result.get_rows(q), ids)
+        assert sorted(hits) == np.flatnonzero(inside).tolist()
+
+
+def test_whole_world_box_finds_every_entity(model: SpatialPartitioningModel) -> None:
+    result: QueryResult = model.queries.query_aabb(
+        (0.0, 0.0), (WORLD_WIDTH, WORLD_HEIGHT)
+    )
+    assert result.hit_count == model.entity_count
+    assert sorted(result.rows.tolist()) == list(range(model.entity_count))
+
+
+def test_result_buffers_are_reused(model: SpatialPartitioningModel) -> None:
+    centers: np.ndarray = get_query_points(QUERY_COUNT, 9)
+    result: QueryResult = model.queries.query_radius(centers, 150.0)
+    buffers: tuple[int, int] = (result.hits.ctypes.data, result.offsets.ctypes.data)
+    again: QueryResult = model.queries.query_radius(centers, 150.0)
+    assert again is result
+    assert (again.hits.ctypes.data, again.offsets.ctypes.data) == buffers
@@ -2,26 +2,38 @@ import math
 from typing import Tuple
 
 import pygame
-from pygame import Surface
+from pygame import Rect, Surface
 from pygame.font import Font
 
 
 class View:
     """
     The View is responsible for drawing everything on the screen using pygame functions, but should know nothing about the size or shape of the model it is drawing
+    :param screen: Draw onto this surface instead of opening a full screen window, for example to render offscreen. update_screen then does nothing
+    :param dirty_rects: While the background doesn't scroll, only erase, redraw and present the parts of the screen that were drawn on in the last two frames instead of the whole screen
     """
 
     def __init__(
         self,
         background_color: Tuple[int, int, int] = (0, 0, 0),
+        screen: Surface | None = None,
+        dirty_rects: bool = True,
     ):
-        # Screen sizing
-        display_info = pygame.display.Info()
-        # Display width/height currently matches world width/height and setting manually.
-        # This will eventually change to only display part of the world and run at full screen
-        self._display_width: int = display_info.current_w
-        self._display_height: int = display_info.current_h
-        self.screen: Surface = self._get_screen()
+        self.offscreen: bool = screen is not None
+        if screen is None:
+            # Screen sizing
+            display_info = pygame.display.Info()
+            # Display width/height currently matches world width/height and setting manually.
+            # This will eventually change to only display part of the world and run at full screen
+            self._display_width: int = display_info.current_w
+            self._display_height: int = display_info.current_h
+            self.screen: Surface = self._get_screen()
+        else:
+            self._display_width: int = screen.get_width()
+            self._display_height: int = screen.get_height()
+            self.screen: Surface = screen
+        # Surface.fblits (pygame-ce) skips building the list of changed rectangles that Surface.blits returns
+        self._fblits = getattr(self.screen, "fblits", None)
         # Get dimensions from created screen
         self.screen_width: int = self.screen.get_width()
         self.screen_height: int = self.screen.get_height()
@@ -29,10 +41,39 @@ class View:
         # Background variables
         self.background_color: Tuple[int, int, int] = background_color
         self.background: Surface = self._get_background()
+        # Screen sized copy of the scrolling background (see scroll_background_layer), in the pixel format of the screen
+        self.background_layer: Surface = pygame.Surface(
+            (self.screen_width, self.screen_height), 0, self.screen
+        )
+        self.background_layer_origin: Tuple[int, int] | None = None
+
+        # Dirty rectangles
+        self.dirty_rects: bool = dirty_rects
+        # Whether this frame redraws and presents the whole screen
+        self._full_redraw: bool = True
+        self._scrolled_last_frame: bool = True
+        # Whether the areas drawn on this frame are recorded
+        self._track_dirty: bool = False
+        self._dirty: list[Rect] = []
+        self._previous_dirty: list[Rect] = []
 
         # Font
         self.font: Font = pygame.font.SysFont("Arial", 48)
+        self.small_font: Font = pygame.font.SysFont("Arial", 16)
+        # The fps text is only re-rendered when the number changes
+        self._fps_value: int | None = None
+        self._fps_surface: Surface | None = None
+
+        # Profiler overlay
+        self.graph_width: int = 600
+        self.graph_height: int = 150
+        self.graph_background: Surface = pygame.Surface(
+            (self.graph_width, self.graph_height), pygame.SRCALPHA
+        )
+        self.graph_background.fill((0, 0, 0, 160))
 
+        if self.offscreen:
+            return
         print(
             "Initialized view with pygame screen Surface dimensions: ",
             self.screen_width,
@@ -60,15 +101,132 @@ class View:
     def draw_background(self, destination: Tuple[int, int] = (0, 0)) -> None:
         self.screen.blit(self.background, destination)
 
+    def scroll_background_layer(self, origin: Tuple[int, int]) -> list[Rect]:
+        """
+        Moves the background layer so that its top left corner is at origin, in the same pixel coordinates the caller draws the background in.
+        The pixels that are still on screen are scrolled in place, and the returned rectangles (in screen coordinates) are the parts that scrolled in and have to be drawn with draw_background_region.
+        Everything is returned the first time or when the layer scrolled by more than a screen.\n
+        Also decides whether this frame is presented with dirty rectangles, which is only done when the background didn't scroll in this or the last frame
+        """
+        previous: Tuple[int, int] | None = self.background_layer_origin
+        self.background_layer_origin = origin
+        scrolled: bool = previous != origin
+        self._full_redraw = (
+            not self.dirty_rects or scrolled or self._scrolled_last_frame
+        )
+        self._scrolled_last_frame = scrolled
+        self._track_dirty = self.dirty_rects and not scrolled
+        self._dirty = []
+        if not scrolled:
+            return []
+        full: Rect = Rect(0, 0, self.screen_width, self.screen_height)
+        if previous is None:
+            return [full]
+        dx: int = origin[0] - previous[0]
+        dy: int = origin[1] - previous[1]
+        if abs(dx) >= self.screen_width or abs(dy) >= self.screen_height:
+            return [full]
+        self.background_layer.scroll(-dx, -dy)
+        exposed: list[Rect] = []
+        # Columns that scrolled in on the left or right, over the full height
+        if dx > 0:
+            exposed.append(Rect(self.screen_width - dx, 0, dx, self.screen_height))
+        elif dx < 0:
+            exposed.append(Rect(0, 0, -dx, self.screen_height))
+        # Rows that scrolled in at the top or bottom, without the columns above
+        x: int = max(-dx, 0)
+        width: int = self.screen_width - abs(dx)
+        if dy > 0:
+            exposed.append(Rect(x, self.screen_height - dy, width, dy))
+        elif dy < 0:
+            exposed.append(Rect(x, 0, width, -dy))
+        return exposed
+
+    def draw_background_region(
+        self, region: Rect, blit_sequence: list[Tuple[Surface, Tuple[float, float]]]
+    ) -> None:
+        """
+        Draws surfaces onto the background layer, clipped to region
+        """
+        self.background_layer.set_clip(region)
+        self.background_layer.blits(blit_sequence, False)
+        self.background_layer.set_clip(None)
+
+    def draw_background_layer(self) -> None:
+        """
+        Copies the background layer to the screen. With dirty rectangles only the parts drawn on in the last frame are restored
+        """
+        if self._full_redraw:
+            self.screen.blit(self.background_layer, (0, 0))
+            return
+        for rect in self._previous_dirty:
+            self.screen.blit(self.background_layer, rect, rect)
+
     def draw_surface(self, surface: Surface, dest: Tuple[float, float]) -> None:
-        self.screen.blit(surface, dest)
+        rect: Rect = self.screen.blit(surface, dest)
+        if self._track_dirty:
+            self._dirty.append(rect)
+
+    def draw_surfaces(
+        self, blit_sequence: list[Tuple[Surface, Tuple[float, float]]]
+    ) -> None:
+        """
+        Draws a whole list of (surface, destination) pairs with one call. Blitting goes fastest when pairs with the same surface are next to each other
+        """
+        if self._track_dirty:
+            self._dirty.extend(self.screen.blits(blit_sequence))
+        elif self._fblits is not None:
+            self._fblits(blit_sequence)
+        else:
+            self.screen.blits(blit_sequence, False)
 
     def print_fps(self, fps: float) -> None:
-        fps_surface: Surface = self.font.render(
-            str(math.floor(fps)), True, (255, 255, 255)
+        value: int = math.floor(fps)
+        if value != self._fps_value:
+            self._fps_value = value
+            self._fps_surface = self.font.render(str(value), True, (255, 255, 255))
+        self.draw_surface(self._fps_surface, (0, 0))
+
+    def render_text_lines(self, lines: list[str]) -> list[Surface]:
+        """
+        Renders lines of text with the small font. Rendering text is slow, so the result should be kept and redrawn with draw_text_lines for as long as the text doesn't change
+        """
+        return [self.small_font.render(line, True, (255, 255, 255)) for line in lines]
+
+    def draw_text_lines(
+        self, text_surfaces: list[Surface], dest: Tuple[int, int]
+    ) -> None:
+        x, y = dest
+        for text_surface in text_surfaces:
+            self.draw_surface(text_surface, (x, y))
+            y += text_surface.get_height()
+
+    def draw_frame_graph(self, frame_ms: list[float], target_ms: float) -> None:
+        """
+        Draws a line graph of frame times in the bottom left corner of the screen, newest frame on the right, with a horizontal line at target_ms
+        """
+        left: int = 0
+        top: int = self.screen_height - self.graph_height
+        self.draw_surface(self.graph_background, (left, top))
+        # Scale so that the target line sits at half height, unless frames are slower than twice the target
+        scale_ms: float = max(target_ms * 2, max(frame_ms, default=0.0))
+        target_y: float = top + self.graph_height * (1 - target_ms / scale_ms)
+        pygame.draw.line(
+            self.screen, (255, 80, 80), (left, target_y), (self.graph_width, target_y)
         )
-        self.screen.blit(fps_surface, fps_surface.get_rect(x=0, y=0))
+        if len(frame_ms) < 2:
+            return
+        step: float = self.graph_width / (len(frame_ms) - 1)
+        points: list[Tuple[float, float]] = [
+            (left + i * step, top + self.graph_height * (1 - ms / scale_ms))
+            for i, ms in enumerate(frame_ms)
+        ]
+        pygame.draw.lines(self.screen, (80, 255, 80), False, points)
 
-    @staticmethod
-    def update_screen() -> None:
-        pygame.display.update()
+    def update_screen(self) -> None:
+        if not self.offscreen:
+            if self._full_redraw:
+                pygame.display.update()
+            else:
+                pygame.display.update(self._previous_dirty + self._dirty)
+        self._previous_dirty = self._dirty